@@ -1,6 +1,6 @@
 import frappe
 from frappe import _
-from frappe.utils import getdate, add_days, nowdate
+from frappe.utils import getdate, add_days, nowdate, cint
 import json
 
 @frappe.whitelist()
@@ -246,46 +246,18 @@ def get_timeseries_data(from_date, to_date):
     return daily_data
 
 @frappe.whitelist()
-def get_visitor_journey(visitor_id):
-    """Get complete journey for a visitor"""
+def get_visitor_journey(visitor_id, cursor=None, limit=50):
+    """Get a visitor's journey, newest first, one page at a time"""
     try:
-        # Get all touchpoints
-        touchpoints = frappe.db.sql("""
-            SELECT
-                'click' as type,
-                click_timestamp as timestamp,
-                tracked_link,
-                utm_source,
-                utm_medium,
-                utm_campaign,
-                page_url,
-                referrer
-            FROM `tabClick Event`
-            WHERE visitor_id = %s
+        from trackflow.journey import get_journey, get_journey_bounds
 
-            UNION ALL
+        page = get_journey(visitor_id, cursor=cursor, limit=limit)
+        first_seen, last_seen = get_journey_bounds(visitor_id)
 
-            SELECT
-                'conversion' as type,
-                conversion_timestamp as timestamp,
-                tracked_link,
-                NULL as utm_source,
-                NULL as utm_medium,
-                campaign as utm_campaign,
-                NULL as page_url,
-                NULL as referrer
-            FROM `tabConversion`
-            WHERE visitor_id = %s
-            
-            ORDER BY timestamp
-        """, (visitor_id, visitor_id), as_dict=True)
-        
-        # Get visitor info
         visitor_info = {
             "id": visitor_id,
-            "first_seen": touchpoints[0]["timestamp"] if touchpoints else None,
-            "last_seen": touchpoints[-1]["timestamp"] if touchpoints else None,
-            "total_touchpoints": len(touchpoints)
+            "first_seen": first_seen,
+            "last_seen": last_seen
         }
         
         # Check if converted
@@ -305,13 +277,50 @@ def get_visitor_journey(visitor_id):
             
         return {
             "visitor": visitor_info,
-            "journey": touchpoints
+            "journey": page["touchpoints"],
+            "has_more": page["has_more"],
+            "next_cursor": page["next_cursor"]
         }
         
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "Get Visitor Journey Error")
         return {"status": "error", "message": str(e)}
 
+@frappe.whitelist()
+def get_cohort_retention(campaign=None, from_date=None, to_date=None, periods=12, refresh=0):
+    """Weekly first-click cohorts with repeat-click and conversion counts"""
+    try:
+        from trackflow.cohort import get_cohort_matrix
+
+        return get_cohort_matrix(
+            campaign=campaign,
+            from_date=from_date,
+            to_date=to_date,
+            periods=cint(periods),
+            refresh=cint(refresh),
+        )
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Get Cohort Retention Error")
+        return {"status": "error", "message": str(e)}
+
+@frappe.whitelist()
+def get_attribution_comparison(from_date=None, to_date=None, campaign=None, refresh=0):
+    """Credited revenue per campaign and channel under every active attribution model"""
+    try:
+        from trackflow.attribution_comparison import get_attribution_comparison
+
+        return get_attribution_comparison(
+            from_date=from_date,
+            to_date=to_date,
+            campaign=campaign,
+            refresh=cint(refresh),
+        )
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Get Attribution Comparison Error")
+        return {"status": "error", "message": str(e)}
+
 @frappe.whitelist()
 def export_analytics(format="csv", **kwargs):
     """Export analytics data"""
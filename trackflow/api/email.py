@@ -1,25 +1,45 @@
 import frappe
 from frappe import _
 import base64
+import hashlib
+import hmac
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from html import escape
+from urllib.parse import urlencode
 from bs4 import BeautifulSoup
-from frappe.utils import now
+from frappe.utils import get_datetime
+from frappe.utils.password import get_encryption_key
+
+from trackflow.email_tracking import (
+    buffer_email_event,
+    get_campaign_engagement,
+    get_recipient_id,
+    record_email_sends,
+)
+from trackflow.rate_limit import check_rate_limit
 
 # 1x1 transparent pixel GIF
 PIXEL_GIF = "R0lGODlhAQABAIAAAAAAAP///yH5BAEAAAAALAAAAAABAAEAAAIBRAA7"
 
+# Sends at least this large are rendered in a process pool and queued directly
+POOL_THRESHOLD = 2000
+POOL_WORKERS = 4
+RENDER_CHUNK_SIZE = 500
+
+SEND_COMMIT_SIZE = 500
+SEND_TIMEOUT = 3600
+
 @frappe.whitelist(allow_guest=True)
-def track_email_open(campaign_id, recipient_id):
+def track_email_open(campaign_id, recipient_id, sig=None):
     """Track email opens via 1x1 pixel"""
     try:
-        # Log email open
-        log = frappe.new_doc("Email Campaign Log")
-        log.event_type = "opened"
-        log.recipient_id = recipient_id
-        log.timestamp = now()
-        log.ip_address = frappe.local.request_ip
-        log.user_agent = frappe.request.headers.get("User-Agent", "")
-        log.insert(ignore_permissions=True)
-        frappe.db.commit()
+        # Buffered; a scheduled job writes the counters
+        recipient_id = verify_recipient(campaign_id, recipient_id, sig)
+        if recipient_id and check_rate_limit("email_open", f"{campaign_id}:{recipient_id}")[0]:
+            buffer_request_event("opened", campaign_id, recipient_id)
         
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "Email Open Tracking Error")
@@ -31,64 +51,162 @@ def track_email_open(campaign_id, recipient_id):
     frappe.response["content_type"] = "image/gif"
 
 @frappe.whitelist(allow_guest=True)
-def track_email_click(campaign_id, recipient_id, link_id):
+def track_email_click(campaign_id, recipient_id, link_id, sig=None):
     """Track email link clicks and redirect"""
     try:
-        # Log email click
-        log = frappe.new_doc("Email Campaign Log")
-        log.event_type = "clicked"
-        log.recipient_id = recipient_id
-        log.tracking_link = link_id
-        log.timestamp = now()
-        log.ip_address = frappe.local.request_ip
-        log.insert(ignore_permissions=True)
-        
-        # Get actual link URL
-        link = frappe.get_doc("Tracked Link", link_id)
-        target_url = link.target_url
-        
-        frappe.db.commit()
+        # The link is shared, the signed recipient says who clicked
+        target_url = frappe.get_cached_value("Tracked Link", link_id, "target_url")
+        recipient_id = verify_recipient(campaign_id, recipient_id, sig)
+        if target_url and recipient_id and check_rate_limit("email_click", f"{campaign_id}:{recipient_id}")[0]:
+            buffer_request_event("clicked", campaign_id, recipient_id, link_id)
         
         # Redirect to target
         frappe.local.response["type"] = "redirect"
-        frappe.local.response["location"] = target_url
+        frappe.local.response["location"] = target_url or "/"
         
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "Email Click Tracking Error")
         frappe.local.response["type"] = "redirect"
         frappe.local.response["location"] = "/"
 
-def wrap_email_links(html_content, campaign_id, recipient_id):
+def buffer_request_event(event_type, campaign_id, recipient_id, link_id=None):
+    """Buffer an open or click along with the visitor behind the request"""
+    request = frappe.request
+    buffer_email_event(
+        event_type,
+        campaign_id,
+        recipient_id,
+        link_id,
+        ip_address=frappe.local.request_ip,
+        user_agent=request.headers.get("User-Agent", "") if request else "",
+        visitor=request.cookies.get("trackflow_visitor") if request else None,
+    )
+
+def sign_recipient(campaign_id, recipient_id, key=None):
+    """Signature binding a recipient to a campaign in tracking URLs"""
+    message = f"{campaign_id}:{recipient_id}".encode()
+    return hmac.new((key or get_encryption_key()).encode(), message, hashlib.sha256).hexdigest()[:16]
+
+def verify_recipient(campaign_id, recipient_id, sig=None):
+    """Recipient from a tracking URL, or None if it cannot be trusted
+
+    URLs sent before recipients were signed carry no signature. They are
+    only accepted for campaigns created before the cutover in TrackFlow
+    Settings, since no later send produces them.
+    """
+    if not recipient_id:
+        return None
+    if sig:
+        expected = sign_recipient(campaign_id, recipient_id).encode()
+        return recipient_id if hmac.compare_digest(expected, str(sig).encode()) else None
+    return recipient_id if is_legacy_campaign(campaign_id) else None
+
+def is_legacy_campaign(campaign_id):
+    """Whether ``campaign_id`` was created before unsigned URLs were retired"""
+    cutover = frappe.db.get_single_value("TrackFlow Settings", "unsigned_email_links_before")
+    if not cutover or not campaign_id:
+        return False
+    
+    created = frappe.db.get_value("Link Campaign", campaign_id, "creation")
+    return bool(created) and get_datetime(created) < get_datetime(cutover)
+
+def get_email_tracked_link(campaign_id, url, links=None):
+    """The Tracked Link shared by every recipient for (campaign, destination URL)
+
+    ``links`` memoises lookups across the recipients of one send.
+    """
+    key = (campaign_id, url)
+    if links is not None and key in links:
+        return links[key]
+
+    name = frappe.db.get_value(
+        "Tracked Link",
+        {"campaign": campaign_id, "target_url": url, "source": "email", "medium": "email"},
+        "name"
+    )
+    if not name:
+        tracked_link = frappe.new_doc("Tracked Link")
+        tracked_link.target_url = url
+        tracked_link.campaign = campaign_id
+        tracked_link.source = "email"
+        tracked_link.medium = "email"
+        # Email links are never printed; skip the QR image
+        tracked_link.flags.skip_qr = True
+        tracked_link.insert(ignore_permissions=True)
+        name = tracked_link.name
+
+    if links is not None:
+        links[key] = name
+    return name
+
+def get_tracking_url(method, **params):
+    return f"{frappe.utils.get_url()}/api/method/trackflow.api.email.{method}?{urlencode(params)}"
+
+class EmailTemplate:
+    """Email HTML compiled once per send and rendered per recipient
+
+    ``parts`` are the static fragments of the rewritten HTML and ``slots``
+    the tracking URL, up to its recipient parameters, that goes between
+    each pair of them. Rendering only signs the recipient and joins
+    strings. Templates are plain data, so they can be sent to pool workers.
+    """
+
+    def __init__(self, campaign_id, parts, slots, key):
+        self.campaign_id = campaign_id
+        self.parts = parts
+        self.slots = slots
+        self.key = key
+
+    def render(self, recipient_id):
+        sig = sign_recipient(self.campaign_id, recipient_id, self.key)
+        recipient_params = escape(urlencode({"recipient_id": recipient_id, "sig": sig}))
+
+        html = [self.parts[0]]
+        for slot, part in zip(self.slots, self.parts[1:]):
+            html += (slot, recipient_params, part)
+        return "".join(html)
+
+    def render_recipients(self, recipients):
+        return [self.render(get_recipient_id(self.campaign_id, recipient)) for recipient in recipients]
+
+def compile_email_template(html_content, campaign_id, links=None, pixel=True):
+    """Parse and rewrite ``html_content`` once into an EmailTemplate
+
+    Every trackable link points at its shared Tracked Link and, with
+    ``pixel``, the open-tracking pixel is added before the closing body tag.
+    """
+    soup = BeautifulSoup(html_content, 'html.parser')
+    # Placeholder for the recipient-specific URLs; random so the content cannot contain it
+    marker = f"trackflow-{frappe.generate_hash(length=10)}-"
+    slot_urls = []
+
+    for link in soup.find_all('a'):
+        if 'href' not in link.attrs:
+            continue
+
+        original_url = link['href']
+
+        # Skip unsubscribe and system links
+        if 'unsubscribe' in original_url.lower() or 'mailto:' in original_url:
+            continue
+
+        link_id = get_email_tracked_link(campaign_id, original_url, links)
+        link['href'] = f"{marker}{len(slot_urls)}"
+        slot_urls.append(get_tracking_url("track_email_click", campaign_id=campaign_id, link_id=link_id))
+
+    html = str(soup)
+    if pixel:
+        html = add_pixel_html(html, f"{marker}{len(slot_urls)}")
+        slot_urls.append(get_tracking_url("track_email_open", campaign_id=campaign_id))
+
+    pieces = re.split(re.escape(marker) + r"(\d+)", html)
+    slots = [escape(slot_urls[int(slot)]) + "&amp;" for slot in pieces[1::2]]
+    return EmailTemplate(campaign_id, pieces[0::2], slots, get_encryption_key())
+
+def wrap_email_links(html_content, campaign_id, recipient_id, links=None):
     """Wrap all links in email for tracking"""
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
-        for link in soup.find_all('a'):
-            if 'href' not in link.attrs:
-                continue
-                
-            original_url = link['href']
-            
-            # Skip unsubscribe and system links
-            if 'unsubscribe' in original_url.lower() or 'mailto:' in original_url:
-                continue
-                
-            # Create tracked link
-            tracked_link = frappe.new_doc("Tracked Link")
-            tracked_link.target_url = original_url
-            tracked_link.campaign = campaign_id
-            tracked_link.source = "email"
-            tracked_link.medium = "email"
-            tracked_link.is_active = 1
-            tracked_link.insert(ignore_permissions=True)
-            
-            # Generate tracking URL
-            track_url = f"{frappe.utils.get_url()}/api/method/trackflow.api.email.track_email_click"
-            track_url += f"?campaign_id={campaign_id}&recipient_id={recipient_id}&link_id={tracked_link.name}"
-            
-            link['href'] = track_url
-            
-        return str(soup)
+        return compile_email_template(html_content, campaign_id, links, pixel=False).render(recipient_id)
         
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "Email Link Wrapping Error")
@@ -96,10 +214,16 @@ def wrap_email_links(html_content, campaign_id, recipient_id):
 
 def add_tracking_pixel(html_content, campaign_id, recipient_id):
     """Add tracking pixel to email"""
-    pixel_url = f"{frappe.utils.get_url()}/api/method/trackflow.api.email.track_email_open"
-    pixel_url += f"?campaign_id={campaign_id}&recipient_id={recipient_id}"
-    
-    pixel_html = f'<img src="{pixel_url}" width="1" height="1" style="display:none;" />'
+    pixel_url = get_tracking_url(
+        "track_email_open",
+        campaign_id=campaign_id,
+        recipient_id=recipient_id,
+        sig=sign_recipient(campaign_id, recipient_id),
+    )
+    return add_pixel_html(html_content, escape(pixel_url))
+
+def add_pixel_html(html_content, src):
+    pixel_html = f'<img src="{src}" width="1" height="1" style="display:none;" />'
     
     # Add before closing body tag
     if '</body>' in html_content:
@@ -107,37 +231,78 @@ def add_tracking_pixel(html_content, campaign_id, recipient_id):
     else:
         return html_content + pixel_html
 
+# Template shared by the recipients rendered in one pool worker
+_worker_template = None
+
+def _init_render_worker(template):
+    global _worker_template
+    _worker_template = template
+
+def _render_chunk(recipients):
+    return _worker_template.render_recipients(recipients)
+
+def render_tracked_emails(template, recipients):
+    """Yield (recipient, html) for each recipient, in order
+
+    Sends of POOL_THRESHOLD recipients or more are rendered in chunks by a
+    process pool. At most a few chunks are in flight at once, so memory
+    stays bounded however fast the consumer drains them.
+    """
+    recipients = list(recipients)
+    if len(recipients) < POOL_THRESHOLD:
+        for recipient in recipients:
+            yield recipient, template.render(get_recipient_id(template.campaign_id, recipient))
+        return
+
+    workers = min(POOL_WORKERS, os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker, initargs=(template,)) as pool:
+        pending = deque()
+        for i in range(0, len(recipients), RENDER_CHUNK_SIZE):
+            chunk = recipients[i:i + RENDER_CHUNK_SIZE]
+            pending.append((chunk, pool.submit(_render_chunk, chunk)))
+            if len(pending) > 2 * workers:
+                chunk, rendered = pending.popleft()
+                yield from zip(chunk, rendered.result())
+
+        while pending:
+            chunk, rendered = pending.popleft()
+            yield from zip(chunk, rendered.result())
+
+def get_email_campaign(campaign_name):
+    """The Link Campaign for an email send, created on first use"""
+    if frappe.db.exists("Link Campaign", campaign_name):
+        return frappe.get_doc("Link Campaign", campaign_name)
+
+    campaign = frappe.new_doc("Link Campaign")
+    campaign.campaign_name = campaign_name
+    campaign.campaign_type = "Email"
+    campaign.start_date = frappe.utils.nowdate()
+    campaign.status = "Active"
+    campaign.insert()
+    return campaign
+
 @frappe.whitelist()
 def prepare_tracked_email(subject, content, recipients, campaign_name):
-    """Prepare email with tracking"""
+    """Prepare email with tracking
+
+    Sends of POOL_THRESHOLD recipients or more are not returned; they are
+    queued like ``send_tracked_email``.
+    """
     try:
-        # Create or get campaign
-        if not frappe.db.exists("Link Campaign", campaign_name):
-            campaign = frappe.new_doc("Link Campaign")
-            campaign.campaign_name = campaign_name
-            campaign.campaign_type = "Email"
-            campaign.start_date = frappe.utils.nowdate()
-            campaign.status = "Active"
-            campaign.insert()
-        else:
-            campaign = frappe.get_doc("Link Campaign", campaign_name)
-            
-        tracked_emails = []
-        
-        for recipient in recipients:
-            # Generate unique recipient ID
-            import hashlib
-            recipient_id = hashlib.md5(f"{campaign.name}_{recipient}".encode()).hexdigest()[:8]
-            
-            # Wrap links and add pixel
-            tracked_content = wrap_email_links(content, campaign.name, recipient_id)
-            tracked_content = add_tracking_pixel(tracked_content, campaign.name, recipient_id)
-            
-            tracked_emails.append({
-                "recipient": recipient,
-                "subject": subject,
-                "content": tracked_content
-            })
+        recipients = frappe.parse_json(recipients) if isinstance(recipients, str) else recipients
+        campaign = get_email_campaign(campaign_name)
+
+        if len(recipients) >= POOL_THRESHOLD:
+            enqueue_tracked_email(subject, content, recipients, campaign.name)
+            return {"status": "queued", "campaign": campaign.name, "recipients": len(recipients)}
+
+        # Parse once; one Tracked Link per destination URL, shared by all recipients
+        template = compile_email_template(content, campaign.name)
+        record_email_sends(campaign.name, recipients)
+        tracked_emails = [
+            {"recipient": recipient, "subject": subject, "content": tracked_content}
+            for recipient, tracked_content in render_tracked_emails(template, recipients)
+        ]
             
         return {
             "status": "success",
@@ -150,41 +315,58 @@ def prepare_tracked_email(subject, content, recipients, campaign_name):
         return {"status": "error", "message": str(e)}
 
 @frappe.whitelist()
-def get_email_campaign_stats(campaign):
-    """Get email campaign statistics"""
+def send_tracked_email(subject, content, recipients, campaign_name):
+    """Queue one tracked email per recipient to the mail queue in the background"""
     try:
-        stats = frappe.db.sql("""
-            SELECT
-                event_type,
-                COUNT(*) as count,
-                COUNT(DISTINCT recipient_id) as unique_recipients
-            FROM `tabEmail Campaign Log`
-            WHERE recipient_id IS NOT NULL
-            GROUP BY event_type
-        """, as_dict=True)
-        
-        result = {
-            "sent": 0,
-            "opened": 0,
-            "clicked": 0,
-            "open_rate": 0,
-            "click_rate": 0
-        }
-        
-        for stat in stats:
-            if stat.event_type == "sent":
-                result["sent"] = stat.count
-            elif stat.event_type == "opened":
-                result["opened"] = stat.unique_recipients
-            elif stat.event_type == "clicked":
-                result["clicked"] = stat.unique_recipients
-                
-        # Calculate rates
-        if result["sent"] > 0:
-            result["open_rate"] = (result["opened"] / result["sent"] * 100)
-            result["click_rate"] = (result["clicked"] / result["sent"] * 100)
-            
-        return result
+        recipients = frappe.parse_json(recipients) if isinstance(recipients, str) else recipients
+        campaign = get_email_campaign(campaign_name)
+        enqueue_tracked_email(subject, content, recipients, campaign.name)
+        return {"status": "queued", "campaign": campaign.name, "recipients": len(recipients)}
+
+    except Exception as e:
+        frappe.log_error(frappe.get_traceback(), "Send Tracked Email Error")
+        return {"status": "error", "message": str(e)}
+
+def enqueue_tracked_email(subject, content, recipients, campaign):
+    frappe.enqueue(
+        "trackflow.api.email.queue_tracked_email",
+        queue="long",
+        timeout=SEND_TIMEOUT,
+        enqueue_after_commit=True,
+        subject=subject,
+        content=content,
+        recipients=list(recipients),
+        campaign=campaign,
+    )
+
+def queue_tracked_email(subject, content, recipients, campaign):
+    """Background job: stream rendered tracked emails into the mail queue"""
+    template = compile_email_template(content, campaign)
+    frappe.db.commit()
+
+    sent = []
+    for recipient, tracked_content in render_tracked_emails(template, recipients):
+        frappe.sendmail(
+            recipients=[recipient],
+            subject=subject,
+            message=tracked_content,
+            reference_doctype="Link Campaign",
+            reference_name=campaign,
+        )
+        sent.append(recipient)
+        if len(sent) >= SEND_COMMIT_SIZE:
+            record_email_sends(campaign, sent)
+            frappe.db.commit()
+            sent = []
+
+    record_email_sends(campaign, sent)
+    frappe.db.commit()
+
+@frappe.whitelist()
+def get_email_campaign_stats(campaign, from_date=None, to_date=None):
+    """Get email campaign statistics from the daily engagement rollups"""
+    try:
+        return get_campaign_engagement(campaign, from_date, to_date)
         
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "Get Email Stats Error")
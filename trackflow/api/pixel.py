@@ -1,6 +1,9 @@
 import frappe
 from frappe import _
 
+from trackflow.rate_limit import check_rate_limit
+from trackflow.trackflow.utils.error_handler import get_client_ip
+
 @frappe.whitelist(allow_guest=True)
 def pixel():
     """
@@ -9,7 +12,7 @@ def pixel():
     # Track the pixel request
     try:
         visitor_id = frappe.local.request.args.get("v")
-        if visitor_id:
+        if visitor_id and check_rate_limit("pixel", get_client_ip())[0]:
             from trackflow.tracking import track_event
             track_event(
                 visitor_id=visitor_id,
@@ -1,30 +1,60 @@
 import frappe
 from frappe import _
+import hashlib
 import json
+from datetime import datetime, timezone
+from werkzeug.wrappers import Response
+
+from trackflow.geo import set_geo_fields
+from trackflow.ip_filter import is_internal_traffic
+from trackflow.rate_limit import check_rate_limit
 from trackflow.trackflow.utils import (
     generate_visitor_id,
     get_visitor_from_request,
     set_visitor_cookie,
-    parse_user_agent,
 )
+from trackflow.user_agent import set_user_agent_fields
 from trackflow.trackflow.utils.error_handler import (
     handle_error,
     validate_required_fields,
     validate_url,
     sanitize_input,
     get_client_ip,
-    rate_limit_check,
     ValidationError,
     TrackingError,
 )
 
+# Largest batch accepted by track_events
+MAX_BATCH_EVENTS = 50
+
+# Oldest client timestamp accepted for a buffered event, in seconds
+MAX_EVENT_AGE = 3600
+
+# Visitor attribution fields filled from the UTM parameters the script sends
+UTM_FIELDS = {
+    "utm_source": "source",
+    "utm_medium": "medium",
+    "utm_campaign": "campaign",
+    "utm_term": "term",
+    "utm_content": "content",
+}
+
+SCRIPT_CACHE_KEY = "trackflow:tracking_script"
+SCRIPT_TAG_START = "<!-- TrackFlow Analytics -->"
+SCRIPT_TAG_END = "<!-- End TrackFlow Analytics -->"
+SCRIPT_MAX_AGE = 3600
+VERSIONED_SCRIPT_MAX_AGE = 365 * 24 * 3600
+
 @frappe.whitelist(allow_guest=True)
 @handle_error(error_type="Event Tracking")
 def track_event():
     """Track custom events from frontend"""
-    # Rate limiting
     client_ip = get_client_ip()
-    allowed, remaining = rate_limit_check(f"track_event:{client_ip}", limit=1000, window=3600)
+    if is_internal_traffic(client_ip):
+        return {"status": "excluded", "message": _("Internal traffic is not tracked")}
+    
+    # Rate limiting
+    allowed, remaining = check_rate_limit("track_event", client_ip)
     
     if not allowed:
         raise TrackingError(_("Rate limit exceeded. Please try again later."), error_code="RATE_LIMIT_EXCEEDED")
@@ -91,6 +121,154 @@ def track_event():
         "remaining_requests": remaining
     }
 
+@frappe.whitelist(allow_guest=True)
+@handle_error(error_type="Event Tracking")
+def track_events():
+    """Track a batch of events sent by the tracking script's beacon
+    
+    The body is ``{"visitor_id": ..., "events": [...]}``. Beacons are sent
+    as text/plain to avoid a CORS preflight, so the body is read raw.
+    """
+    data = json.loads(frappe.request.data or '{}')
+    events = data.get("events") if isinstance(data, dict) else None
+    
+    if not events or not isinstance(events, list):
+        raise ValidationError(_("No events provided"))
+    if len(events) > MAX_BATCH_EVENTS:
+        raise ValidationError(_("At most {0} events per batch").format(MAX_BATCH_EVENTS))
+    
+    # Each event counts against the same budget as a single track_event call
+    client_ip = get_client_ip()
+    if is_internal_traffic(client_ip):
+        return {"status": "excluded", "message": _("Internal traffic is not tracked")}
+    
+    allowed, remaining = check_rate_limit("track_event", client_ip, cost=len(events))
+    
+    if not allowed:
+        raise TrackingError(_("Rate limit exceeded. Please try again later."), error_code="RATE_LIMIT_EXCEEDED")
+    
+    visitor_id = frappe.request.cookies.get("trackflow_visitor") or data.get("visitor_id")
+    if isinstance(visitor_id, str):
+        visitor_id = frappe.utils.strip_html_tags(visitor_id)[:140]
+    if not visitor_id or not isinstance(visitor_id, str):
+        visitor_id = generate_visitor_id()
+    
+    # One visitor lookup for the whole batch
+    visitor = get_or_create_visitor(visitor_id, client_ip)
+    
+    rows = [row for row in (build_event_row(visitor, event) for event in events) if row]
+    if rows:
+        insert_visitor_events(visitor, rows)
+        frappe.db.commit()
+    
+    return {
+        "status": "success",
+        "visitor_id": visitor_id,
+        "accepted": len(rows),
+        "remaining_requests": remaining
+    }
+
+def build_event_row(visitor, event):
+    """Validated Visitor Event values for one beaconed event, or None"""
+    event = sanitize_input(event, max_length=1000)
+    if not event:
+        return None
+    
+    try:
+        url = validate_url(event["url"]) if event.get("url") else ""
+    except ValidationError:
+        return None
+    
+    event_type = event.get("event_type") or "pageview"
+    if not isinstance(event_type, str):
+        return None
+    
+    properties = event.get("properties")
+    if not isinstance(properties, dict):
+        properties = {}
+    
+    return frappe._dict(
+        name=frappe.generate_hash(length=10),
+        visitor=visitor,
+        event_type=event_type[:140],
+        event_category=str(properties.get("category") or "custom")[:140],
+        url=url[:140],
+        timestamp=get_event_timestamp(event.get("ts")),
+        event_data=json.dumps(properties),
+        attribution=get_event_attribution(event),
+    )
+
+def get_event_attribution(event):
+    """Visitor attribution fields from an event's referrer and UTM parameters"""
+    attribution = frappe._dict()
+    for param, fieldname in UTM_FIELDS.items():
+        if event.get(param) and isinstance(event[param], str):
+            attribution[fieldname] = event[param][:140]
+    
+    if event.get("referrer"):
+        try:
+            attribution.referrer = validate_url(event["referrer"])[:140]
+        except ValidationError:
+            pass
+    return attribution
+
+def get_event_timestamp(ts):
+    """When a buffered event happened, from the client's epoch milliseconds
+    
+    Clocks are not trusted beyond MAX_EVENT_AGE in the past or any time in
+    the future; such events are stamped with the server time.
+    """
+    now = frappe.utils.now_datetime()
+    try:
+        # Epoch time is UTC; stored datetimes are in the site's system timezone
+        happened = datetime.fromtimestamp(int(ts) / 1000, timezone.utc).replace(tzinfo=None)
+        happened = frappe.utils.convert_utc_to_system_timezone(happened).replace(tzinfo=None)
+    except (TypeError, ValueError, OverflowError, OSError):
+        return now
+    if happened > now or (now - happened).total_seconds() > MAX_EVENT_AGE:
+        return now
+    return happened
+
+def insert_visitor_events(visitor, rows):
+    """Insert a batch of Visitor Events and update the visitor once"""
+    from trackflow.journey import PAGE_VIEW_EVENTS, _from_visitor_event, record_touchpoints
+    
+    now = frappe.utils.now()
+    fields = ["name", "creation", "modified", "owner", "modified_by",
+              "visitor", "event_type", "event_category", "url", "timestamp", "event_data"]
+    frappe.db.bulk_insert("Visitor Event", fields, [
+        (row.name, now, now, "Guest", "Guest",
+         row.visitor, row.event_type, row.event_category, row.url, row.timestamp, row.event_data)
+        for row in rows
+    ])
+    
+    # The after_insert hook does not run for bulk inserts
+    record_touchpoints([
+        dict(_from_visitor_event(row), reference_doctype="Visitor Event", reference_name=row.name)
+        for row in rows
+    ])
+    
+    frappe.db.sql("""
+        UPDATE `tabVisitor`
+        SET last_seen = %s, page_views = IFNULL(page_views, 0) + %s
+        WHERE name = %s
+    """, (now, sum(1 for row in rows if row.event_type in PAGE_VIEW_EVENTS), visitor))
+    
+    first_touch = next((row.attribution for row in rows if row.get("attribution")), None)
+    if first_touch:
+        set_first_touch(visitor, first_touch)
+
+def set_first_touch(visitor, attribution):
+    """Store where a visitor came from, unless it is already known"""
+    assignments = ", ".join(f"`{fieldname}` = %({fieldname})s" for fieldname in attribution)
+    frappe.db.sql(f"""
+        UPDATE `tabVisitor`
+        SET {assignments}
+        WHERE name = %(visitor)s
+            AND IFNULL(source, 'direct') IN ('', 'direct')
+            AND IFNULL(referrer, '') = ''
+    """, dict(attribution, visitor=visitor))
+
 def get_or_create_visitor(visitor_id, ip_address):
     """Get or create visitor record"""
     visitor_name = frappe.db.get_value("Visitor", {"visitor_id": visitor_id}, "name")
@@ -105,6 +283,8 @@ def get_or_create_visitor(visitor_id, ip_address):
     visitor.last_seen = frappe.utils.now()
     visitor.ip_address = ip_address
     visitor.user_agent = frappe.request.headers.get('User-Agent', '')
+    set_user_agent_fields(visitor, visitor.user_agent)
+    set_geo_fields(visitor, ip_address)
     visitor.insert(ignore_permissions=True)
     return visitor.name
 
@@ -114,86 +294,67 @@ def update_visitor_session(visitor_id, event_type):
 
 @frappe.whitelist(allow_guest=True)
 @handle_error(error_type="Script Generation", return_response=False)
-def get_tracking_script():
-    """Get tracking JavaScript code"""
-    settings = frappe.get_single("TrackFlow Settings")
-    
-    if not settings or not settings.enable_tracking:
-        return "<!-- TrackFlow tracking disabled -->"
-    
-    # Generate tracking script
-    script = """
-(function() {
-    var TrackFlow = window.TrackFlow || {};
-    
-    TrackFlow.apiUrl = '%s';
-    TrackFlow.visitorId = '%s';
-    TrackFlow.sessionId = '%s';
-    TrackFlow.requireConsent = %s;
-    
-    TrackFlow.track = function(eventType, properties) {
-        var data = {
-            visitor_id: TrackFlow.visitorId,
-            event_type: eventType || 'pageview',
-            url: window.location.href,
-            referrer: document.referrer,
-            properties: properties || {},
-            utm_source: getParam('utm_source'),
-            utm_medium: getParam('utm_medium'),
-            utm_campaign: getParam('utm_campaign'),
-            utm_content: getParam('utm_content'),
-            utm_term: getParam('utm_term')
-        };
-        
-        fetch(TrackFlow.apiUrl + '/api/method/trackflow.api.tracking.track_event', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify(data),
-            credentials: 'include'
-        });
-    };
-    
-    TrackFlow.consent = function(granted) {
-        fetch(TrackFlow.apiUrl + '/api/method/trackflow.api.tracking.record_consent', {
-            method: 'POST',
-            headers: {'Content-Type': 'application/json'},
-            body: JSON.stringify({
-                visitor_id: TrackFlow.visitorId,
-                consent_given: granted
-            }),
-            credentials: 'include'
-        });
-    };
-    
-    function getParam(name) {
-        var match = RegExp('[?&]' + name + '=([^&]*)').exec(window.location.search);
-        return match && decodeURIComponent(match[1].replace(/\+/g, ' '));
-    }
-    
-    // Auto-track pageviews
-    if (!TrackFlow.requireConsent || getCookie('trackflow_consent') === 'true') {
-        TrackFlow.track('pageview');
-    }
-    
-    function getCookie(name) {
-        var value = "; " + document.cookie;
-        var parts = value.split("; " + name + "=");
-        if (parts.length == 2) return parts.pop().split(";").shift();
+def get_tracking_script(v=None):
+    """Get tracking JavaScript code
+    
+    The script is the same for every visitor and is cached in Redis with an
+    ETag derived from the settings version, so a cache hit or a revalidation
+    never touches the database. ``v`` pins a version: such URLs are
+    immutable and cached for a year.
+    """
+    bundle = get_tracking_script_bundle()
+    etag = f'"{bundle["version"]}"'
+    max_age = VERSIONED_SCRIPT_MAX_AGE if v == bundle["version"] else SCRIPT_MAX_AGE
+    headers = {
+        "ETag": etag,
+        "Cache-Control": f"public, max-age={max_age}" + (", immutable" if max_age == VERSIONED_SCRIPT_MAX_AGE else ""),
     }
     
-    window.TrackFlow = TrackFlow;
-})();
-""" % (
-        frappe.utils.get_url(),
-        (get_visitor_from_request() or ("", ""))[0] or "",
-        frappe.request.cookies.get("trackflow_session") or "",
-        "true" if getattr(settings, "require_gdpr_consent", False) else "false"
-    )
+    if etag in (frappe.get_request_header("If-None-Match") or ""):
+        return Response(status=304, headers=headers)
     
-    # Set content type
-    frappe.response["content_type"] = "application/javascript"
+    return Response(bundle["script"], mimetype="application/javascript", headers=headers)
+
+def get_tracking_script_bundle():
+    """{"version", "script"} of the current tracking script"""
+    bundle = frappe.cache().get_value(SCRIPT_CACHE_KEY)
+    if bundle is None:
+        bundle = build_tracking_script()
+        frappe.cache().set_value(SCRIPT_CACHE_KEY, bundle)
+    return bundle
+
+def build_tracking_script():
+    settings = frappe.get_cached_doc("TrackFlow Settings")
     
-    return script
+    if not settings.enable_tracking:
+        script = "/* TrackFlow tracking disabled */\n"
+    else:
+        config = {
+            "apiUrl": frappe.utils.get_url(),
+            "requireConsent": bool(getattr(settings, "require_gdpr_consent", False)),
+        }
+        with open(frappe.get_app_path("trackflow", "public", "js", "trackflow-embed.js")) as f:
+            script = f"window.TrackFlowConfig = {json.dumps(config)};\n{f.read()}"
+    
+    version = hashlib.md5(f"{settings.modified}\n{script}".encode()).hexdigest()[:12]
+    return {"version": version, "script": script}
+
+def get_tracking_script_url():
+    """Versioned, long-cacheable URL of the tracking script"""
+    return frappe.utils.get_url(get_tracking_script_path())
+
+def get_tracking_script_path():
+    version = get_tracking_script_bundle()["version"]
+    return f"/api/method/trackflow.api.tracking.get_tracking_script?v={version}"
+
+def get_tracking_script_tag():
+    """Website head block loading the versioned tracking script"""
+    return f"""{SCRIPT_TAG_START}
+<script src="{get_tracking_script_path()}" async></script>
+{SCRIPT_TAG_END}"""
+
+def clear_tracking_script_cache():
+    frappe.cache().delete_value(SCRIPT_CACHE_KEY)
 
 @frappe.whitelist()
 @handle_error(error_type="Create Link")
@@ -4,7 +4,8 @@ TrackFlow REST API v1
 
 import frappe
 from frappe import _
-from frappe.utils import now_datetime
+from frappe.utils import now_datetime, get_datetime
+import base64
 import json
 from urllib.parse import urlencode, urlparse, parse_qs, urlunparse
 
@@ -87,9 +88,40 @@ def create_link(url, campaign=None, title=None, source=None, medium=None, **kwar
     }
 
 
+# Columns an integration may request from the click feed via ``fields``.
+# ``name`` is always returned because the cursor is built from it.
+CLICK_FEED_FIELDS = (
+    "name",
+    "click_timestamp",
+    "tracked_link",
+    "visitor_id",
+    "ip_address",
+    "user_agent",
+    "referrer",
+    "utm_source",
+    "utm_medium",
+    "utm_campaign",
+    "campaign",
+)
+DEFAULT_FEED_FIELDS = ("click_timestamp", "ip_address", "user_agent", "referrer", "utm_source", "utm_medium")
+MAX_PAGE_SIZE = 500
+FEED_COUNT_MODES = ("exact", "estimate", "none")
+
+
 @frappe.whitelist()
-def get_analytics(short_code=None, campaign=None, period="7d"):
-    """Get analytics for a link or campaign"""
+def get_analytics(short_code=None, campaign=None, period="7d", cursor=None, since=None, limit=100, fields=None, count="exact"):
+    """Get a keyset-paginated click feed for a link or campaign
+
+    Clicks are returned newest first and ordered on (click_timestamp, name).
+    Pass the returned ``next_cursor`` as ``cursor`` to fetch the next (older)
+    page, and the returned ``head_cursor`` as ``since`` on the next poll to
+    fetch only clicks recorded after it. ``count`` is one of ``exact``,
+    ``estimate`` (the database's row estimate for the period's index range)
+    or ``none``; totals are only computed for the first page of a feed.
+    """
+    if count not in FEED_COUNT_MODES:
+        frappe.throw(_("count must be one of: {0}").format(", ".join(FEED_COUNT_MODES)))
+
     filters = {}
 
     if short_code:
@@ -102,24 +134,108 @@ def get_analytics(short_code=None, campaign=None, period="7d"):
     else:
         frappe.throw(_("Please provide either short_code or campaign"))
 
+    limit = min(max(frappe.utils.cint(limit) or 100, 1), MAX_PAGE_SIZE)
+    columns = _parse_feed_fields(fields)
     date_range = _get_date_range(period)
-    filters["click_timestamp"] = ["between", date_range]
-
-    clicks = frappe.get_all(
-        "Click Event",
-        filters=filters,
-        fields=["click_timestamp", "ip_address", "user_agent", "referrer", "utm_source", "utm_medium"],
-        order_by="click_timestamp desc",
-        limit=500,
+
+    conditions = ["`{0}` = %({0})s".format(key) for key in filters]
+    conditions.append("click_timestamp BETWEEN %(from_date)s AND %(to_date)s")
+    values = dict(filters, from_date=date_range[0], to_date=date_range[1])
+
+    if cursor:
+        values["cursor_ts"], values["cursor_name"] = _decode_cursor(cursor)
+        conditions.append(
+            "(click_timestamp < %(cursor_ts)s OR (click_timestamp = %(cursor_ts)s AND name < %(cursor_name)s))"
+        )
+    if since:
+        values["since_ts"], values["since_name"] = _decode_cursor(since)
+        conditions.append(
+            "(click_timestamp > %(since_ts)s OR (click_timestamp = %(since_ts)s AND name > %(since_name)s))"
+        )
+
+    values["page_size"] = limit + 1
+    clicks = frappe.db.sql(
+        """SELECT {columns} FROM `tabClick Event`
+        WHERE {conditions}
+        ORDER BY click_timestamp DESC, name DESC
+        LIMIT %(page_size)s""".format(
+            columns=", ".join(f"`{c}`" for c in columns),
+            conditions=" AND ".join(conditions),
+        ),
+        values,
+        as_dict=True,
     )
 
-    return {
+    has_more = len(clicks) > limit
+    clicks = clicks[:limit]
+
+    result = {
         "success": True,
         "period": period,
-        "total_clicks": len(clicks),
-        "clicks": clicks[:100],
+        "clicks": clicks,
+        "has_more": has_more,
+        "next_cursor": _encode_cursor(clicks[-1]) if has_more else None,
+        "head_cursor": _encode_cursor(clicks[0]) if clicks else since,
     }
 
+    if not cursor and count != "none":
+        result.update(_get_feed_total(filters, values, count))
+
+    return result
+
+
+def _parse_feed_fields(fields):
+    """Validate the requested projection against CLICK_FEED_FIELDS"""
+    if not fields:
+        requested = list(DEFAULT_FEED_FIELDS)
+    elif isinstance(fields, str):
+        fields = fields.strip()
+        requested = json.loads(fields) if fields.startswith("[") else [f.strip() for f in fields.split(",")]
+    else:
+        requested = list(fields)
+
+    invalid = [f for f in requested if f not in CLICK_FEED_FIELDS]
+    if invalid:
+        frappe.throw(_("Invalid fields: {0}").format(", ".join(invalid)))
+
+    # name and click_timestamp make up the cursor, so always select them
+    columns = ["name", "click_timestamp"]
+    columns.extend(f for f in requested if f not in columns)
+    return columns
+
+
+def _encode_cursor(row):
+    """Opaque cursor for a click row: urlsafe base64 of [timestamp, name]"""
+    payload = json.dumps([str(row["click_timestamp"]), row["name"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor):
+    """Inverse of _encode_cursor, returns (timestamp, name)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        timestamp, name = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return get_datetime(timestamp), name
+    except Exception:
+        frappe.throw(_("Invalid cursor"))
+
+
+def _get_feed_total(filters, values, count):
+    """Total clicks in the feed window, exact or estimated from the index"""
+    key = "tracked_link" if filters.get("tracked_link") else "campaign"
+    query = """SELECT COUNT(*) FROM `tabClick Event`
+        WHERE `{0}` = %({0})s AND click_timestamp BETWEEN %(from_date)s AND %(to_date)s""".format(key)
+
+    if count == "estimate":
+        # The optimizer sizes the range from the (key, click_timestamp) index
+        # without reading the rows
+        plan = frappe.db.sql("EXPLAIN " + query, values, as_dict=True)
+        total = plan[0].get("rows") if plan else 0
+        return {"total_clicks": frappe.utils.cint(total), "total_is_estimate": True}
+
+    total = frappe.db.sql(query, values)[0][0]
+    return {"total_clicks": total or 0, "total_is_estimate": False}
+
 
 @frappe.whitelist()
 def bulk_create_links(links):
@@ -164,7 +280,7 @@ def _build_final_url(link):
 
 def _get_date_range(period):
     """Convert period string to date range"""
-    from frappe.utils import add_days, get_datetime
+    from frappe.utils import add_days
 
     end_date = get_datetime()
     days_map = {"1d": -1, "7d": -7, "30d": -30, "90d": -90}
@@ -1,225 +1,1024 @@
 """
-Attribution calculation module for TrackFlow
+Attribution engine for TrackFlow
+
+Every attribution caller goes through the same three steps:
+
+1. ``TouchpointLoader`` reads touchpoints for a set of visitors with one
+   windowed query per source table and caches them for the rest of the
+   request or job.
+2. The touches are laid out as parallel NumPy arrays: deal index, seconds
+   before conversion and channel code.
+3. A model kernel from ``KERNELS`` turns those arrays into per-touch credit.
+   The Attribution Model doctype only supplies the configuration (model
+   type, lookback, decay rate, ...).
 """
 
 import frappe
 from frappe import _
+from frappe.utils import flt, get_datetime, now_datetime
 import json
-from datetime import datetime, timedelta
+import numpy as np
+from collections import OrderedDict
+from datetime import timedelta
+
+
+BATCH_CHUNK_SIZE = 500
+
+# Visitors per IN list when loading touchpoints
+LOADER_CHUNK_SIZE = 1000
+
+# Loaded windows kept per loader
+LOADER_CACHE_SIZE = 16
+
+DEFAULT_DECAY_RATE = 0.1
+
+
+# ---------------------------------------------------------------------------
+# Model kernels
+#
+# A kernel receives a TouchBatch (touches sorted by deal, oldest first) and
+# the model configuration and returns one weight per touch, summing to 1
+# for every deal that has touches.
+# ---------------------------------------------------------------------------
+
+KERNELS = {}
+
+
+def register_kernel(model_type):
+    """Register a kernel for an Attribution Model ``model_type``"""
+    def decorator(fn):
+        KERNELS[model_type] = fn
+        return fn
+    return decorator
+
+
+def get_kernel(model_type):
+    return KERNELS.get(model_type) or KERNELS["last_touch"]
+
+
+def segment_positions(deal, n_deals):
+    """Position of each touch within its deal and the deal's touch count
+
+    ``deal`` must be sorted.
+    """
+    counts = np.bincount(deal, minlength=n_deals)
+    starts = np.cumsum(counts) - counts
+    return np.arange(len(deal)) - starts[deal], counts[deal]
+
+
+@register_kernel("first_touch")
+def first_touch_kernel(batch, config):
+    return (batch.position == 0).astype(float)
+
+
+@register_kernel("last_touch")
+def last_touch_kernel(batch, config):
+    return (batch.position == batch.size - 1).astype(float)
+
+
+@register_kernel("linear")
+def linear_kernel(batch, config):
+    return 1.0 / batch.size
+
+
+@register_kernel("time_decay")
+def time_decay_kernel(batch, config):
+    """(1 - decay_rate) ** whole days before conversion, normalised per deal"""
+    days = batch.seconds_before // 86400
+    weights = (1 - (config.decay_rate or DEFAULT_DECAY_RATE)) ** days
+    totals = np.bincount(batch.deal, weights=weights, minlength=batch.n_deals)[batch.deal]
+    # Deals whose weights all decayed to zero fall back to linear credit
+    return np.where(totals > 0, weights / np.where(totals > 0, totals, 1), 1.0 / batch.size)
+
+
+def positional_weights(batch, first, middle, last):
+    """Fixed shares for the first, middle and last touches of each deal
+
+    One-touch deals give everything to that touch. Two-touch deals split
+    the middle share between first and last in proportion.
+    """
+    position, size = batch.position, batch.size
+    edges = first + last
+    weights = np.where(position == 0, first, np.where(position == size - 1, last, middle / np.maximum(size - 2, 1)))
+    weights = np.where(size == 2, np.where(position == 0, first, last) / (edges or 1), weights)
+    return np.where(size == 1, 1.0, weights)
+
+
+@register_kernel("position_based")
+def position_based_kernel(batch, config):
+    return positional_weights(batch, 0.4, 0.2, 0.4)
+
+
+@register_kernel("custom")
+def custom_kernel(batch, config):
+    """Positional shares from custom_weights, e.g. {"first": 0.3, "middle": 0.4, "last": 0.3}"""
+    shares = config.custom_weights
+    if not shares:
+        return linear_kernel(batch, config)
+    return positional_weights(batch, shares["first"], shares["middle"], shares["last"])
+
+
+def parse_custom_weights(custom_weights):
+    """Normalised {first, middle, last} shares, or None to fall back to linear"""
+    try:
+        weights = json.loads(custom_weights) if isinstance(custom_weights, str) else custom_weights
+        shares = {key: max(flt(weights.get(key)), 0) for key in ("first", "middle", "last")}
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+    total = sum(shares.values())
+    if not total:
+        return None
+    return {key: value / total for key, value in shares.items()}
+
+
+@register_kernel("markov")
+def markov_kernel(batch, config):
+    """Learned per-channel credit (trackflow.markov), shared by a channel's touches"""
+    if not config.learned_weights or batch.channel_names is None:
+        return linear_kernel(batch, config)
+
+    channel_weight = np.array([config.learned_weights.get(name, 0.0) for name in batch.channel_names])
+    return spread_channel_values(batch, channel_weight[batch.channel])
+
+
+@register_kernel("shapley")
+def shapley_kernel(batch, config):
+    """Shapley value of each channel within its deal's coalition (trackflow.shapley)"""
+    if batch.channel_names is None:
+        return linear_kernel(batch, config)
+
+    from trackflow.shapley import get_coalition_values
+
+    n_channels = len(batch.channel_names)
+    pairs, group = np.unique(batch.deal * n_channels + batch.channel, return_inverse=True)
+    pair_deal, pair_channel = pairs // n_channels, pairs % n_channels
+
+    deals, first = np.unique(pair_deal, return_index=True)
+    coalitions = [
+        [batch.channel_names[code] for code in channels.tolist()]
+        for channels in np.split(pair_channel, first[1:])
+    ]
+    values = get_coalition_values(coalitions, config.shapley_error)
+
+    pair_value = np.array([
+        max(values[i].get(batch.channel_names[code], 0.0), 0.0)
+        for i, code in zip(np.searchsorted(deals, pair_deal).tolist(), pair_channel.tolist())
+    ])
+    return spread_channel_values(batch, pair_value[group])
+
+
+def spread_channel_values(batch, touch_value):
+    """Per-touch credit from the value of each touch's (deal, channel)
+
+    Each channel present in a deal gets its value, split evenly across its
+    touches, then credit is normalised per deal. Deals whose channels are
+    all worth nothing fall back to linear credit.
+    """
+    key = batch.deal * (int(batch.channel.max()) + 1) + batch.channel
+    _keys, group, repeats = np.unique(key, return_inverse=True, return_counts=True)
+    weights = touch_value / repeats[group]
+    totals = np.bincount(batch.deal, weights=weights, minlength=batch.n_deals)[batch.deal]
+    return np.where(totals > 0, weights / np.where(totals > 0, totals, 1), 1.0 / batch.size)
+
+
+def parse_learned_weights(learned_weights):
+    """{channel: weight} from an Attribution Model's learned_weights"""
+    try:
+        weights = json.loads(learned_weights) if isinstance(learned_weights, str) else learned_weights
+        return {channel: max(flt(weight), 0) for channel, weight in (weights or {}).items()}
+    except (TypeError, ValueError, AttributeError):
+        return {}
+
+
+# ---------------------------------------------------------------------------
+# Touchpoint loading
+# ---------------------------------------------------------------------------
+
+# Tables touchpoints are read from; ``where`` narrows a source to the rows
+# that are marketing touches
+TOUCHPOINT_SOURCES = {
+    "Click Event": {
+        "visitor": "visitor_id",
+        "timestamp": "click_timestamp",
+        "source": "utm_source",
+        "medium": "utm_medium",
+        "campaign": "IFNULL(campaign, utm_campaign)",
+        "kind": "click",
+    },
+    "Journey Touchpoint": {
+        "visitor": "visitor",
+        "timestamp": "timestamp",
+        "source": "source",
+        "medium": "medium",
+        "campaign": "campaign",
+        "where": "touchpoint_type IN ('email_open', 'email_click')",
+        "kind": "email",
+    },
+}
+
+
+class TouchpointLoader:
+    """Windowed, cached touchpoint loading for many visitors at once
+
+    Channels are interned: every touch is a compact ``(timestamp, code,
+    kind)`` tuple and ``channels[code]`` is its ``(source, medium,
+    campaign)``. The window is applied in SQL on each source's indexed
+    (visitor, timestamp) columns.
+    """
+
+    def __init__(self, sources=None):
+        self.sources = sources or TOUCHPOINT_SOURCES
+        self.channels = []
+        self.channel_codes = {}
+        self._cache = OrderedDict()
+
+    def channel_code(self, source, medium, campaign):
+        key = (source or None, medium or None, campaign or None)
+        code = self.channel_codes.get(key)
+        if code is None:
+            code = self.channel_codes[key] = len(self.channels)
+            self.channels.append(key)
+        return code
+
+    def channel_name(self, code):
+        return self.channels[code][0] or "direct"
+
+    def is_direct(self, code):
+        source, medium, _campaign = self.channels[code]
+        return not source and not medium
+
+    def load(self, visitors, window_start=None, window_end=None):
+        """{visitor: [(timestamp, channel code, kind), ...]} oldest first"""
+        visitors = tuple(sorted({v for v in visitors if v}))
+        key = (visitors, window_start, window_end)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        grouped = {visitor: [] for visitor in visitors}
+        for i in range(0, len(visitors), LOADER_CHUNK_SIZE):
+            chunk = visitors[i:i + LOADER_CHUNK_SIZE]
+            for source, spec in self.sources.items():
+                if frappe.db.table_exists(source):
+                    self._load_source(source, spec, chunk, window_start, window_end, grouped)
+
+        for touches in grouped.values():
+            touches.sort()
+
+        self._cache[key] = grouped
+        if len(self._cache) > LOADER_CACHE_SIZE:
+            self._cache.popitem(last=False)
+        return grouped
+
+    def _load_source(self, source, spec, visitors, window_start, window_end, grouped):
+        conditions = [f"{spec['visitor']} IN %(visitors)s"]
+        if window_start:
+            conditions.append(f"{spec['timestamp']} >= %(window_start)s")
+        if window_end:
+            conditions.append(f"{spec['timestamp']} <= %(window_end)s")
+        if spec.get("where"):
+            conditions.append(spec["where"])
+
+        rows = frappe.db.sql(
+            """
+            SELECT {visitor}, {timestamp}, {source}, {medium}, {campaign}
+            FROM `tab{doctype}`
+            WHERE {conditions}
+            """.format(
+                visitor=spec["visitor"],
+                timestamp=spec["timestamp"],
+                source=spec["source"],
+                medium=spec["medium"],
+                campaign=spec["campaign"],
+                doctype=source,
+                conditions=" AND ".join(conditions),
+            ),
+            {"visitors": visitors, "window_start": window_start, "window_end": window_end},
+            as_iterator=True,
+        )
+
+        kind = spec.get("kind")
+        for visitor, timestamp, utm_source, utm_medium, campaign in rows:
+            if timestamp:
+                grouped[visitor].append(
+                    (get_datetime(timestamp), self.channel_code(utm_source, utm_medium, campaign), kind)
+                )
+
+
+def get_touchpoint_loader():
+    """Loader shared by every attribution caller in the current request or job"""
+    loader = getattr(frappe.local, "trackflow_touchpoint_loader", None)
+    if loader is None:
+        loader = frappe.local.trackflow_touchpoint_loader = TouchpointLoader()
+    return loader
+
+
+def load_touchpoints(visitors, lookback_days=None, until=None):
+    """Touchpoint dicts for one or more visitors, oldest first
+
+    Only touches in the ``lookback_days`` before ``until`` (default now)
+    are read. Each dict has ``timestamp``, ``channel``, ``source``,
+    ``medium``, ``campaign``, ``type`` (click or email) and ``visitor``.
+    """
+    if isinstance(visitors, str):
+        visitors = [visitors]
+
+    until = get_datetime(until) if until else now_datetime()
+    window_start = until - timedelta(days=lookback_days) if lookback_days else None
+
+    loader = get_touchpoint_loader()
+    grouped = loader.load(visitors or [], window_start, until)
+
+    touchpoints = []
+    for visitor, touches in grouped.items():
+        for timestamp, code, kind in touches:
+            source, medium, campaign = loader.channels[code]
+            touchpoints.append({
+                "timestamp": timestamp,
+                "channel": loader.channel_name(code),
+                "source": source,
+                "medium": medium,
+                "campaign": campaign,
+                "type": kind,
+                "visitor": visitor,
+            })
+
+    touchpoints.sort(key=lambda tp: tp["timestamp"])
+    return touchpoints
+
+
+# ---------------------------------------------------------------------------
+# Engine
+# ---------------------------------------------------------------------------
+
+def get_model_config(model):
+    """Engine configuration from an Attribution Model (doc, dict or model type)"""
+    if isinstance(model, str):
+        model = {"model_type": model}
+    model = model or {}
+
+    config = frappe._dict(
+        name=model.get("name"),
+        model_type=model.get("model_type") or "last_touch",
+        lookback_days=model.get("lookback_days"),
+        decay_rate=model.get("decay_rate"),
+        minimum_touchpoints=model.get("minimum_touchpoints") or 1,
+        include_direct_traffic=model.get("include_direct_traffic", 1),
+    )
+    if config.model_type == "custom":
+        config.custom_weights = parse_custom_weights(model.get("custom_weights"))
+    if config.model_type == "markov":
+        config.learned_weights = parse_learned_weights(model.get("learned_weights"))
+    if config.model_type == "shapley":
+        config.shapley_error = model.get("shapley_error")
+    return config
+
+
+class AttributionEngine:
+    """Credits touchpoints under one attribution model configuration"""
+
+    def __init__(self, model, loader=None):
+        self.config = get_model_config(model)
+        self.kernel = get_kernel(self.config.model_type)
+        self.loader = loader
+
+    def credit(self, deal, seconds_before, channel, n_deals, direct_channels=None, channel_names=None):
+        """Per-touch credit over flat touch arrays
+
+        Applies the lookback, direct-traffic and minimum-touchpoint rules,
+        orders the touches by deal (oldest first) and runs the model
+        kernel. Returns the resulting TouchBatch with a ``weights`` array;
+        ``index`` maps each of its touches back to the input arrays.
+        """
+        index = np.arange(len(deal))
+        if self.config.lookback_days:
+            index = index[seconds_before <= self.config.lookback_days * 86400]
+        if not self.config.include_direct_traffic and direct_channels is not None and len(channel):
+            index = index[~direct_channels[channel[index]]]
+
+        index = index[np.lexsort((-seconds_before[index], deal[index]))]
+        batch = self._batch(index, deal, seconds_before, channel, n_deals, channel_names)
+
+        if self.config.minimum_touchpoints > 1 and len(index):
+            index = index[batch.size >= self.config.minimum_touchpoints]
+            batch = self._batch(index, deal, seconds_before, channel, n_deals, channel_names)
+
+        batch.weights = self.kernel(batch, self.config) if len(index) else np.zeros(0)
+        return batch
+
+    def _batch(self, index, deal, seconds_before, channel, n_deals, channel_names):
+        position, size = segment_positions(deal[index], n_deals)
+        return frappe._dict(
+            index=index,
+            deal=deal[index],
+            seconds_before=seconds_before[index],
+            channel=channel[index],
+            position=position,
+            size=size,
+            n_deals=n_deals,
+            channel_names=channel_names,
+        )
+
+    def credit_touchpoints(self, touchpoints, conversion_value):
+        """Credit for one conversion's touchpoint dicts, grouped by channel
+
+        Touchpoints carry a ``channel`` and a ``timestamp``; the latest
+        touch is taken as the conversion time and the lookback window is
+        counted back from it. Returns
+        ``{channel: {credit, value, touchpoint_count}}``.
+        """
+        batch = self._credit_dicts(touchpoints)
+        if batch is None:
+            return {}
+
+        value = flt(conversion_value)
+        result = {}
+        for code, weight in zip(batch.channel.tolist(), batch.weights.tolist()):
+            name = batch.channel_names[code]
+            entry = result.setdefault(name, {"credit": 0.0, "value": 0.0, "touchpoint_count": 0})
+            entry["credit"] += weight
+            entry["value"] += weight * value
+            entry["touchpoint_count"] += 1
+
+        return {name: entry for name, entry in result.items() if entry["credit"] > 0}
+
+    def touch_credits(self, touchpoints):
+        """Per-touchpoint credit (0-1), aligned with ``touchpoints``"""
+        credits = [0.0] * len(touchpoints)
+        batch = self._credit_dicts(touchpoints)
+        if batch is None:
+            return credits
+
+        for idx, weight in zip(batch.touch_index.tolist(), batch.weights.tolist()):
+            credits[idx] = weight
+        return credits
+
+    def _credit_dicts(self, touchpoints):
+        timed = []
+        for idx, tp in enumerate(touchpoints or []):
+            timestamp = tp.get("timestamp")
+            if timestamp:
+                timed.append((get_datetime(timestamp), idx, tp.get("channel") or "direct"))
+        if not timed:
+            return None
+
+        channel_codes = {}
+        for _ts, _idx, name in timed:
+            channel_codes.setdefault(name, len(channel_codes))
+
+        converted_on = max(ts for ts, _idx, _name in timed)
+        seconds_before = np.array([(converted_on - ts).total_seconds() for ts, _idx, _name in timed], dtype=np.int64)
+        channel = np.array([channel_codes[name] for _ts, _idx, name in timed], dtype=np.int64)
+        channel_names = list(channel_codes)
+        direct = np.array([name == "direct" for name in channel_names], dtype=bool)
+
+        batch = self.credit(np.zeros(len(timed), dtype=np.int64), seconds_before, channel, 1, direct, channel_names)
+        batch.touch_index = np.array([idx for _ts, idx, _name in timed], dtype=np.int64)[batch.index]
+        return batch
+
+    def credit_deals(self, deal_rows):
+        """Per (deal, channel) credit for a chunk of deals
+
+        ``deal_rows`` are (name, visitor, conversion time, value) tuples.
+        Returns a list of Deal Attribution row dicts.
+        """
+        if not deal_rows:
+            return []
+
+        loader = self.loader or get_touchpoint_loader()
+        touches = load_deal_touches(loader, deal_rows, self.config.lookback_days)
+        if not len(touches.deal):
+            return []
+
+        direct = np.array([loader.is_direct(code) for code in range(len(loader.channels))], dtype=bool)
+        names = [loader.channel_name(code) for code in range(len(loader.channels))]
+        batch = self.credit(touches.deal, touches.seconds_before, touches.channel, len(deal_rows), direct, names)
+        if not len(batch.deal):
+            return []
+
+        return fold_deal_credit(batch, deal_rows, loader.channels)
+
+
+def load_deal_touches(loader, deal_rows, lookback_days=None):
+    """Touches for a chunk of deals as parallel arrays
+
+    The loader is queried once for the union window of the chunk and each
+    touch is kept for its visitor's deals that converted after it; the
+    engine then cuts every deal to its own lookback window.
+    """
+    conversion_times = [get_datetime(row[2]) for row in deal_rows]
+    window_end = max(conversion_times)
+    window_start = min(conversion_times) - timedelta(days=lookback_days) if lookback_days else None
+
+    touches_by_visitor = loader.load([row[1] for row in deal_rows], window_start, window_end)
+
+    deal_idx = []
+    timestamps = []
+    channel = []
+    for idx, row in enumerate(deal_rows):
+        for timestamp, code, _kind in touches_by_visitor.get(row[1], ()):
+            deal_idx.append(idx)
+            timestamps.append(timestamp)
+            channel.append(code)
+
+    deal_idx = np.asarray(deal_idx, dtype=np.int64)
+    channel = np.asarray(channel, dtype=np.int64)
+    if not len(deal_idx):
+        return frappe._dict(deal=deal_idx, seconds_before=np.zeros(0, np.int64), channel=channel)
+
+    conversion = np.asarray(conversion_times, dtype="datetime64[s]")
+    touched = np.asarray(timestamps, dtype="datetime64[s]")
+    before = (conversion[deal_idx] - touched).astype(np.int64)
+
+    keep = before >= 0
+    return frappe._dict(deal=deal_idx[keep], seconds_before=before[keep], channel=channel[keep])
+
+
+def fold_deal_credit(batch, deal_rows, channels):
+    """One Deal Attribution row dict per (deal, channel) from per-touch credit"""
+    n_channels = len(channels)
+    keys, group = np.unique(batch.deal * n_channels + batch.channel, return_inverse=True)
+    credit = np.bincount(group, weights=batch.weights)
+    earliest = np.zeros(len(keys), dtype=np.int64)
+    np.maximum.at(earliest, group, batch.seconds_before)
+    has_first = np.zeros(len(keys), dtype=bool)
+    np.logical_or.at(has_first, group, batch.position == 0)
+    has_last = np.zeros(len(keys), dtype=bool)
+    np.logical_or.at(has_last, group, batch.position == batch.size - 1)
+    single = np.zeros(len(keys), dtype=bool)
+    np.logical_or.at(single, group, batch.size == 1)
+
+    results = []
+    for i, key in enumerate(keys.tolist()):
+        if credit[i] <= 0:
+            continue
+        deal_name, _visitor, converted_on, value = deal_rows[key // n_channels]
+        source, medium, campaign = channels[key % n_channels]
+        if single[i]:
+            position_label = "Single Touch"
+        elif has_first[i]:
+            position_label = "First Touch"
+        elif has_last[i]:
+            position_label = "Last Touch"
+        else:
+            position_label = "Middle Touch"
+
+        results.append({
+            "deal": deal_name,
+            "deal_value": flt(value),
+            "touchpoint_type": classify_channel(source, medium, campaign),
+            "touchpoint_source": source,
+            "touchpoint_medium": medium,
+            "touchpoint_campaign": campaign,
+            "touchpoint_timestamp": get_datetime(converted_on) - timedelta(seconds=int(earliest[i])),
+            "attribution_weight": flt(credit[i] * 100, 4),
+            "attributed_value": flt(credit[i] * flt(value), 2),
+            "position_in_journey": position_label,
+            "days_to_conversion": int(earliest[i] // 86400),
+        })
+
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Batch attribution for won deals
+# ---------------------------------------------------------------------------
+
+# Deal Attribution.touchpoint_type for a touch, keyed by lower-cased medium
+MEDIUM_TYPES = {
+    "email": "Email",
+    "cpc": "Paid Search",
+    "ppc": "Paid Search",
+    "paid": "Paid Search",
+    "paidsearch": "Paid Search",
+    "social": "Social",
+    "paid_social": "Social",
+    "display": "Display",
+    "banner": "Display",
+    "referral": "Referral",
+    "organic": "Organic",
+}
+
+
+def classify_channel(source, medium, campaign):
+    """Deal Attribution touchpoint_type for a (source, medium, campaign) touch"""
+    touch_type = MEDIUM_TYPES.get((medium or "").strip().lower())
+    if touch_type:
+        return touch_type
+    if campaign:
+        return "Campaign"
+    if not source and not medium:
+        return "Direct"
+    return "Other"
 
 
+def get_model_label(model_type):
+    """CRM Deal.trackflow_attribution_model option for a model type"""
+    return (model_type or "last_touch").replace("_", " ").title()
+
+
+def get_attribution_model(model=None):
+    """Attribution Model doc by name, or the default model"""
+    if model and not isinstance(model, str):
+        return model
+    if model:
+        return frappe.get_cached_doc("Attribution Model", model)
+
+    from trackflow.trackflow.doctype.attribution_model.attribution_model import (
+        get_default_attribution_model,
+    )
+
+    return get_default_attribution_model()
+
+
+def run_batch_attribution(deals=None, model=None, from_date=None, to_date=None,
+                          only_missing=False, chunk_size=BATCH_CHUNK_SIZE):
+    """Credit won deals in chunks and write Deal Attribution rows in bulk
+
+    ``deals`` limits the run to the given deal names, otherwise every won
+    deal (closed between ``from_date`` and ``to_date`` when given) is
+    processed. Returns the number of deals credited.
+    """
+    if not frappe.db.table_exists("CRM Deal"):
+        return 0
+
+    model = get_attribution_model(model)
+    if not model:
+        return 0
+
+    engine = AttributionEngine(model)
+    deal_rows = get_won_deals(deals, from_date, to_date, only_missing)
+    credited = 0
+    for i in range(0, len(deal_rows), chunk_size):
+        chunk = deal_rows[i:i + chunk_size]
+        credited += write_deal_attribution(model, chunk, engine.credit_deals(chunk))
+        frappe.db.commit()
+
+    return credited
+
+
+# When a deal was won; deals won before trackflow_won_on was recorded fall back to modified
+WON_ON = "IFNULL(trackflow_won_on, modified)"
+
+
+def get_won_deals(deals=None, from_date=None, to_date=None, only_missing=False):
+    """(name, visitor, conversion time, value) for won, tracked deals"""
+    conditions = ["status = 'Won'", "IFNULL(trackflow_visitor_id, '') != ''"]
+    values = {}
+
+    if deals:
+        conditions.append("name IN %(deals)s")
+        values["deals"] = tuple(deals)
+    if from_date:
+        conditions.append(f"{WON_ON} >= %(from_date)s")
+        values["from_date"] = from_date
+    if to_date:
+        conditions.append(f"{WON_ON} < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)")
+        values["to_date"] = to_date
+    if only_missing:
+        conditions.append(
+            "NOT EXISTS (SELECT 1 FROM `tabDeal Attribution` da WHERE da.deal = `tabCRM Deal`.name)"
+        )
+
+    return frappe.db.sql(
+        """
+        SELECT name, trackflow_visitor_id, {won_on}, IFNULL(annual_revenue, 0)
+        FROM `tabCRM Deal`
+        WHERE {conditions}
+        ORDER BY {won_on}
+        """.format(won_on=WON_ON, conditions=" AND ".join(conditions)),
+        values,
+    )
+
+
+def write_deal_attribution(model, deal_rows, results):
+    """Replace a chunk's Deal Attribution rows for this model in bulk"""
+    deal_names = [row[0] for row in deal_rows]
+    if not deal_names:
+        return 0
+
+    frappe.db.sql(
+        """DELETE FROM `tabDeal Attribution`
+        WHERE deal IN %(deals)s AND attribution_model = %(model)s""",
+        {"deals": tuple(deal_names), "model": model.name},
+    )
+
+    insert_deal_attribution(model, results)
+    return mark_deals_attributed(model, results)
+
+
+# Deal Attribution columns written from engine result rows
+ATTRIBUTION_FIELDS = [
+    "deal_value", "touchpoint_type", "touchpoint_source", "touchpoint_medium",
+    "touchpoint_campaign", "touchpoint_timestamp", "attribution_weight",
+    "attributed_value", "position_in_journey", "days_to_conversion",
+]
+
+
+# CRM Deal table field the rows belong to, so they load on the deal form
+DEAL_ATTRIBUTION_FIELD = "trackflow_attributions"
+
+
+def insert_deal_attribution(model, results, next_idx=None):
+    """Bulk insert result rows as children of their deals
+
+    ``next_idx`` gives the first free idx per deal when the deal already
+    has rows; rows are numbered from 1 otherwise.
+    """
+    if not results:
+        return
+
+    fields = [
+        "name", "creation", "modified", "owner", "modified_by",
+        "parent", "parenttype", "parentfield", "idx", "attribution_model", "deal",
+    ] + ATTRIBUTION_FIELDS
+    now = now_datetime()
+    next_idx = dict(next_idx or {})
+    values = []
+    for row in results:
+        idx = next_idx.get(row["deal"], 1)
+        next_idx[row["deal"]] = idx + 1
+        values.append((
+            frappe.generate_hash(length=10), now, now, "Administrator", "Administrator",
+            row["deal"], "CRM Deal", DEAL_ATTRIBUTION_FIELD, idx, model.name, row["deal"],
+        ) + tuple(row[field] for field in ATTRIBUTION_FIELDS))
+    frappe.db.bulk_insert("Deal Attribution", fields, values)
+
+
+def mark_deals_attributed(model, results):
+    credited = sorted({row["deal"] for row in results})
+    if credited:
+        frappe.db.sql(
+            """UPDATE `tabCRM Deal`
+            SET trackflow_attribution_model = %(label)s, trackflow_marketing_influenced = 1
+            WHERE name IN %(deals)s""",
+            {"label": get_model_label(model.model_type), "deals": tuple(credited)},
+        )
+
+    return len(credited)
+
+
+# ---------------------------------------------------------------------------
+# Incremental recompute
+#
+# Ingestion adds a visitor to a Redis set whenever it records a touch that
+# can move credit. A scheduled worker pops those visitors, recomputes their
+# open deals and leads, and writes only the rows that changed.
+# ---------------------------------------------------------------------------
+
+DIRTY_VISITORS_KEY = "trackflow:attribution:dirty_visitors"
+DIRTY_BATCH_SIZE = 1000
+DIRTY_MAX_BATCHES = 20
+
+# Journey Touchpoint types that can change a visitor's attribution
+ATTRIBUTION_TOUCH_TYPES = ("link_click", "email_open", "email_click", "conversion")
+
+
+def mark_visitor_dirty(visitor):
+    """Queue a visitor's open deals and leads for recompute"""
+    if visitor:
+        frappe.cache().sadd(DIRTY_VISITORS_KEY, visitor)
+
+
+def pop_dirty_visitors(limit=DIRTY_BATCH_SIZE):
+    cache = frappe.cache()
+    visitors = []
+    while len(visitors) < limit:
+        visitor = cache.spop(DIRTY_VISITORS_KEY)
+        if visitor is None:
+            break
+        visitors.append(frappe.safe_decode(visitor))
+    return visitors
+
+
+def recompute_dirty_attribution(model=None, batch_size=DIRTY_BATCH_SIZE, max_batches=DIRTY_MAX_BATCHES):
+    """Recompute attribution for visitors with new touches since the last run
+
+    Returns the number of visitors processed. Visitors of a batch that
+    fails are queued again for the next run.
+    """
+    model = get_attribution_model(model)
+    if not model:
+        return 0
+
+    engine = AttributionEngine(model)
+    processed = 0
+    for _batch in range(max_batches):
+        visitors = pop_dirty_visitors(batch_size)
+        if not visitors:
+            break
+
+        try:
+            deal_rows = get_open_deals(visitors)
+            for i in range(0, len(deal_rows), BATCH_CHUNK_SIZE):
+                chunk = deal_rows[i:i + BATCH_CHUNK_SIZE]
+                apply_attribution_diff(model, chunk, engine.credit_deals(chunk))
+            update_lead_touch_summary(visitors)
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            frappe.cache().sadd(DIRTY_VISITORS_KEY, *visitors)
+            raise
+
+        processed += len(visitors)
+
+    return processed
+
+
+def get_open_deals(visitors):
+    """(name, visitor, now, value) for the visitors' deals that are still open"""
+    if not visitors or not frappe.db.table_exists("CRM Deal"):
+        return []
+
+    return frappe.db.sql(
+        """
+        SELECT name, trackflow_visitor_id, %(now)s, IFNULL(annual_revenue, 0)
+        FROM `tabCRM Deal`
+        WHERE trackflow_visitor_id IN %(visitors)s
+            AND status NOT IN ('Won', 'Lost')
+        """,
+        {"visitors": tuple(visitors), "now": now_datetime()},
+    )
+
+
+def diff_deal_attribution(existing, results):
+    """Inserts, updates and deletes that turn ``existing`` rows into ``results``
+
+    Rows are matched on (deal, source, medium, campaign). Returns
+    ``(inserts, [(name, changes)], delete_names)``.
+    """
+    current = {
+        (row.deal, row.touchpoint_source, row.touchpoint_medium, row.touchpoint_campaign): row
+        for row in existing
+    }
+
+    inserts, updates = [], []
+    for row in results:
+        old = current.pop(
+            (row["deal"], row["touchpoint_source"], row["touchpoint_medium"], row["touchpoint_campaign"]),
+            None,
+        )
+        if old is None:
+            inserts.append(row)
+            continue
+
+        changes = {
+            field: row[field]
+            for field in ATTRIBUTION_FIELDS
+            if not _same_value(old.get(field), row[field])
+        }
+        if changes:
+            updates.append((old.name, changes))
+
+    return inserts, updates, [row.name for row in current.values()]
+
+
+def _same_value(old, new):
+    if isinstance(new, float):
+        return abs(flt(old) - new) < 1e-4
+    if old is None or new is None:
+        return old == new
+    if hasattr(new, "timestamp"):
+        return get_datetime(old) == get_datetime(new)
+    return old == new
+
+
+def apply_attribution_diff(model, deal_rows, results):
+    """Bring a chunk's Deal Attribution rows in line with ``results``"""
+    deal_names = [row[0] for row in deal_rows]
+    if not deal_names:
+        return 0
+
+    existing = frappe.db.sql(
+        """
+        SELECT name, deal, idx, {fields}
+        FROM `tabDeal Attribution`
+        WHERE deal IN %(deals)s AND attribution_model = %(model)s
+        """.format(fields=", ".join(ATTRIBUTION_FIELDS)),
+        {"deals": tuple(deal_names), "model": model.name},
+        as_dict=True,
+    )
+    inserts, updates, deletes = diff_deal_attribution(existing, results)
+
+    next_idx = {}
+    for row in existing:
+        next_idx[row.deal] = max(next_idx.get(row.deal, 1), (row.idx or 0) + 1)
+
+    if deletes:
+        frappe.db.sql(
+            """DELETE FROM `tabDeal Attribution` WHERE name IN %(names)s""",
+            {"names": tuple(deletes)},
+        )
+    for name, changes in updates:
+        frappe.db.set_value("Deal Attribution", name, changes)
+    insert_deal_attribution(model, inserts, next_idx)
+
+    return mark_deals_attributed(model, results)
+
+
+def update_lead_touch_summary(visitors):
+    """Refresh first/last touch and touch count on the visitors' open leads"""
+    if not visitors or not frappe.db.table_exists("CRM Lead"):
+        return
+
+    leads = frappe.db.sql(
+        """
+        SELECT name, trackflow_visitor_id, trackflow_first_touch_date,
+            trackflow_last_touch_date, trackflow_touch_count
+        FROM `tabCRM Lead`
+        WHERE trackflow_visitor_id IN %(visitors)s AND IFNULL(converted, 0) = 0
+        """,
+        {"visitors": tuple(visitors)},
+    )
+    if not leads:
+        return
+
+    touches = get_touchpoint_loader().load([lead[1] for lead in leads], window_end=now_datetime())
+    for name, visitor, first_touch, last_touch, touch_count in leads:
+        visitor_touches = touches.get(visitor) or []
+        summary = {
+            "trackflow_first_touch_date": visitor_touches[0][0] if visitor_touches else None,
+            "trackflow_last_touch_date": visitor_touches[-1][0] if visitor_touches else None,
+            "trackflow_touch_count": len(visitor_touches),
+        }
+        if (first_touch, last_touch, touch_count or 0) != tuple(summary.values()):
+            frappe.db.set_value("CRM Lead", name, summary, update_modified=False)
+
+
+# ---------------------------------------------------------------------------
+# Visitor-level attribution
+# ---------------------------------------------------------------------------
+
 class AttributionCalculator:
-    """Calculate multi-touch attribution for conversions"""
-    
+    """Calculate multi-touch attribution for a visitor's conversion"""
+
     def __init__(self, visitor_id, conversion_value, attribution_model="last_touch"):
         self.visitor_id = visitor_id
         self.conversion_value = conversion_value
         self.attribution_model = attribution_model
         self.touchpoints = []
-        
+
     def calculate(self):
-        """Calculate attribution based on selected model"""
-        # Get all touchpoints
+        """Touchpoints in the attribution window with their credit (%)"""
         self.touchpoints = self.get_touchpoints()
-        
-        if not self.touchpoints:
-            return {"touchpoints": [], "total_credit": 0}
-            
-        # Apply attribution model
-        if self.attribution_model == "last_touch":
-            return self.last_touch_attribution()
-        elif self.attribution_model == "first_touch":
-            return self.first_touch_attribution()
-        elif self.attribution_model == "linear":
-            return self.linear_attribution()
-        elif self.attribution_model == "time_decay":
-            return self.time_decay_attribution()
-        elif self.attribution_model == "position_based":
-            return self.position_based_attribution()
-        else:
-            # Default to last touch
-            return self.last_touch_attribution()
-            
-    def get_touchpoints(self):
-        """Get all touchpoints for the visitor"""
-        settings = frappe.get_single("TrackFlow Settings")
-        attribution_window = settings.attribution_window_days or 90
-        
-        # Calculate cutoff date
-        cutoff_date = frappe.utils.add_to_date(
-            frappe.utils.now(),
-            days=-attribution_window
-        )
-        
-        # Get all relevant events
-        events = frappe.get_all(
-            "Visitor Event",
-            filters={
-                "visitor": self.visitor_id,
-                "timestamp": [">=", cutoff_date],
-                "event_type": ["in", ["page_view", "campaign_click", "form_submission"]]
-            },
-            fields=["event_type", "timestamp", "event_data", "url"],
-            order_by="timestamp asc"
-        )
-        
-        # Get visitor info for source attribution
-        visitor = frappe.get_doc("Visitor", self.visitor_id)
-        
-        touchpoints = []
-        for event in events:
-            event_data = json.loads(event.event_data or "{}")
-            
-            touchpoint = {
-                "timestamp": event.timestamp,
-                "type": event.event_type,
-                "url": event.url,
-                "source": event_data.get("source") or visitor.source,
-                "medium": event_data.get("medium") or visitor.medium,
-                "campaign": event_data.get("campaign") or visitor.campaign,
-                "credit": 0  # Will be calculated by attribution model
-            }
-            
-            touchpoints.append(touchpoint)
-            
-        return touchpoints
-        
-    def last_touch_attribution(self):
-        """100% credit to the last touchpoint"""
-        if not self.touchpoints:
-            return {"touchpoints": [], "total_credit": 0}
-            
-        # Give all credit to last touchpoint
-        self.touchpoints[-1]["credit"] = 100
-        
-        return {
-            "touchpoints": self.touchpoints,
-            "total_credit": 100,
-            "model": "last_touch"
-        }
-        
-    def first_touch_attribution(self):
-        """100% credit to the first touchpoint"""
-        if not self.touchpoints:
-            return {"touchpoints": [], "total_credit": 0}
-            
-        # Give all credit to first touchpoint
-        self.touchpoints[0]["credit"] = 100
-        
-        return {
-            "touchpoints": self.touchpoints,
-            "total_credit": 100,
-            "model": "first_touch"
-        }
-        
-    def linear_attribution(self):
-        """Equal credit to all touchpoints"""
-        if not self.touchpoints:
-            return {"touchpoints": [], "total_credit": 0}
-            
-        # Distribute credit equally
-        credit_per_touch = 100 / len(self.touchpoints)
-        
-        for touchpoint in self.touchpoints:
-            touchpoint["credit"] = round(credit_per_touch, 2)
-            
-        return {
-            "touchpoints": self.touchpoints,
-            "total_credit": 100,
-            "model": "linear"
-        }
-        
-    def time_decay_attribution(self):
-        """More credit to recent touchpoints"""
-        if not self.touchpoints:
-            return {"touchpoints": [], "total_credit": 0}
-            
-        # Calculate time-based weights
-        conversion_time = frappe.utils.get_datetime(self.touchpoints[-1]["timestamp"])
-        weights = []
-        
-        for touchpoint in self.touchpoints:
-            touch_time = frappe.utils.get_datetime(touchpoint["timestamp"])
-            days_before_conversion = (conversion_time - touch_time).days
-            
-            # Use exponential decay with 7-day half-life
-            weight = 2 ** (-days_before_conversion / 7)
-            weights.append(weight)
-            
-        # Normalize weights to sum to 100
-        total_weight = sum(weights)
-        
-        for i, touchpoint in enumerate(self.touchpoints):
-            touchpoint["credit"] = round((weights[i] / total_weight) * 100, 2)
-            
-        return {
-            "touchpoints": self.touchpoints,
-            "total_credit": 100,
-            "model": "time_decay"
-        }
-        
-    def position_based_attribution(self):
-        """40% first, 40% last, 20% middle touchpoints"""
+
         if not self.touchpoints:
             return {"touchpoints": [], "total_credit": 0}
-            
-        if len(self.touchpoints) == 1:
-            # Only one touchpoint gets all credit
-            self.touchpoints[0]["credit"] = 100
-        elif len(self.touchpoints) == 2:
-            # Split 50/50 between first and last
-            self.touchpoints[0]["credit"] = 50
-            self.touchpoints[1]["credit"] = 50
-        else:
-            # 40% first, 40% last, 20% distributed among middle
-            self.touchpoints[0]["credit"] = 40
-            self.touchpoints[-1]["credit"] = 40
-            
-            middle_count = len(self.touchpoints) - 2
-            middle_credit = 20 / middle_count
-            
-            for i in range(1, len(self.touchpoints) - 1):
-                self.touchpoints[i]["credit"] = round(middle_credit, 2)
-                
+
+        engine = AttributionEngine(self.attribution_model)
+        for touchpoint, credit in zip(self.touchpoints, engine.touch_credits(self.touchpoints)):
+            touchpoint["credit"] = round(credit * 100, 2)
+
         return {
             "touchpoints": self.touchpoints,
             "total_credit": 100,
-            "model": "position_based"
+            "model": engine.config.model_type
         }
 
+    def get_touchpoints(self):
+        """Get the visitor's touchpoints within the attribution window"""
+        attribution_window = frappe.db.get_single_value("TrackFlow Settings", "attribution_window_days") or 90
+
+        touchpoints = load_touchpoints(self.visitor_id, attribution_window)
+        for touchpoint in touchpoints:
+            touchpoint["credit"] = 0  # Will be calculated by attribution model
+
+        return touchpoints
+
 
 def get_attribution_summary(deal_name):
     """Get attribution summary for a deal"""
     deal = frappe.get_doc("CRM Deal", deal_name)
-    
+
     if not deal.trackflow_attribution_data:
         return None
-        
+
     attribution_data = json.loads(deal.trackflow_attribution_data)
-    
+
     # Summarize by source
     source_summary = {}
     for touchpoint in attribution_data.get("touchpoints", []):
         source = touchpoint.get("source", "direct")
         credit = touchpoint.get("credit", 0)
-        
+
         if source in source_summary:
             source_summary[source] += credit
         else:
             source_summary[source] = credit
-            
+
     # Summarize by campaign
     campaign_summary = {}
     for touchpoint in attribution_data.get("touchpoints", []):
         campaign = touchpoint.get("campaign")
         if campaign:
             credit = touchpoint.get("credit", 0)
-            
+
             if campaign in campaign_summary:
                 campaign_summary[campaign] += credit
             else:
                 campaign_summary[campaign] = credit
-                
+
     return {
         "model": attribution_data.get("model"),
         "touchpoint_count": len(attribution_data.get("touchpoints", [])),
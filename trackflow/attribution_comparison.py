@@ -0,0 +1,105 @@
+"""
+Attribution model comparison for TrackFlow
+
+Credits the deals won in a date range under every active Attribution
+Model side by side. Touchpoints are loaded once for the whole deal set,
+with the widest lookback of the models, and every model's kernel runs over
+the same touch arrays. Credited revenue is summed per (campaign, channel)
+and the result is cached per date range.
+"""
+
+import frappe
+import numpy as np
+from frappe.utils import add_days, flt, getdate, nowdate
+
+from trackflow.attribution import (
+    AttributionEngine,
+    get_touchpoint_loader,
+    get_won_deals,
+    load_deal_touches,
+)
+
+CACHE_TTL = 3600
+DEFAULT_DAYS = 90
+
+
+def get_attribution_comparison(from_date=None, to_date=None, campaign=None, refresh=False):
+    """Credited revenue per (campaign, channel) under every active model
+
+    Returns ``{"models": [...], "rows": [...]}``; each row has
+    ``campaign``, ``channel`` and one value per model name. Filtering by
+    campaign is applied to the cached result for the date range.
+    """
+    to_date = getdate(to_date or nowdate())
+    from_date = getdate(from_date or add_days(to_date, -DEFAULT_DAYS))
+
+    key = get_cache_key(from_date, to_date)
+    comparison = None if refresh else frappe.cache().get_value(key)
+    if comparison is None:
+        comparison = compare_models(get_active_models(), get_won_deals(from_date=from_date, to_date=to_date))
+        frappe.cache().set_value(key, comparison, expires_in_sec=CACHE_TTL)
+
+    if campaign:
+        comparison = dict(comparison, rows=[row for row in comparison["rows"] if row["campaign"] == campaign])
+    return comparison
+
+
+def get_cache_key(from_date, to_date):
+    return f"trackflow:attribution_comparison:{from_date}:{to_date}"
+
+
+def get_active_models():
+    return [
+        frappe.get_cached_doc("Attribution Model", name)
+        for name in frappe.get_all(
+            "Attribution Model", filters={"is_active": 1}, order_by="is_default desc, model_name asc", pluck="name"
+        )
+    ]
+
+
+def compare_models(models, deal_rows, loader=None):
+    """Credited revenue per (campaign, channel) for each model over one touch load"""
+    result = {"models": [model.name for model in models], "rows": []}
+    if not models or not deal_rows:
+        return result
+
+    loader = loader or get_touchpoint_loader()
+    lookbacks = [model.lookback_days for model in models]
+    # A model without a lookback needs the full history
+    touches = load_deal_touches(loader, deal_rows, max(lookbacks) if all(lookbacks) else None)
+    if not len(touches.deal):
+        return result
+
+    direct = np.array([loader.is_direct(code) for code in range(len(loader.channels))], dtype=bool)
+    names = [loader.channel_name(code) for code in range(len(loader.channels))]
+    deal_value = np.array([flt(row[3]) for row in deal_rows])
+
+    # (campaign, channel) group of every channel code
+    group_keys = {}
+    channel_group = np.array([
+        group_keys.setdefault((campaign, names[code]), len(group_keys))
+        for code, (_source, _medium, campaign) in enumerate(loader.channels)
+    ], dtype=np.int64)
+
+    credited = np.zeros((len(models), len(group_keys)))
+    for i, model in enumerate(models):
+        batch = AttributionEngine(model, loader).credit(
+            touches.deal, touches.seconds_before, touches.channel, len(deal_rows), direct, names
+        )
+        if len(batch.deal):
+            credited[i] = np.bincount(
+                channel_group[batch.channel],
+                weights=batch.weights * deal_value[batch.deal],
+                minlength=len(group_keys),
+            )
+
+    for (campaign, channel), group in group_keys.items():
+        if not credited[:, group].any():
+            continue
+        row = {"campaign": campaign, "channel": channel}
+        for model, value in zip(result["models"], credited[:, group].tolist()):
+            row[model] = flt(value, 2)
+        result["rows"].append(row)
+
+    result["rows"].sort(key=lambda row: -max(row[model] for model in result["models"]))
+    return result
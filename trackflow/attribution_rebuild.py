@@ -0,0 +1,166 @@
+"""
+Attribution rebuilds for TrackFlow
+
+Re-credits every won deal under one Attribution Model, for example after
+the default model changes. The deal set is split into chunks that run as
+separate jobs on the long queue, so several workers share the work. Each
+finished chunk is checkpointed in Redis: starting the rebuild again after
+a crash only queues the chunks that have no checkpoint yet. Progress is
+published to the Attribution Model form.
+"""
+
+import frappe
+from frappe.utils import cint, now_datetime
+
+from trackflow.attribution import AttributionEngine, get_won_deals, write_deal_attribution
+
+REBUILD_CHUNK_SIZE = 500
+REBUILD_QUEUE = "long"
+REBUILD_TIMEOUT = 1800
+REBUILD_EVENT = "trackflow_attribution_rebuild"
+
+# Rebuild state outlives the jobs by a week
+STATE_TTL = 7 * 24 * 3600
+
+
+def state_key(model):
+    return f"trackflow:attribution_rebuild:{model}"
+
+
+def chunk_key(rebuild_id, chunk):
+    return f"trackflow:attribution_rebuild:{rebuild_id}:chunk:{chunk}"
+
+
+def done_key(rebuild_id):
+    return f"trackflow:attribution_rebuild:{rebuild_id}:done"
+
+
+def get_rebuild_state(model):
+    return frappe.cache().get_value(state_key(model))
+
+
+def start_rebuild(model, from_date=None, to_date=None, restart=False, chunk_size=REBUILD_CHUNK_SIZE):
+    """Queue a rebuild of ``model``, or resume the unfinished one
+
+    Returns the rebuild state.
+    """
+    state = get_rebuild_state(model)
+    if state and not state.finished_on and not restart:
+        enqueue_pending_chunks(state)
+        publish_progress(state)
+        return state
+
+    cache = frappe.cache()
+    deals = [row[0] for row in get_won_deals(from_date=from_date, to_date=to_date)]
+    chunk_size = cint(chunk_size) or REBUILD_CHUNK_SIZE
+
+    state = frappe._dict(
+        rebuild_id=frappe.generate_hash(length=10),
+        model=model,
+        from_date=from_date,
+        to_date=to_date,
+        deals=len(deals),
+        chunks=(len(deals) + chunk_size - 1) // chunk_size,
+        started_on=now_datetime(),
+        finished_on=None if deals else now_datetime(),
+    )
+    for chunk, i in enumerate(range(0, len(deals), chunk_size)):
+        cache.set_value(chunk_key(state.rebuild_id, chunk), deals[i:i + chunk_size], expires_in_sec=STATE_TTL)
+    cache.set_value(state_key(model), state, expires_in_sec=STATE_TTL)
+
+    enqueue_pending_chunks(state)
+    publish_progress(state)
+    return state
+
+
+def enqueue_pending_chunks(state):
+    done = get_done_chunks(state)
+    for chunk in range(state.chunks):
+        if chunk in done:
+            continue
+        frappe.enqueue(
+            "trackflow.attribution_rebuild.rebuild_chunk",
+            queue=REBUILD_QUEUE,
+            timeout=REBUILD_TIMEOUT,
+            job_id=f"trackflow-attribution-rebuild-{state.rebuild_id}-{chunk}",
+            deduplicate=True,
+            enqueue_after_commit=True,
+            model=state.model,
+            rebuild_id=state.rebuild_id,
+            chunk=chunk,
+        )
+
+
+def get_done_chunks(state):
+    return {cint(frappe.safe_decode(chunk)) for chunk in frappe.cache().smembers(done_key(state.rebuild_id))}
+
+
+def rebuild_chunk(model, rebuild_id, chunk):
+    """Background job: re-credit one chunk of deals and checkpoint it"""
+    state = get_rebuild_state(model)
+    if not state or state.rebuild_id != rebuild_id:
+        # Superseded by a restart
+        return
+
+    cache = frappe.cache()
+    if cache.sismember(done_key(rebuild_id), chunk):
+        return
+
+    deals = cache.get_value(chunk_key(rebuild_id, chunk))
+    if deals:
+        attribution_model = frappe.get_doc("Attribution Model", model)
+        deal_rows = get_won_deals(deals=deals)
+        write_deal_attribution(
+            attribution_model, deal_rows, AttributionEngine(attribution_model).credit_deals(deal_rows)
+        )
+        frappe.db.commit()
+
+    cache.sadd(done_key(rebuild_id), chunk)
+    cache.expire(cache.make_key(done_key(rebuild_id)), STATE_TTL)
+
+    if len(get_done_chunks(state)) >= state.chunks and not state.finished_on:
+        state.finished_on = now_datetime()
+        cache.set_value(state_key(model), state, expires_in_sec=STATE_TTL)
+
+    publish_progress(state)
+
+
+def get_progress(state):
+    done = len(get_done_chunks(state))
+    return {
+        "model": state.model,
+        "rebuild_id": state.rebuild_id,
+        "deals": state.deals,
+        "chunks": state.chunks,
+        "done": done,
+        "percent": round(done * 100 / state.chunks, 1) if state.chunks else 100,
+        "started_on": str(state.started_on),
+        "finished": bool(state.finished_on),
+    }
+
+
+def publish_progress(state):
+    frappe.publish_realtime(
+        REBUILD_EVENT,
+        get_progress(state),
+        doctype="Attribution Model",
+        docname=state.model,
+    )
+
+
+@frappe.whitelist()
+def rebuild_attribution(model, from_date=None, to_date=None, restart=0):
+    """Rebuild (or resume rebuilding) attribution for every won deal under ``model``"""
+    frappe.get_doc("Attribution Model", model).check_permission("write")
+
+    state = start_rebuild(model, from_date, to_date, restart=cint(restart))
+    return get_progress(state)
+
+
+@frappe.whitelist()
+def get_rebuild_status(model):
+    """Progress of the latest rebuild of ``model``, if any"""
+    frappe.get_doc("Attribution Model", model).check_permission("read")
+
+    state = get_rebuild_state(model)
+    return get_progress(state) if state else None
@@ -0,0 +1,222 @@
+"""
+Cohort retention engine for TrackFlow
+
+Visitors are grouped by the week of their first click and the campaign that
+click belonged to. For every cohort the engine counts how many visitors
+clicked again, or converted, in each following week.
+
+Click Event and Conversion are each streamed once in index order into flat
+(visitor, week) arrays. Every cohort matrix is then produced by a single
+``numpy.bincount`` over the flattened (campaign, cohort, offset) cell index,
+and each campaign's matrix is cached.
+"""
+
+import frappe
+import numpy as np
+from frappe.utils import add_days, get_datetime, getdate, nowdate
+
+DEFAULT_PERIODS = 12
+CACHE_TTL = 3600
+
+ALL_CAMPAIGNS = "__all__"
+
+
+def get_cohort_matrix(campaign=None, from_date=None, to_date=None, periods=DEFAULT_PERIODS, refresh=False):
+    """Cohort matrix for one campaign (or all campaigns), served from cache
+
+    A cache miss computes the matrices for every campaign in one pass and
+    caches each of them, so later requests for other campaigns are hits.
+    A campaign without cohorts has its empty matrix cached as well.
+    """
+    to_date = getdate(to_date or nowdate())
+    from_date = getdate(from_date or add_days(to_date, -7 * DEFAULT_PERIODS))
+    periods = max(int(periods or DEFAULT_PERIODS), 1)
+
+    key = get_cache_key(campaign, from_date, to_date, periods)
+    if not refresh:
+        cached = frappe.cache().get_value(key)
+        if cached:
+            return cached
+
+    matrices = compute_cohorts(from_date, to_date, periods)
+    matrices.setdefault(campaign or ALL_CAMPAIGNS, empty_matrix(periods))
+    for name, matrix in matrices.items():
+        frappe.cache().set_value(
+            get_cache_key(name, from_date, to_date, periods), matrix, expires_in_sec=CACHE_TTL
+        )
+
+    return matrices[campaign or ALL_CAMPAIGNS]
+
+
+def get_cache_key(campaign, from_date, to_date, periods):
+    return f"trackflow:cohort:{campaign or ALL_CAMPAIGNS}:{from_date}:{to_date}:{periods}"
+
+
+def compute_cohorts(from_date, to_date, periods):
+    """Matrices for every campaign plus the combined one, keyed by campaign"""
+    clicks = load_clicks(add_days(to_date, 7 * periods))
+    if not clicks.visitor_ids:
+        return {}
+
+    # The first cohort week can start up to six days before from_date
+    conversions = load_conversions(
+        clicks.visitor_index, add_days(from_date, -7), add_days(to_date, 7 * periods)
+    )
+
+    start_week = to_week(np.array([from_date], dtype="datetime64[D]"))[0]
+    end_week = to_week(np.array([to_date], dtype="datetime64[D]"))[0]
+    n_cohorts = int(end_week - start_week) + 1
+
+    returned = count_cells(clicks, clicks.visitor, clicks.week, start_week, n_cohorts, periods)
+    converted = count_cells(clicks, conversions[0], conversions[1], start_week, n_cohorts, periods)
+    sizes = count_sizes(clicks, start_week, n_cohorts)
+
+    # Every cohort member clicked in its first week by definition
+    returned[:, :, 0] = sizes
+
+    matrices = {
+        ALL_CAMPAIGNS: build_matrix(
+            sizes.sum(axis=0), returned.sum(axis=0), converted.sum(axis=0), start_week, periods
+        )
+    }
+    for code, name in enumerate(clicks.campaigns):
+        if name and sizes[code].any():
+            matrices[name] = build_matrix(sizes[code], returned[code], converted[code], start_week, periods)
+
+    return matrices
+
+
+def load_clicks(until):
+    """Stream every click up to ``until`` once, in timestamp order
+
+    The first click seen for a visitor fixes its cohort week and campaign.
+    """
+    visitor_index = {}
+    first_campaign = []
+    campaign_codes = {}
+    campaigns = []
+    visitor = []
+    timestamps = []
+
+    rows = frappe.db.sql(
+        """
+        SELECT visitor_id, campaign, click_timestamp
+        FROM `tabClick Event`
+        WHERE click_timestamp < %s
+            AND visitor_id IS NOT NULL AND visitor_id != ''
+        ORDER BY click_timestamp
+        """,
+        until,
+        as_iterator=True,
+    )
+
+    for visitor_id, campaign, timestamp in rows:
+        idx = visitor_index.get(visitor_id)
+        if idx is None:
+            idx = visitor_index[visitor_id] = len(first_campaign)
+            code = campaign_codes.get(campaign)
+            if code is None:
+                code = campaign_codes[campaign] = len(campaigns)
+                campaigns.append(campaign)
+            first_campaign.append(code)
+        visitor.append(idx)
+        timestamps.append(get_datetime(timestamp))
+
+    visitor = np.asarray(visitor, dtype=np.int64)
+    week = to_week(np.asarray(timestamps, dtype="datetime64[D]"))
+
+    first_week = np.full(len(first_campaign), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first_week, visitor, week)
+
+    return frappe._dict(
+        visitor_ids=list(visitor_index),
+        visitor_index=visitor_index,
+        campaigns=campaigns,
+        first_campaign=np.asarray(first_campaign, dtype=np.int64),
+        first_week=first_week,
+        visitor=visitor,
+        week=week,
+    )
+
+
+def load_conversions(visitor_index, from_date, until):
+    """(visitor, week) arrays for conversions by visitors that have clicked"""
+    visitor = []
+    timestamps = []
+
+    rows = frappe.db.sql(
+        """
+        SELECT visitor_id, conversion_timestamp
+        FROM `tabConversion`
+        WHERE conversion_timestamp >= %s AND conversion_timestamp < %s
+            AND visitor_id IS NOT NULL AND visitor_id != ''
+        """,
+        (from_date, until),
+        as_iterator=True,
+    )
+
+    for visitor_id, timestamp in rows:
+        idx = visitor_index.get(visitor_id)
+        if idx is not None and timestamp:
+            visitor.append(idx)
+            timestamps.append(get_datetime(timestamp))
+
+    return (
+        np.asarray(visitor, dtype=np.int64),
+        to_week(np.asarray(timestamps, dtype="datetime64[D]")),
+    )
+
+
+def to_week(days):
+    """Monday-aligned week number since the epoch for datetime64[D] values"""
+    # 1970-01-01 was a Thursday, so shifting by three days aligns on Monday
+    return (days.astype(np.int64) + 3) // 7
+
+
+def count_sizes(clicks, start_week, n_cohorts):
+    """Visitors per (campaign, cohort week)"""
+    cohort = clicks.first_week - start_week
+    mask = (cohort >= 0) & (cohort < n_cohorts)
+    cells = clicks.first_campaign[mask] * n_cohorts + cohort[mask]
+    n_campaigns = len(clicks.campaigns)
+    return np.bincount(cells, minlength=n_campaigns * n_cohorts).reshape(n_campaigns, n_cohorts)
+
+
+def count_cells(clicks, visitor, week, start_week, n_cohorts, periods):
+    """Distinct visitors active per (campaign, cohort week, weeks since first click)"""
+    n_campaigns = len(clicks.campaigns)
+    shape = (n_campaigns, n_cohorts, periods)
+    if not len(visitor):
+        return np.zeros(shape, dtype=np.int64)
+
+    first_week = clicks.first_week[visitor]
+    offset = week - first_week
+    cohort = first_week - start_week
+    mask = (offset >= 0) & (offset < periods) & (cohort >= 0) & (cohort < n_cohorts)
+
+    # A visitor counts once per week however many times it was active
+    pairs = np.unique(visitor[mask] * periods + offset[mask])
+    visitor, offset = pairs // periods, pairs % periods
+
+    cells = (
+        clicks.first_campaign[visitor] * n_cohorts + (clicks.first_week[visitor] - start_week)
+    ) * periods + offset
+    return np.bincount(cells, minlength=n_campaigns * n_cohorts * periods).reshape(shape)
+
+
+def build_matrix(sizes, returned, converted, start_week, periods):
+    """Serialisable cohort matrix, keeping only cohorts that have visitors"""
+    rows = np.flatnonzero(sizes)
+    weeks = (np.asarray(start_week + rows, dtype=np.int64) * 7 - 3).astype("datetime64[D]")
+
+    return {
+        "periods": periods,
+        "weeks": [str(week) for week in weeks],
+        "sizes": sizes[rows].tolist(),
+        "returned": returned[rows].tolist(),
+        "converted": converted[rows].tolist(),
+    }
+
+
+def empty_matrix(periods):
+    return {"periods": periods, "weeks": [], "sizes": [], "returned": [], "converted": []}
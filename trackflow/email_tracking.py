@@ -0,0 +1,442 @@
+"""
+Buffered email engagement tracking for TrackFlow
+
+The open pixel and click redirect only append a compact event to a Redis
+list and return. A scheduled job drains the list in batches and folds the
+events into Email Campaign Log counters: one row per (campaign, recipient)
+for opens and per (campaign, recipient, link) for clicks, so repeated
+opens raise a count instead of adding rows.
+
+Each batch is claimed atomically: its events are moved to a processing list
+under a new batch id, and the id is stored with the counters in the same
+transaction. A flush that fails before its commit is replayed by the next
+run, and one that fails after it is recognised by the id and only released,
+so events are neither lost nor counted twice.
+
+Engagement is also rolled up per campaign and day in Email Campaign Daily
+Stats. Every recipient is numbered within its campaign when the email is
+sent, and each rollup row keeps bitmaps of the recipients who opened and
+clicked that day. Unique counts over any date range are the popcount of
+the OR of the daily bitmaps, so no DISTINCT scan is needed.
+"""
+
+import base64
+import hashlib
+import json
+import zlib
+
+import frappe
+from frappe.utils import flt, getdate, now, now_datetime
+
+EVENTS_KEY = "trackflow:email_events"
+PROCESSING_KEY = "trackflow:email_events:processing"
+BATCH_KEY = "trackflow:email_events:batch"
+
+# Global default holding the id of the last batch written to the database
+FLUSHED_BATCH_KEY = "trackflow_flushed_email_batch"
+
+# Moves up to ARGV[1] events to the processing list under batch id ARGV[2];
+# a batch left there by a failed flush is returned again instead
+CLAIM_SCRIPT = """
+local batch = redis.call('GET', KEYS[3])
+if not batch then
+    if redis.call('LLEN', KEYS[1]) == 0 then
+        return nil
+    end
+    for _ = 1, tonumber(ARGV[1]) do
+        if not redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT') then
+            break
+        end
+    end
+    redis.call('SET', KEYS[3], ARGV[2])
+    batch = ARGV[2]
+end
+return {batch, redis.call('LRANGE', KEYS[2], 0, -1)}
+"""
+
+FLUSH_BATCH_SIZE = 5000
+FLUSH_MAX_BATCHES = 20
+INSERT_CHUNK_SIZE = 500
+
+# Journey touchpoint recorded for each event type
+TOUCHPOINT_TYPES = {"opened": "email_open", "clicked": "email_click"}
+
+USER_AGENT_LENGTH = 500
+
+
+def get_recipient_id(campaign, recipient):
+    """Recipient id carried in tracking URLs"""
+    return hashlib.md5(f"{campaign}_{recipient}".encode()).hexdigest()[:8]
+
+
+def buffer_email_event(event_type, campaign, recipient, link=None, ip_address=None, user_agent=None, visitor=None):
+    """Append one open or click to the buffer"""
+    event = [event_type, campaign, recipient, link, now(), ip_address, (user_agent or "")[:USER_AGENT_LENGTH], visitor]
+    frappe.cache().rpush(EVENTS_KEY, json.dumps(event))
+
+
+def flush_email_events(batch_size=FLUSH_BATCH_SIZE, max_batches=FLUSH_MAX_BATCHES):
+    """Move buffered events into Email Campaign Log; returns the number flushed"""
+    cache = frappe.cache()
+    flushed = 0
+
+    for _batch in range(max_batches):
+        claimed = claim_email_events(cache, batch_size)
+        if not claimed:
+            break
+
+        batch_id, raw = frappe.safe_decode(claimed[0]), claimed[1]
+        if get_flushed_batch() != batch_id:
+            events = [json.loads(frappe.safe_decode(event)) for event in raw]
+            upsert_email_log(aggregate_email_events(events))
+            update_engagement_rollups(events)
+            record_email_touchpoints(events)
+            frappe.db.set_global(FLUSHED_BATCH_KEY, batch_id)
+            frappe.db.commit()
+            flushed += len(raw)
+
+        cache.pipeline().delete(cache.make_key(PROCESSING_KEY), cache.make_key(BATCH_KEY)).execute()
+        if len(raw) < batch_size:
+            break
+
+    return flushed
+
+
+def claim_email_events(cache, batch_size):
+    """(batch id, events) of the batch to flush, or None if the buffer is empty"""
+    claim = cache.register_script(CLAIM_SCRIPT)
+    return claim(
+        keys=[cache.make_key(EVENTS_KEY), cache.make_key(PROCESSING_KEY), cache.make_key(BATCH_KEY)],
+        args=[batch_size, frappe.generate_hash(length=20)],
+    )
+
+
+def get_flushed_batch():
+    """Id of the last batch written, locked until commit"""
+    return frappe.db.get_value(
+        "DefaultValue", {"parent": "__global", "defkey": FLUSHED_BATCH_KEY}, "defvalue", for_update=True
+    )
+
+
+def get_log_name(event_type, campaign, recipient, link=None):
+    """Deterministic row name so a counter is upserted in place"""
+    key = "\n".join(str(part or "") for part in (event_type, campaign, recipient, link))
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def aggregate_email_events(events):
+    """{log name: row} with opens and clicks counted per recipient"""
+    rows = {}
+    for event_type, campaign, recipient, link, timestamp, ip_address, user_agent, _visitor in events:
+        opened = event_type == "opened"
+        if opened:
+            link = None
+
+        name = get_log_name(event_type, campaign, recipient, link)
+        row = rows.get(name)
+        if row is None:
+            row = rows[name] = frappe._dict(
+                event_type=event_type,
+                campaign=campaign,
+                recipient_id=recipient,
+                tracking_link=link,
+                timestamp=timestamp,
+                last_event=timestamp,
+                open_count=0,
+                click_count=0,
+                ip_address=ip_address,
+                user_agent=user_agent,
+            )
+
+        row["open_count" if opened else "click_count"] += 1
+        row.timestamp = min(row.timestamp, timestamp)
+        row.last_event = max(row.last_event, timestamp)
+
+    return rows
+
+
+def upsert_email_log(rows):
+    """Add aggregated counters onto Email Campaign Log"""
+    now_ts = now_datetime()
+    values = [
+        (
+            name, now_ts, now_ts, "Guest", "Guest",
+            row.timestamp, row.last_event, row.event_type, row.campaign, row.recipient_id,
+            row.tracking_link, row.open_count, row.click_count, row.ip_address, row.user_agent,
+        )
+        for name, row in rows.items()
+    ]
+
+    for i in range(0, len(values), INSERT_CHUNK_SIZE):
+        chunk = values[i:i + INSERT_CHUNK_SIZE]
+        frappe.db.sql(
+            """
+            INSERT INTO `tabEmail Campaign Log`
+                (name, creation, modified, owner, modified_by,
+                timestamp, last_event, event_type, campaign, recipient_id,
+                tracking_link, open_count, click_count, ip_address, user_agent)
+            VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE
+                open_count = open_count + VALUES(open_count),
+                click_count = click_count + VALUES(click_count),
+                last_event = GREATEST(last_event, VALUES(last_event)),
+                modified = VALUES(modified)
+            """.format(placeholders=", ".join(["(" + ", ".join(["%s"] * 15) + ")"] * len(chunk))),
+            [v for row in chunk for v in row],
+        )
+
+
+def record_email_touchpoints(events):
+    """Add opens and clicks to the journeys of the visitors behind them"""
+    events = [event for event in events if event[7]]
+    if not events:
+        return
+
+    from trackflow.journey import record_touchpoints
+
+    campaigns = set(
+        frappe.get_all("Link Campaign", filters={"name": ["in", list({event[1] for event in events})]}, pluck="name")
+    )
+    record_touchpoints([
+        {
+            "visitor": visitor,
+            "touchpoint_type": TOUCHPOINT_TYPES[event_type],
+            "timestamp": timestamp,
+            "campaign": campaign if campaign in campaigns else None,
+            "source": "email",
+            "medium": "email",
+            "tracked_link": link,
+        }
+        for event_type, campaign, _recipient, link, timestamp, _ip, _user_agent, visitor in events
+    ])
+
+
+def encode_bitmap(bits):
+    if not bits:
+        return ""
+    return base64.b64encode(zlib.compress(bits.to_bytes((bits.bit_length() + 7) // 8, "little"))).decode()
+
+
+def decode_bitmap(value):
+    return int.from_bytes(zlib.decompress(base64.b64decode(value)), "little") if value else 0
+
+
+def get_recipient_name(campaign, recipient_id):
+    return hashlib.md5(f"{campaign}\n{recipient_id}".encode()).hexdigest()
+
+
+def get_stats_name(campaign, stats_date):
+    """Deterministic row name so a (campaign, day) pair is upserted in place"""
+    return f"{getdate(stats_date)}-{campaign}"
+
+
+def record_email_sends(campaign, recipients, sent_on=None):
+    """Number new recipients of ``campaign`` and add them to the day's sends
+
+    Recipients already sent this campaign keep their number and are not
+    counted again. Returns the number of new recipients.
+    """
+    sent_on = sent_on or now_datetime()
+    pending = {}
+    for recipient in recipients:
+        recipient_id = get_recipient_id(campaign, recipient)
+        pending[get_recipient_name(campaign, recipient_id)] = (recipient, recipient_id)
+
+    names = list(pending)
+    for i in range(0, len(names), INSERT_CHUNK_SIZE):
+        for name in frappe.db.sql(
+            """SELECT name FROM `tabEmail Campaign Recipient` WHERE name IN %(names)s""",
+            {"names": tuple(names[i:i + INSERT_CHUNK_SIZE])},
+            pluck=True,
+        ):
+            pending.pop(name, None)
+
+    if not pending:
+        return 0
+
+    # Locks the campaign's numbering until commit
+    next_index = frappe.db.sql(
+        """
+        SELECT IFNULL(MAX(recipient_index), -1) + 1
+        FROM `tabEmail Campaign Recipient`
+        WHERE campaign = %s
+        FOR UPDATE
+        """,
+        (campaign,),
+    )[0][0]
+
+    fields = ["name", "creation", "modified", "owner", "modified_by",
+              "campaign", "recipient", "recipient_id", "recipient_index", "sent_on"]
+    rows = [
+        (name, sent_on, sent_on, "Administrator", "Administrator",
+         campaign, recipient, recipient_id, next_index + i, sent_on)
+        for i, (name, (recipient, recipient_id)) in enumerate(pending.items())
+    ]
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        frappe.db.bulk_insert("Email Campaign Recipient", fields, rows[i:i + INSERT_CHUNK_SIZE])
+
+    add_daily_sends(campaign, sent_on, len(rows))
+    return len(rows)
+
+
+def get_recipient_indexes(pairs):
+    """{(campaign, recipient id): bit} for recipients numbered at send time"""
+    names = {get_recipient_name(campaign, recipient): (campaign, recipient) for campaign, recipient in pairs}
+    indexes = {}
+    keys = list(names)
+    for i in range(0, len(keys), INSERT_CHUNK_SIZE):
+        for name, recipient_index in frappe.db.sql(
+            """SELECT name, recipient_index FROM `tabEmail Campaign Recipient` WHERE name IN %(names)s""",
+            {"names": tuple(keys[i:i + INSERT_CHUNK_SIZE])},
+        ):
+            indexes[names[name]] = recipient_index
+    return indexes
+
+
+def fold_engagement(events, indexes):
+    """{(campaign, day): counters and bitmaps} for a batch of events
+
+    A click also marks the recipient as having opened, since images are
+    often blocked and the pixel never loads.
+    """
+    days = {}
+    for event_type, campaign, recipient, _link, timestamp, _ip, _user_agent, _visitor in events:
+        if not campaign:
+            continue
+
+        day = days.setdefault(
+            (campaign, timestamp[:10]), {"opens": 0, "clicks": 0, "open_bits": 0, "click_bits": 0}
+        )
+        index = indexes.get((campaign, recipient))
+        bit = 1 << index if index is not None else 0
+
+        if event_type == "opened":
+            day["opens"] += 1
+            day["open_bits"] |= bit
+        else:
+            day["clicks"] += 1
+            day["open_bits"] |= bit
+            day["click_bits"] |= bit
+
+    return days
+
+
+def update_engagement_rollups(events):
+    """Fold a batch of buffered events into Email Campaign Daily Stats"""
+    indexes = get_recipient_indexes({(event[1], event[2]) for event in events if event[1] and event[2]})
+    days = fold_engagement(events, indexes)
+    if not days:
+        return
+
+    names = {get_stats_name(campaign, day): (campaign, day) for campaign, day in days}
+    # Locked so bitmaps merged here are not overwritten by a concurrent flush
+    for name, open_bitmap, click_bitmap in frappe.db.sql(
+        """
+        SELECT name, open_bitmap, click_bitmap
+        FROM `tabEmail Campaign Daily Stats`
+        WHERE name IN %(names)s
+        FOR UPDATE
+        """,
+        {"names": tuple(names)},
+    ):
+        day = days[names[name]]
+        day["open_bits"] |= decode_bitmap(open_bitmap)
+        day["click_bits"] |= decode_bitmap(click_bitmap)
+
+    upsert_daily_engagement(days)
+
+
+def add_daily_sends(campaign, stats_date, sends):
+    now_ts = now_datetime()
+    frappe.db.sql(
+        """
+        INSERT INTO `tabEmail Campaign Daily Stats`
+            (name, creation, modified, owner, modified_by, campaign, stats_date, sends)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            sends = sends + VALUES(sends),
+            modified = VALUES(modified)
+        """,
+        (get_stats_name(campaign, stats_date), now_ts, now_ts, "Administrator", "Administrator",
+         campaign, getdate(stats_date), sends),
+    )
+
+
+def upsert_daily_engagement(days):
+    """Add opens and clicks onto the rollups and store the merged bitmaps
+
+    ``days`` holds the complete bitmaps of each day, already merged with
+    the stored ones.
+    """
+    now_ts = now_datetime()
+    values = []
+    for (campaign, day), counters in days.items():
+        unique_opens = counters["open_bits"].bit_count()
+        unique_clicks = counters["click_bits"].bit_count()
+        values.append((
+            get_stats_name(campaign, day), now_ts, now_ts, "Administrator", "Administrator",
+            campaign, day, counters["opens"], counters["clicks"],
+            unique_opens, unique_clicks, flt(unique_clicks * 100 / unique_opens, 2) if unique_opens else 0,
+            encode_bitmap(counters["open_bits"]), encode_bitmap(counters["click_bits"]),
+        ))
+
+    for i in range(0, len(values), INSERT_CHUNK_SIZE):
+        chunk = values[i:i + INSERT_CHUNK_SIZE]
+        frappe.db.sql(
+            """
+            INSERT INTO `tabEmail Campaign Daily Stats`
+                (name, creation, modified, owner, modified_by,
+                campaign, stats_date, opens, clicks,
+                unique_opens, unique_clicks, click_to_open_rate,
+                open_bitmap, click_bitmap)
+            VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE
+                opens = opens + VALUES(opens),
+                clicks = clicks + VALUES(clicks),
+                unique_opens = VALUES(unique_opens),
+                unique_clicks = VALUES(unique_clicks),
+                click_to_open_rate = VALUES(click_to_open_rate),
+                open_bitmap = VALUES(open_bitmap),
+                click_bitmap = VALUES(click_bitmap),
+                modified = VALUES(modified)
+            """.format(placeholders=", ".join(["(" + ", ".join(["%s"] * 14) + ")"] * len(chunk))),
+            [v for row in chunk for v in row],
+        )
+
+
+def get_campaign_engagement(campaign, from_date=None, to_date=None):
+    """Sends, opens, clicks and unique engagement of a campaign from its rollups"""
+    filters = {"campaign": campaign}
+    if from_date and to_date:
+        filters["stats_date"] = ["between", [getdate(from_date), getdate(to_date)]]
+    elif from_date:
+        filters["stats_date"] = [">=", getdate(from_date)]
+    elif to_date:
+        filters["stats_date"] = ["<=", getdate(to_date)]
+
+    rows = frappe.get_all(
+        "Email Campaign Daily Stats",
+        filters=filters,
+        fields=["stats_date", "sends", "opens", "clicks", "unique_opens", "unique_clicks",
+                "click_to_open_rate", "open_bitmap", "click_bitmap"],
+        order_by="stats_date asc",
+    )
+
+    opened = clicked = 0
+    for row in rows:
+        opened |= decode_bitmap(row.pop("open_bitmap"))
+        clicked |= decode_bitmap(row.pop("click_bitmap"))
+
+    sent = sum(row.sends for row in rows)
+    unique_opens, unique_clicks = opened.bit_count(), clicked.bit_count()
+    return {
+        "sent": sent,
+        "opens": sum(row.opens for row in rows),
+        "clicks": sum(row.clicks for row in rows),
+        "opened": unique_opens,
+        "clicked": unique_clicks,
+        "open_rate": unique_opens / sent * 100 if sent else 0,
+        "click_rate": unique_clicks / sent * 100 if sent else 0,
+        "click_to_open_rate": unique_clicks / unique_opens * 100 if unique_opens else 0,
+        "daily": rows,
+    }
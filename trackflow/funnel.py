@@ -0,0 +1,218 @@
+"""
+Conversion funnel engine for TrackFlow
+
+Builds one stage bitmap per visitor, with the first timestamp at which the
+visitor reached each stage, from a single time-ordered pass over every
+source table involved in the funnel. Stage counts, drop-off, stage value and
+time-to-convert percentiles are then derived in memory in one place.
+"""
+
+import frappe
+from frappe.utils import flt, get_datetime
+
+
+# Source tables a funnel stage can be built on. ``match`` is the column a
+# stage's match values are compared against, ``matched_timestamp`` is used
+# instead of ``timestamp`` when a stage filters on a status (e.g. the time a
+# deal was won rather than created).
+FUNNEL_SOURCES = {
+    "Click Event": {
+        "visitor": "visitor_id",
+        "timestamp": "click_timestamp",
+        "match": "event_type",
+        "campaign": "campaign",
+    },
+    "Visitor Event": {
+        "visitor": "visitor",
+        "timestamp": "timestamp",
+        "match": "event_type",
+    },
+    "Conversion": {
+        "visitor": "visitor_id",
+        "timestamp": "conversion_timestamp",
+        "match": "conversion_type",
+        "campaign": "campaign",
+        "value": "conversion_value",
+    },
+    "CRM Lead": {
+        "visitor": "trackflow_visitor_id",
+        "timestamp": "creation",
+        "match": "status",
+        "matched_timestamp": "modified",
+        "campaign": "trackflow_campaign",
+    },
+    "CRM Deal": {
+        "visitor": "trackflow_visitor_id",
+        "timestamp": "creation",
+        "match": "status",
+        "matched_timestamp": "modified",
+        "value": "annual_revenue",
+    },
+}
+
+DEFAULT_STAGES = [
+    {"stage_name": "Visited Site", "source": "Click Event"},
+    {"stage_name": "Viewed Product/Service", "source": "Visitor Event", "match_values": "pageview, page_view"},
+    {"stage_name": "Submitted Form", "source": "Conversion", "match_values": "Contact Form, Demo Request, Sign Up"},
+    {"stage_name": "Became Lead", "source": "CRM Lead"},
+    {"stage_name": "Converted to Deal", "source": "CRM Deal"},
+    {"stage_name": "Deal Won", "source": "CRM Deal", "match_values": "Won"},
+]
+
+
+def get_funnel_stages(funnel=None):
+    """Stage definitions for a Funnel Definition, or the default funnel"""
+    if not funnel:
+        funnel = frappe.db.get_value("Funnel Definition", {"is_default": 1}, "name")
+
+    if funnel:
+        doc = frappe.get_cached_doc("Funnel Definition", funnel)
+        return [
+            {"stage_name": s.stage_name, "source": s.source, "match_values": s.match_values}
+            for s in doc.stages
+        ]
+
+    return [dict(stage) for stage in DEFAULT_STAGES]
+
+
+def parse_match_values(match_values):
+    """Comma or newline separated match values as a frozenset (None = any)"""
+    if not match_values:
+        return None
+    values = {v.strip() for v in match_values.replace("\n", ",").split(",") if v.strip()}
+    return frozenset(values) or None
+
+
+class FunnelEngine:
+    """Single-scan conversion funnel over the TrackFlow source tables"""
+
+    def __init__(self, stages, filters=None):
+        self.stages = stages
+        self.filters = frappe._dict(filters or {})
+        self.matchers = [parse_match_values(s.get("match_values")) for s in stages]
+
+        # visitor -> [bitmap, [first timestamp per stage], [value per stage]]
+        self.visitors = {}
+
+    def run(self):
+        """Scan every source once and return the computed funnel"""
+        for source in self._sources():
+            self.scan(source)
+        return self.compute()
+
+    def _sources(self):
+        seen = []
+        for stage in self.stages:
+            if stage["source"] not in seen:
+                seen.append(stage["source"])
+        return seen
+
+    def scan(self, source):
+        """One time-ordered pass over a source table, feeding every stage built on it"""
+        spec = FUNNEL_SOURCES.get(source)
+        if not spec or not frappe.db.table_exists(source):
+            return
+
+        stage_idx = [i for i, s in enumerate(self.stages) if s["source"] == source]
+        columns = [
+            spec["visitor"],
+            spec["timestamp"],
+            spec["match"],
+            spec.get("value") or "NULL",
+            spec.get("matched_timestamp") or spec["timestamp"],
+        ]
+        conditions = [f"`{spec['visitor']}` IS NOT NULL", f"`{spec['visitor']}` != ''"]
+        if self.filters.get("from_date"):
+            conditions.append(f"`{spec['timestamp']}` >= %(from_date)s")
+        if self.filters.get("to_date"):
+            conditions.append(f"`{spec['timestamp']}` < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)")
+        if self.filters.get("campaign") and spec.get("campaign"):
+            conditions.append(f"`{spec['campaign']}` = %(campaign)s")
+
+        rows = frappe.db.sql(
+            """
+            SELECT {columns}
+            FROM `tab{source}`
+            WHERE {conditions}
+            ORDER BY `{timestamp}`
+            """.format(
+                columns=", ".join(c if c == "NULL" else f"`{c}`" for c in columns),
+                source=source,
+                conditions=" AND ".join(conditions),
+                timestamp=spec["timestamp"],
+            ),
+            self.filters,
+            as_iterator=True,
+        )
+
+        for visitor, timestamp, match, value, matched_timestamp in rows:
+            for idx in stage_idx:
+                allowed = self.matchers[idx]
+                if allowed is None:
+                    self.add(idx, visitor, timestamp, value)
+                elif match in allowed:
+                    self.add(idx, visitor, matched_timestamp or timestamp, value)
+
+    def add(self, stage_idx, visitor, timestamp, value=None):
+        """Record that a visitor reached a stage; the earliest timestamp wins"""
+        state = self.visitors.get(visitor)
+        if state is None:
+            n = len(self.stages)
+            state = self.visitors[visitor] = [0, [None] * n, [0.0] * n]
+
+        timestamp = get_datetime(timestamp) if timestamp else None
+        bit = 1 << stage_idx
+        if not state[0] & bit:
+            state[0] |= bit
+            state[1][stage_idx] = timestamp
+            state[2][stage_idx] = flt(value)
+        elif timestamp and (state[1][stage_idx] is None or timestamp < state[1][stage_idx]):
+            state[1][stage_idx] = timestamp
+
+    def compute(self):
+        """Stage counts, drop-off, value and time-to-convert from the bitmaps
+
+        A visitor counts towards a stage only if every earlier stage was also
+        reached. Time to convert is measured from the first stage.
+        """
+        n = len(self.stages)
+        counts = [0] * n
+        values = [0.0] * n
+        durations = [[] for _ in range(n)]
+
+        for bitmap, timestamps, stage_values in self.visitors.values():
+            start = timestamps[0]
+            for idx in range(n):
+                if not bitmap & (1 << idx):
+                    break
+                counts[idx] += 1
+                values[idx] += stage_values[idx]
+                if idx and start and timestamps[idx]:
+                    durations[idx].append(max((timestamps[idx] - start).total_seconds(), 0))
+
+        total = counts[0] if n else 0
+        result = []
+        for idx, stage in enumerate(self.stages):
+            previous = counts[idx - 1] if idx else total
+            stage_durations = sorted(durations[idx])
+            result.append(
+                frappe._dict(
+                    stage=stage["stage_name"],
+                    visitors=counts[idx],
+                    conversion_rate=(counts[idx] / total * 100) if total else 0,
+                    drop_off_rate=((previous - counts[idx]) / previous * 100) if previous else 0,
+                    value=values[idx],
+                    avg_time=(sum(stage_durations) / len(stage_durations)) if stage_durations else 0,
+                    p50_time=percentile(stage_durations, 50),
+                    p90_time=percentile(stage_durations, 90),
+                )
+            )
+        return result
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0
+    rank = max(int(-(-pct * len(sorted_values) // 100)), 1)
+    return sorted_values[min(rank, len(sorted_values)) - 1]
@@ -0,0 +1,129 @@
+"""
+IP geolocation from a local MaxMind database
+
+The GeoLite2/GeoIP2 City (or Country) ``.mmdb`` file configured in
+TrackFlow Settings is opened with mmap, so every worker on the host shares
+the same page-cache copy and a lookup copies nothing but the record it
+decodes. Results are kept in an LRU keyed by network (/24 for IPv4, /48
+for IPv6); city-level data does not change within those. No lookup ever
+leaves the host, and without a database the location is left empty.
+"""
+
+import ipaddress
+import os
+import time
+from functools import lru_cache
+
+import frappe
+
+from trackflow.ip_filter import PRIVATE_NETWORKS
+
+CACHE_SIZE = 16384
+
+# Settings are re-read, and the file checked for updates, this often
+SETTINGS_TTL = 60
+
+IPV4_PREFIX = 24
+IPV6_PREFIX = 48
+
+# site: (expires, path); path: (mtime, reader)
+_paths = {}
+_readers = {}
+
+
+def get_database_path():
+    """Absolute path of the configured database, or None"""
+    site = frappe.local.site
+    cached = _paths.get(site)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+
+    try:
+        path = (frappe.get_cached_doc("TrackFlow Settings").get("geoip_database_path") or "").strip()
+        if path and not os.path.isabs(path):
+            path = os.path.abspath(frappe.get_site_path(path))
+    except Exception:
+        path = ""
+
+    _paths[site] = (time.monotonic() + SETTINGS_TTL, path or None)
+    if path:
+        # Pick up a replaced file, e.g. after the weekly GeoLite2 update
+        get_reader(path, reload=True)
+    return path or None
+
+
+def get_reader(path, reload=False):
+    cached = _readers.get(path)
+    if cached and not reload:
+        return cached[1]
+
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        mtime = None
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    reader = None
+    if mtime is not None:
+        try:
+            import maxminddb
+
+            reader = maxminddb.open_database(path, maxminddb.MODE_MMAP)
+        except Exception as e:
+            frappe.log_error(f"Could not open GeoIP database {path}: {e}", "TrackFlow GeoIP")
+
+    # The replaced reader is left to be garbage collected, as other threads
+    # may still be reading from it
+    _readers[path] = (mtime, reader)
+    lookup.cache_clear()
+    return reader
+
+
+def get_geo_location(ip_address):
+    """{country, region, city} of ``ip_address``; empty if it is not known"""
+    if not ip_address or PRIVATE_NETWORKS.contains(ip_address):
+        return frappe._dict()
+
+    path = get_database_path()
+    if not path:
+        return frappe._dict()
+
+    try:
+        address = ipaddress.ip_address(ip_address.strip())
+    except ValueError:
+        return frappe._dict()
+
+    prefix = IPV4_PREFIX if address.version == 4 else IPV6_PREFIX
+    network = ipaddress.ip_network(f"{address}/{prefix}", strict=False)
+    return frappe._dict(zip(("country", "region", "city"), lookup(path, str(network.network_address))))
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def lookup(path, ip_address):
+    reader = get_reader(path)
+    try:
+        record = reader.get(ip_address) if reader else None
+    except Exception:
+        record = None
+    if not record:
+        return None, None, None
+
+    subdivisions = record.get("subdivisions") or [{}]
+    return (
+        get_name(record.get("country") or record.get("registered_country")),
+        get_name(subdivisions[0]),
+        get_name(record.get("city")),
+    )
+
+
+def get_name(entity):
+    return ((entity or {}).get("names") or {}).get("en")
+
+
+def set_geo_fields(doc, ip_address):
+    """Store the location of ``ip_address`` on a Visitor or Click Event"""
+    geo = get_geo_location(ip_address)
+    doc.country = geo.get("country")
+    doc.region = geo.get("region")
+    doc.city = geo.get("city")
@@ -22,6 +22,9 @@ doctype_list_js = {
     "CRM Lead": "public/js/crm_lead_list.js",
 }
 
+# Counts guest page views in memory; flushed by trackflow.tasks.flush_page_views
+after_request = ["trackflow.tracking.after_request"]
+
 doc_events = {
     "CRM Lead": {
         "before_insert": "trackflow.integrations.crm_lead.before_lead_create",
@@ -34,10 +37,20 @@ doc_events = {
         "on_update": "trackflow.integrations.crm_organization.on_update",
     },
     "CRM Deal": {
+        "before_save": "trackflow.integrations.crm_deal.before_save",
         "after_insert": "trackflow.integrations.crm_deal.after_insert",
         "on_update": "trackflow.integrations.crm_deal.on_update",
         "on_submit": "trackflow.integrations.crm_deal.calculate_attribution",
     },
+    "Click Event": {
+        "after_insert": "trackflow.journey.record_from_doc",
+    },
+    "Visitor Event": {
+        "after_insert": "trackflow.journey.record_from_doc",
+    },
+    "Conversion": {
+        "after_insert": "trackflow.journey.record_from_doc",
+    },
     "Web Form": {
         "on_update": "trackflow.integrations.web_form.inject_tracking_script",
         "validate": "trackflow.integrations.web_form.validate_tracking_settings",
@@ -45,12 +58,24 @@ doc_events = {
 }
 
 scheduler_events = {
+    "cron": {
+        "* * * * *": [
+            "trackflow.tasks.flush_email_events",
+            "trackflow.tasks.flush_page_views",
+        ],
+        "*/15 * * * *": [
+            "trackflow.tasks.recompute_dirty_attribution",
+        ],
+    },
     "hourly": [
         "trackflow.tasks.process_visitor_sessions",
         "trackflow.tasks.update_campaign_metrics",
+        "trackflow.tasks.update_visitor_activity_summary",
     ],
     "daily": [
         "trackflow.tasks.cleanup_expired_data",
+        "trackflow.tasks.refresh_markov_attribution",
+        "trackflow.tasks.refresh_shapley_coalitions",
         "trackflow.tasks.calculate_attribution",
     ],
     "weekly": [
@@ -104,6 +129,8 @@ fixtures = [
                     "CRM Deal-trackflow_first_touch_source",
                     "CRM Deal-trackflow_last_touch_source",
                     "CRM Deal-trackflow_marketing_influenced",
+                    "CRM Deal-trackflow_won_on",
+                    "CRM Deal-trackflow_attributions",
                     "Web Form-trackflow_tracking_enabled",
                     "Web Form-trackflow_conversion_goal",
                 ],
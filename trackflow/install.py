@@ -41,6 +41,14 @@ def after_migrate():
     create_trackflow_settings()
     create_web_form_custom_fields()
 
+    # The app update may have changed the tracking script asset, and with it
+    # the version in the website's script URL
+    from trackflow.api.tracking import clear_tracking_script_cache
+
+    clear_tracking_script_cache()
+    if frappe.db.exists("TrackFlow Settings", "TrackFlow Settings"):
+        frappe.get_single("TrackFlow Settings").update_website_tracking()
+
 
 def check_dependencies():
     """Check if required apps are installed. FCRM is optional — warn only."""
@@ -201,7 +209,7 @@ def create_fcrm_custom_fields():
                 "fieldname": "trackflow_attribution_model",
                 "label": "Attribution Model",
                 "fieldtype": "Select",
-                "options": "Last Touch\nFirst Touch\nLinear\nTime Decay\nPosition Based",
+                "options": "Last Touch\nFirst Touch\nLinear\nTime Decay\nPosition Based\nCustom\nMarkov\nShapley",
                 "insert_after": "trackflow_tab",
                 "default": "Last Touch",
             },
@@ -226,6 +234,23 @@ def create_fcrm_custom_fields():
                 "insert_after": "trackflow_last_touch_source",
                 "read_only": 1,
             },
+            {
+                "fieldname": "trackflow_won_on",
+                "label": "Won On",
+                "fieldtype": "Datetime",
+                "insert_after": "trackflow_marketing_influenced",
+                "read_only": 1,
+                "no_copy": 1,
+            },
+            {
+                "fieldname": "trackflow_attributions",
+                "label": "Attribution",
+                "fieldtype": "Table",
+                "options": "Deal Attribution",
+                "insert_after": "trackflow_won_on",
+                "read_only": 1,
+                "no_copy": 1,
+            },
         ],
     }
 
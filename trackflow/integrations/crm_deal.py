@@ -2,6 +2,15 @@ import frappe
 from frappe import _
 from frappe.utils import flt, nowdate
 
+from trackflow.attribution import load_touchpoints
+
+def before_save(doc, method):
+    """Record when a deal is won; attribution treats this as its conversion time"""
+    if doc.status == "Won" and doc.has_value_changed("status"):
+        doc.trackflow_won_on = frappe.utils.now_datetime()
+    elif doc.status != "Won":
+        doc.trackflow_won_on = None
+
 def after_insert(doc, method):
     """Track deal creation with attribution"""
     try:
@@ -28,6 +37,15 @@ def on_update(doc, method):
             # Track conversion for won deals
             if doc.status == "Won":
                 track_deal_conversion(doc)
+        
+        if doc.has_value_changed("status"):
+            if doc.status == "Won":
+                # Replaces the provisional credit written while the deal was open,
+                # which used the time of the recompute as the conversion time
+                enqueue_deal_attribution(doc)
+            elif doc.status == "Lost":
+                # Lost deals earn no credit
+                frappe.db.delete("Deal Attribution", {"parent": doc.name, "parenttype": "CRM Deal"})
                 
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "TrackFlow Deal Update Error")
@@ -38,33 +56,32 @@ def calculate_attribution(doc, method):
         if doc.status != "Won":
             return
             
-        # Get all touchpoints for this deal
-        touchpoints = get_deal_touchpoints(doc)
-        
-        if not touchpoints:
-            return
-            
-        # Get attribution model using shared function
-        attribution_model = get_default_attribution_model_cached()
-        
-        if not attribution_model:
-            frappe.log_error("No attribution model available", "Deal Attribution Error")
-            return
-            
-        # Convert touchpoints using shared function
-        formatted_touchpoints = format_touchpoints_for_attribution(touchpoints)
-        
-        # Calculate attribution using Attribution Model engine
-        attribution_result = attribution_model.calculate_attribution(formatted_touchpoints, doc.annual_revenue or 0)
-        
-        # Update deal with attribution summary
-        doc.trackflow_attribution_model = attribution_model.model_type
-        doc.trackflow_marketing_influenced = 1
-        doc.save()
+        enqueue_deal_attribution(doc)
             
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "TrackFlow Attribution Calculation Error")
 
+def enqueue_deal_attribution(doc):
+    """Credit one deal in the background once the caller's transaction commits
+    
+    The batch run commits per chunk, so it must not run inside a document hook.
+    """
+    # Get attribution model using shared function
+    attribution_model = get_default_attribution_model_cached()
+    
+    if not attribution_model:
+        frappe.log_error("No attribution model available", "Deal Attribution Error")
+        return
+    
+    # Same engine and row writer as the scheduled batch run
+    frappe.enqueue(
+        "trackflow.attribution.run_batch_attribution",
+        queue="short",
+        deals=[doc.name],
+        model=attribution_model.name,
+        enqueue_after_commit=True,
+    )
+
 def format_touchpoints_for_attribution(touchpoints):
     """Convert touchpoints to format expected by Attribution Model"""
     formatted_touchpoints = []
@@ -83,50 +100,28 @@ def get_default_attribution_model_cached():
     from trackflow.trackflow.doctype.attribution_model.attribution_model import get_default_attribution_model
     return get_default_attribution_model()
 
-def get_deal_touchpoints(doc):
-    """Get all marketing touchpoints for a deal"""
-    touchpoints = []
+def get_deal_touchpoints(doc, lookback_days=None):
+    """Marketing touchpoints for a deal's visitor, oldest first
     
+    Only the last ``lookback_days`` are read when given.
+    """
     try:
         # Get visitor ID
         visitor_id = doc.trackflow_visitor_id if hasattr(doc, 'trackflow_visitor_id') else None
         
         if not visitor_id:
-            return touchpoints
-            
-        # Get all click events for visitor
-        clicks = frappe.get_all("Click Event",
-            filters={"visitor_id": visitor_id},
-            fields=["name", "campaign", "utm_source", "utm_medium", "utm_campaign", "creation"],
-            order_by="creation asc"
-        )
-        
-        for click in clicks:
-            touchpoints.append({
-                "type": "click",
-                "campaign": click.campaign or click.utm_campaign,
-                "source": click.utm_source,
-                "medium": click.utm_medium,
-                "date": click.creation
-            })
-            
-        # Get email interactions
-        email_logs = frappe.get_all("Email Campaign Log",
-            filters={"visitor_id": visitor_id},
-            fields=["campaign", "action", "creation"],
-            order_by="creation asc"
-        )
-        
-        for log in email_logs:
-            touchpoints.append({
-                "type": "email",
-                "campaign": log.campaign,
-                "source": "email",
-                "medium": "email",
-                "date": log.creation
-            })
+            return []
             
-        return touchpoints
+        return [
+            {
+                "type": tp["type"],
+                "campaign": tp["campaign"],
+                "source": tp["source"],
+                "medium": tp["medium"],
+                "date": tp["timestamp"]
+            }
+            for tp in load_touchpoints(visitor_id, lookback_days)
+        ]
         
     except Exception as e:
         frappe.log_error(frappe.get_traceback(), "TrackFlow Get Touchpoints Error")
@@ -156,6 +151,17 @@ def create_attribution_record(doc):
     pass
 
 
+def get_deal_journey(visitor_id, limit=50):
+    """Latest journey touchpoints, oldest first, for the deal timeline chart"""
+    from trackflow.journey import get_journey
+
+    touchpoints = get_journey(visitor_id, limit=limit)["touchpoints"]
+    return [
+        {"timestamp": str(tp.timestamp), "event_type": tp.touchpoint_type, "campaign": tp.campaign}
+        for tp in reversed(touchpoints)
+    ]
+
+
 @frappe.whitelist()
 def get_deal_attribution_report(deal_name):
     """Get attribution report for a deal"""
@@ -167,8 +173,9 @@ def get_deal_attribution_report(deal_name):
         if not visitor_id:
             return {"error": "No visitor tracking data found for this deal"}
         
-        # Get all touchpoints for this deal
-        touchpoints = get_deal_touchpoints(deal)
+        # Touchpoints inside the default model's lookback window
+        attribution_model = get_default_attribution_model_cached()
+        touchpoints = get_deal_touchpoints(deal, attribution_model.lookback_days if attribution_model else None)
         
         # Get attribution summary
         attribution_summary = {
@@ -177,7 +184,8 @@ def get_deal_attribution_report(deal_name):
             "attribution_model": getattr(deal, 'trackflow_attribution_model', 'Last Touch'),
             "visitor_id": visitor_id,
             "touchpoint_count": len(touchpoints),
-            "touchpoints": touchpoints[:10],  # Limit to latest 10
+            "touchpoints": touchpoints[-10:],  # Limit to latest 10
+            "customer_journey": get_deal_journey(visitor_id),
         }
         
         # Check for existing attribution records first
@@ -197,14 +205,11 @@ def get_deal_attribution_report(deal_name):
                     "value": attr.attributed_value
                 }
             attribution_summary["attribution_breakdown"] = attribution_breakdown
-        elif touchpoints:
+        elif touchpoints and attribution_model:
             # Calculate attribution breakdown if no stored records
-            attribution_model = get_default_attribution_model_cached()
-            
-            if attribution_model:
-                formatted_touchpoints = format_touchpoints_for_attribution(touchpoints)
-                attribution_result = attribution_model.calculate_attribution(formatted_touchpoints, deal.annual_revenue or 0)
-                attribution_summary["attribution_breakdown"] = attribution_result
+            formatted_touchpoints = format_touchpoints_for_attribution(touchpoints)
+            attribution_result = attribution_model.calculate_attribution(formatted_touchpoints, deal.annual_revenue or 0)
+            attribution_summary["attribution_breakdown"] = attribution_result
         
         return attribution_summary
         
@@ -251,6 +251,21 @@ def get_lead_tracking_data(lead):
     
     return {"status": "success", "data": data}
 
+@frappe.whitelist()
+def get_visitor_journey(visitor_id, cursor=None, limit=50):
+    """One page of a lead's visitor journey, newest first"""
+    from trackflow.journey import format_touchpoint, get_journey
+
+    if not visitor_id:
+        return {"events": [], "has_more": False, "next_cursor": None}
+
+    page = get_journey(visitor_id, cursor=cursor, limit=limit)
+    return {
+        "events": [format_touchpoint(row) for row in page["touchpoints"]],
+        "has_more": page["has_more"],
+        "next_cursor": page["next_cursor"],
+    }
+
 @frappe.whitelist()
 def link_visitor_to_lead(lead, visitor_id):
     """Link a visitor to an existing lead"""
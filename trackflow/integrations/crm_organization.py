@@ -91,57 +91,27 @@ def track_conversion(doc, conversion_type):
         frappe.log_error(frappe.get_traceback(), "TrackFlow Organization Conversion Error")
 
 @frappe.whitelist()
-def get_organization_journey(organization):
-    """Get complete journey for an organization"""
+def get_organization_journey(organization, cursor=None, limit=50):
+    """Get complete journey for an organization, one page at a time"""
     try:
+        from trackflow.journey import format_touchpoint, get_journey, get_journey_bounds
+
         org = frappe.get_doc("CRM Organization", organization)
         visitor_id = org.trackflow_visitor_id if hasattr(org, 'trackflow_visitor_id') else None
         
         if not visitor_id:
             return {"touchpoints": [], "engagement_score": 0}
             
-        # Get all touchpoints
-        touchpoints = []
-        
-        # Click events
-        clicks = frappe.get_all("Click Event",
-            filters={"visitor_id": visitor_id},
-            fields=["name", "tracked_link", "creation", "utm_source", "utm_medium", "utm_campaign"],
-            order_by="creation desc"
-        )
-        
-        for click in clicks:
-            touchpoints.append({
-                "type": "click",
-                "date": str(click.creation),
-                "source": click.utm_source,
-                "medium": click.utm_medium,
-                "campaign": click.utm_campaign
-            })
-            
-        # Email interactions
-        emails = frappe.get_all("Email Campaign Log",
-            filters={"visitor_id": visitor_id},
-            fields=["campaign", "action", "creation"],
-            order_by="creation desc"
-        )
-        
-        for email in emails:
-            touchpoints.append({
-                "type": f"email_{email.action}",
-                "date": str(email.creation),
-                "campaign": email.campaign
-            })
-            
-        # Sort by date
-        touchpoints.sort(key=lambda x: x["date"], reverse=True)
+        page = get_journey(visitor_id, cursor=cursor, limit=limit)
+        first_touch, last_touch = get_journey_bounds(visitor_id)
         
         return {
-            "touchpoints": touchpoints[:50],  # Latest 50 touchpoints
+            "touchpoints": [format_touchpoint(row) for row in page["touchpoints"]],
+            "has_more": page["has_more"],
+            "next_cursor": page["next_cursor"],
             "engagement_score": org.trackflow_engagement_score or 0,
-            "total_touchpoints": len(touchpoints),
-            "first_touch_date": touchpoints[-1]["date"] if touchpoints else None,
-            "last_touch_date": touchpoints[0]["date"] if touchpoints else None
+            "first_touch_date": str(first_touch) if first_touch else None,
+            "last_touch_date": str(last_touch) if last_touch else None
         }
         
     except Exception as e:
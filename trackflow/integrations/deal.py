@@ -13,6 +13,8 @@ from frappe import _
 import json
 from datetime import datetime
 
+from trackflow.attribution import load_touchpoints
+
 
 def on_deal_create(doc, method):
     """Hook called when a deal/opportunity is created"""
@@ -58,15 +60,15 @@ def on_deal_update(doc, method):
 
 def create_deal_attribution(deal, tracked_link, attribution_data):
     """Create attribution record for a deal"""
-    # Get all touchpoints that led to this deal
-    touchpoints = get_deal_touchpoints(deal, attribution_data)
-    
     # Get attribution model
     attribution_model = frappe.get_doc(
         'Attribution Model',
         frappe.db.get_single_value('TrackFlow Settings', 'default_attribution_model')
     )
     
+    # Get the touchpoints inside the model's lookback window
+    touchpoints = get_deal_touchpoints(deal, attribution_data, attribution_model.lookback_days)
+    
     # Calculate attribution
     deal_value = frappe.db.get_value('Opportunity', deal, 'opportunity_amount') or 0
     attribution = attribution_model.calculate_attribution(touchpoints, deal_value)
@@ -135,53 +137,21 @@ def inherit_tracking_from_party(doc):
         }).insert(ignore_permissions=True)
 
 
-def get_deal_touchpoints(deal, attribution_data=None):
-    """Get all touchpoints that influenced a deal"""
-    # Get direct associations
-    direct_touchpoints = frappe.db.sql("""
-        SELECT 
-            ce.timestamp,
-            ce.channel,
-            ce.source,
-            ce.medium,
-            ce.campaign,
-            tl.name as tracked_link
-        FROM `tabClick Event` ce
-        JOIN `tabTracked Link` tl ON ce.tracked_link = tl.name
-        JOIN `tabDeal Link Association` dla ON dla.tracked_link = tl.name
-        WHERE dla.deal = %(deal)s
-        ORDER BY ce.timestamp
-    """, {'deal': deal}, as_dict=True)
-    
-    # Get inherited touchpoints from lead/contact
-    inherited_touchpoints = frappe.db.sql("""
-        SELECT 
-            ce.timestamp,
-            ce.channel,
-            ce.source,
-            ce.medium,
-            ce.campaign,
-            tl.name as tracked_link
-        FROM `tabClick Event` ce
-        JOIN `tabTracked Link` tl ON ce.tracked_link = tl.name
-        JOIN `tabDeal Link Association` dla ON dla.tracked_link = tl.name
+def get_deal_touchpoints(deal, attribution_data=None, lookback_days=None):
+    """Get all touchpoints that influenced a deal, oldest first"""
+    return load_touchpoints(get_deal_visitors(deal), lookback_days)
+
+
+def get_deal_visitors(deal):
+    """Visitors whose clicks on the deal's associated links led to it"""
+    return frappe.db.sql_list("""
+        SELECT DISTINCT ce.visitor_id
+        FROM `tabDeal Link Association` dla
+        JOIN `tabClick Event` ce
+            ON ce.tracked_link = dla.tracking_link AND ce.ip_address = dla.ip_address
         WHERE dla.deal = %(deal)s
-            AND dla.inherited_from IS NOT NULL
-        ORDER BY ce.timestamp
-    """, {'deal': deal}, as_dict=True)
-    
-    # Combine and deduplicate
-    all_touchpoints = direct_touchpoints + inherited_touchpoints
-    seen = set()
-    unique_touchpoints = []
-    
-    for tp in all_touchpoints:
-        key = (tp['tracked_link'], tp['timestamp'])
-        if key not in seen:
-            seen.add(key)
-            unique_touchpoints.append(tp)
-            
-    return unique_touchpoints
+            AND IFNULL(ce.visitor_id, '') != ''
+    """, {'deal': deal})
 
 
 def track_deal_stage_change(deal, old_stage, new_stage, deal_value):
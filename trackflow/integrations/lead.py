@@ -13,6 +13,8 @@ from frappe import _
 import json
 from datetime import datetime
 
+from trackflow.attribution import load_touchpoints
+
 
 def on_lead_create(doc, method):
     """Hook called when a lead is created"""
@@ -155,29 +157,16 @@ def track_lead_final_conversion(doc):
 
 def get_lead_attribution_data(lead):
     """Get attribution data for a lead"""
-    # Get all touchpoints for the lead
-    touchpoints = frappe.db.sql("""
-        SELECT 
-            ce.timestamp,
-            ce.channel,
-            ce.source,
-            ce.medium,
-            ce.campaign,
-            tl.name as tracked_link,
-            tl.campaign_name
-        FROM `tabClick Event` ce
-        JOIN `tabTracked Link` tl ON ce.tracked_link = tl.name
-        JOIN `tabLead Link Association` lla ON lla.tracked_link = tl.name
-        WHERE lla.lead = %(lead)s
-        ORDER BY ce.timestamp
-    """, {'lead': lead}, as_dict=True)
-    
     # Get attribution model
     attribution_model = frappe.get_doc(
         'Attribution Model',
         frappe.db.get_single_value('TrackFlow Settings', 'default_attribution_model')
     )
     
+    # Touchpoints of the lead's visitor inside the model's lookback window
+    visitor_id = frappe.db.get_value('CRM Lead', lead, 'trackflow_visitor_id')
+    touchpoints = load_touchpoints(visitor_id, attribution_model.lookback_days) if visitor_id else []
+    
     # Calculate attribution
     attribution = attribution_model.calculate_attribution(
         touchpoints,
@@ -0,0 +1,155 @@
+"""
+Internal traffic matching
+
+TrackFlow Settings lists internal IP ranges as text, one per line. They are
+compiled once per settings version into sorted, merged integer intervals,
+one list for IPv4 and one for IPv6, and an address is matched with a binary
+search. A small LRU of recent answers sits in front, since the same office
+addresses tend to repeat.
+
+Accepted ranges are CIDR blocks (10.0.0.0/8, fd00::/8), single addresses,
+``start-end`` ranges and, for ranges saved before CIDR support, dotted IPv4
+prefixes such as ``192.168.1.`` or ``10``.
+"""
+
+import ipaddress
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+
+import frappe
+
+# Settings are re-checked this often; ranges are only recompiled if they changed
+SETTINGS_TTL = 60
+
+RECENT_IPS = 1024
+
+_matchers = {}
+
+
+class IPRangeMatcher:
+    """Sorted integer intervals of IPv4 and IPv6 ranges"""
+
+    def __init__(self, networks=()):
+        intervals = {4: [], 6: []}
+        for start, end in networks:
+            intervals[start.version].append((int(start), int(end)))
+
+        self.starts, self.ends = {}, {}
+        for version, ranges in intervals.items():
+            merged = []
+            for start, end in sorted(ranges):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self.starts[version] = [start for start, _end in merged]
+            self.ends[version] = [end for _start, end in merged]
+
+        self.recent = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __bool__(self):
+        return bool(self.starts[4] or self.starts[6])
+
+    def contains(self, ip):
+        if not ip or not self:
+            return False
+
+        with self.lock:
+            if ip in self.recent:
+                self.recent.move_to_end(ip)
+                return self.recent[ip]
+
+        matched = self.lookup(ip)
+        with self.lock:
+            self.recent[ip] = matched
+            if len(self.recent) > RECENT_IPS:
+                self.recent.popitem(last=False)
+        return matched
+
+    def lookup(self, ip):
+        try:
+            address = ipaddress.ip_address(ip.strip())
+        except ValueError:
+            return False
+
+        # ::ffff:10.0.0.1 is the IPv4 address as seen by a dual-stack socket
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+
+        starts = self.starts[address.version]
+        i = bisect_right(starts, int(address)) - 1
+        return i >= 0 and int(address) <= self.ends[address.version][i]
+
+
+def parse_ip_range(token):
+    """(first, last) address of one range; ValueError if it is not one"""
+    token = token.strip()
+    if "-" in token:
+        start, end = (ipaddress.ip_address(part.strip()) for part in token.split("-", 1))
+        if start.version != end.version or start > end:
+            raise ValueError(token)
+        return start, end
+
+    if "/" not in token and ":" not in token and (token.count(".") < 3 or token.endswith(".")):
+        # Dotted IPv4 prefix, e.g. "192.168." or "10"
+        octets = [octet for octet in token.split(".") if octet]
+        if not octets:
+            raise ValueError(token)
+        token = ".".join(octets + ["0"] * (4 - len(octets))) + f"/{8 * len(octets)}"
+
+    network = ipaddress.ip_network(token, strict=False)
+    return network.network_address, network.broadcast_address
+
+
+def parse_ip_ranges(raw):
+    """Tokens of a newline or comma separated list of ranges"""
+    return [token.strip() for token in (raw or "").replace(",", "\n").splitlines() if token.strip()]
+
+
+def compile_ip_ranges(raw, ignore_invalid=True):
+    networks = []
+    for token in parse_ip_ranges(raw):
+        try:
+            networks.append(parse_ip_range(token))
+        except ValueError:
+            if not ignore_invalid:
+                raise
+    return IPRangeMatcher(networks)
+
+
+PRIVATE_NETWORKS = compile_ip_ranges(
+    "10.0.0.0/8\n172.16.0.0/12\n192.168.0.0/16\n127.0.0.0/8\n::1/128\nfc00::/7\nfe80::/10"
+)
+
+
+def get_internal_matcher():
+    """Matcher for the configured internal ranges, or None if exclusion is off"""
+    site = frappe.local.site
+    cached = _matchers.get(site)
+    if cached and cached[0] > time.monotonic():
+        return cached[2]
+
+    try:
+        settings = frappe.get_cached_doc("TrackFlow Settings")
+        version = str(settings.modified)
+        if cached and cached[1] == version:
+            matcher = cached[2]
+        elif settings.get("exclude_internal_traffic"):
+            matcher = compile_ip_ranges(settings.get("internal_ip_ranges"))
+        else:
+            matcher = None
+    except Exception:
+        # If settings cannot be read, don't exclude the traffic
+        version, matcher = None, None
+
+    _matchers[site] = (time.monotonic() + SETTINGS_TTL, version, matcher)
+    return matcher
+
+
+def is_internal_traffic(ip_address):
+    """Whether ``ip_address`` is in the configured internal ranges"""
+    matcher = get_internal_matcher()
+    return bool(matcher) and matcher.contains(ip_address)
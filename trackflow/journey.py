@@ -0,0 +1,270 @@
+"""
+Visitor journey store for TrackFlow
+
+Every tracked touchpoint (link clicks, page events, email opens and clicks,
+conversions) is appended to Journey Touchpoint at ingest time. Journey views
+read that table through its (visitor, timestamp) index one page at a time,
+so the cost of rendering a journey does not grow with its length.
+"""
+
+import base64
+import heapq
+import json
+
+import frappe
+from frappe import _
+from frappe.utils import cint, flt, get_datetime, now
+
+from trackflow.attribution import ATTRIBUTION_TOUCH_TYPES, mark_visitor_dirty
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+JOURNEY_FIELDS = [
+    "name",
+    "visitor",
+    "timestamp",
+    "touchpoint_type",
+    "title",
+    "campaign",
+    "source",
+    "medium",
+    "tracked_link",
+    "url",
+    "value",
+    "reference_doctype",
+    "reference_name",
+]
+
+PAGE_VIEW_EVENTS = ("pageview", "page_view")
+
+
+def record_touchpoint(visitor, touchpoint_type, timestamp=None, **fields):
+    """Append one touchpoint to a visitor's journey"""
+    if not visitor:
+        return None
+
+    touchpoint = frappe.get_doc(
+        dict(
+            fields,
+            doctype="Journey Touchpoint",
+            visitor=visitor,
+            touchpoint_type=touchpoint_type,
+            timestamp=timestamp or now(),
+        )
+    )
+    touchpoint.insert(ignore_permissions=True)
+
+    if touchpoint_type in ATTRIBUTION_TOUCH_TYPES:
+        mark_visitor_dirty(visitor)
+
+    return touchpoint
+
+
+def record_touchpoints(touchpoints):
+    """Bulk-append touchpoints; the batch counterpart of ``record_touchpoint``
+
+    Each touchpoint is a dict with ``visitor``, ``touchpoint_type`` and
+    ``timestamp`` plus any other Journey Touchpoint field.
+    """
+    touchpoints = [tp for tp in touchpoints if tp.get("visitor")]
+    if not touchpoints:
+        return
+
+    now_ts = now()
+    fields = ["creation", "modified", "owner", "modified_by"] + JOURNEY_FIELDS
+    rows = [
+        [now_ts, now_ts, "Administrator", "Administrator"]
+        + [frappe.generate_hash(length=10)]
+        + [tp.get(field) for field in JOURNEY_FIELDS[1:]]
+        for tp in touchpoints
+    ]
+    frappe.db.bulk_insert("Journey Touchpoint", fields, rows)
+
+    for visitor in {tp["visitor"] for tp in touchpoints if tp["touchpoint_type"] in ATTRIBUTION_TOUCH_TYPES}:
+        mark_visitor_dirty(visitor)
+
+
+def record_from_doc(doc, method=None):
+    """after_insert hook: mirror Click Event, Visitor Event and Conversion rows"""
+    try:
+        mapper = TOUCHPOINT_MAPPERS.get(doc.doctype)
+        if not mapper:
+            return
+
+        touchpoint = mapper(doc)
+        if touchpoint:
+            record_touchpoint(
+                reference_doctype=doc.doctype,
+                reference_name=doc.name,
+                **touchpoint,
+            )
+    except Exception as e:
+        frappe.log_error(f"Journey touchpoint error for {doc.doctype} {doc.name}: {e}", "TrackFlow Journey")
+
+
+def _from_click(doc):
+    return {
+        "visitor": doc.visitor_id,
+        "touchpoint_type": "link_click",
+        "timestamp": doc.click_timestamp or doc.creation,
+        "title": doc.short_code or doc.tracked_link,
+        "campaign": doc.campaign,
+        "source": doc.utm_source,
+        "medium": doc.utm_medium,
+        "tracked_link": doc.tracked_link,
+        "url": doc.page_url,
+    }
+
+
+def _from_visitor_event(doc):
+    return {
+        "visitor": doc.visitor,
+        "touchpoint_type": "page_view" if doc.event_type in PAGE_VIEW_EVENTS else "event",
+        "timestamp": doc.timestamp or doc.creation,
+        "title": doc.event_action or doc.event_type,
+        "tracked_link": doc.tracked_link,
+        "url": doc.url,
+        "value": doc.event_value,
+    }
+
+
+def _from_conversion(doc):
+    return {
+        "visitor": doc.visitor_id,
+        "touchpoint_type": "conversion",
+        "timestamp": doc.conversion_timestamp or doc.creation,
+        "title": doc.conversion_type,
+        "campaign": doc.campaign,
+        "tracked_link": doc.tracked_link,
+        "value": doc.conversion_value,
+    }
+
+
+TOUCHPOINT_MAPPERS = {
+    "Click Event": _from_click,
+    "Visitor Event": _from_visitor_event,
+    "Conversion": _from_conversion,
+}
+
+
+def get_journey(visitors, cursor=None, limit=DEFAULT_PAGE_SIZE, order="desc"):
+    """One page of touchpoints for one or more visitors
+
+    Each visitor is read with a bounded range scan on (visitor, timestamp)
+    and the per-visitor pages are merged, so a page costs at most ``limit``
+    rows per visitor regardless of how long the journeys are. Returns
+    ``touchpoints``, ``has_more`` and ``next_cursor``.
+    """
+    if isinstance(visitors, str):
+        visitors = [visitors]
+    visitors = [v for v in dict.fromkeys(visitors or []) if v]
+
+    limit = min(max(cint(limit) or DEFAULT_PAGE_SIZE, 1), MAX_PAGE_SIZE)
+    descending = (order or "desc").lower() != "asc"
+    position = decode_cursor(cursor) if cursor else None
+
+    pages = [_get_visitor_page(visitor, position, limit + 1, descending) for visitor in visitors]
+    merged = heapq.merge(
+        *pages,
+        key=lambda row: (get_datetime(row.timestamp), row.name),
+        reverse=descending,
+    )
+
+    touchpoints = []
+    for row in merged:
+        touchpoints.append(row)
+        if len(touchpoints) > limit:
+            break
+
+    has_more = len(touchpoints) > limit
+    touchpoints = touchpoints[:limit]
+
+    return {
+        "touchpoints": touchpoints,
+        "has_more": has_more,
+        "next_cursor": encode_cursor(touchpoints[-1]) if has_more else None,
+    }
+
+
+def _get_visitor_page(visitor, position, limit, descending):
+    operator, direction = ("<", "DESC") if descending else (">", "ASC")
+    conditions = ["visitor = %(visitor)s"]
+    values = {"visitor": visitor, "limit": limit}
+
+    if position:
+        # Keyset on (timestamp, name); stable under concurrent appends
+        conditions.append(
+            f"(timestamp {operator} %(ts)s OR (timestamp = %(ts)s AND name {operator} %(name)s))"
+        )
+        values.update(ts=position[0], name=position[1])
+
+    return frappe.db.sql(
+        """
+        SELECT {fields}
+        FROM `tabJourney Touchpoint`
+        WHERE {conditions}
+        ORDER BY timestamp {direction}, name {direction}
+        LIMIT %(limit)s
+        """.format(
+            fields=", ".join(f"`{f}`" for f in JOURNEY_FIELDS),
+            conditions=" AND ".join(conditions),
+            direction=direction,
+        ),
+        values,
+        as_dict=True,
+    )
+
+
+def get_journey_bounds(visitors):
+    """First and last touchpoint timestamps, each read from the index edge"""
+    if isinstance(visitors, str):
+        visitors = [visitors]
+
+    first = last = None
+    for visitor in visitors or []:
+        if not visitor:
+            continue
+        bounds = frappe.db.sql(
+            """
+            SELECT
+                (SELECT timestamp FROM `tabJourney Touchpoint`
+                    WHERE visitor = %(visitor)s ORDER BY timestamp ASC LIMIT 1),
+                (SELECT timestamp FROM `tabJourney Touchpoint`
+                    WHERE visitor = %(visitor)s ORDER BY timestamp DESC LIMIT 1)
+            """,
+            {"visitor": visitor},
+        )[0]
+        if bounds[0] and (first is None or bounds[0] < first):
+            first = bounds[0]
+        if bounds[1] and (last is None or bounds[1] > last):
+            last = bounds[1]
+
+    return first, last
+
+
+def encode_cursor(row):
+    payload = json.dumps([str(row.timestamp), row.name])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        timestamp, name = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return get_datetime(timestamp), name
+    except Exception:
+        frappe.throw(_("Invalid cursor"))
+
+
+def format_touchpoint(row):
+    """Touchpoint as a timeline event for the desk journey panels"""
+    return {
+        "type": row.touchpoint_type,
+        "timestamp": str(row.timestamp),
+        "title": row.title or row.touchpoint_type,
+        "description": " / ".join(filter(None, [row.source, row.medium, row.campaign])) or (row.url or ""),
+        "campaign": row.campaign,
+        "source": row.source,
+        "medium": row.medium,
+        "value": flt(row.value),
+    }
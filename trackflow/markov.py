@@ -0,0 +1,200 @@
+"""
+Markov-chain attribution for TrackFlow
+
+Every visitor journey in Journey Touchpoint is read as a path through
+channel states: start -> channel -> ... -> conversion or null. Transition
+counts are accumulated while streaming the table in keyset pages, so memory
+is bounded by the number of channels rather than the number of journeys.
+
+A channel's credit is its removal effect: the relative drop in the
+probability of reaching conversion from start when that channel is taken
+out of the chain. The normalised effects are stored on every active
+``markov`` Attribution Model and applied per deal by the engine's
+``markov`` kernel.
+"""
+
+import json
+
+import frappe
+import numpy as np
+from frappe.utils import now_datetime
+
+STREAM_PAGE_SIZE = 50000
+
+# Absorbing and start states; channels are numbered from FIRST_CHANNEL
+START, CONVERSION, NULL = 0, 1, 2
+FIRST_CHANNEL = 3
+
+JOURNEY_TOUCH_TYPES = ("link_click", "email_open", "email_click", "conversion")
+
+
+class TransitionCounter:
+    """Streaming transition counts between journey states"""
+
+    def __init__(self):
+        self.channels = {}
+        self.counts = {}
+        self.journeys = 0
+
+    def state(self, channel):
+        state = self.channels.get(channel)
+        if state is None:
+            state = self.channels[channel] = FIRST_CHANNEL + len(self.channels)
+        return state
+
+    def add_journey(self, channels, converted):
+        previous = START
+        for channel in channels:
+            state = self.state(channel)
+            self.counts[previous, state] = self.counts.get((previous, state), 0) + 1
+            previous = state
+
+        end = CONVERSION if converted else NULL
+        self.counts[previous, end] = self.counts.get((previous, end), 0) + 1
+        self.journeys += 1
+
+    def transition_matrix(self):
+        """Row-normalised transition probabilities over all states"""
+        n_states = FIRST_CHANNEL + len(self.channels)
+        counts = np.zeros((n_states, n_states))
+        if self.counts:
+            keys = np.array(list(self.counts), dtype=np.int64)
+            counts[keys[:, 0], keys[:, 1]] = list(self.counts.values())
+
+        totals = counts.sum(axis=1, keepdims=True)
+        return np.divide(counts, totals, out=np.zeros_like(counts), where=totals > 0)
+
+    def removal_effects(self):
+        """{channel: share of credit}, summing to 1 when any journey converted"""
+        if not self.channels:
+            return {}
+
+        probabilities = self.transition_matrix()
+        transient = np.r_[START, np.arange(FIRST_CHANNEL, len(probabilities))]
+        q = probabilities[np.ix_(transient, transient)]
+        r = probabilities[transient, CONVERSION]
+
+        base = conversion_probability(q, r)
+        if base <= 0:
+            return {}
+
+        effects = {}
+        for channel, state in self.channels.items():
+            # Transient index of the channel; start is index 0
+            i = state - FIRST_CHANNEL + 1
+            removed_q, removed_r = q.copy(), r.copy()
+            # Traffic into a removed channel is lost to null
+            removed_q[:, i] = 0
+            removed_q[i, :] = 0
+            removed_r[i] = 0
+            effects[channel] = max(1 - conversion_probability(removed_q, removed_r) / base, 0.0)
+
+        total = sum(effects.values())
+        if not total:
+            return {}
+        return {channel: effect / total for channel, effect in effects.items()}
+
+
+def conversion_probability(q, r):
+    """Probability of absorbing into conversion from start
+
+    Solves (I - Q) x = r for the absorption probabilities of every
+    transient state and returns the start state's.
+    """
+    a = np.eye(len(q)) - q
+    try:
+        return float(np.linalg.solve(a, r)[0])
+    except np.linalg.LinAlgError:
+        return float(np.linalg.lstsq(a, r, rcond=None)[0][0])
+
+
+def stream_journeys(page_size=STREAM_PAGE_SIZE):
+    """Yield (channels, converted) for every journey in the store
+
+    A visitor's journey ends at each conversion; touches after a conversion
+    start the visitor's next journey.
+    """
+    position = None
+    visitor, path = None, []
+
+    while True:
+        rows = _get_touch_page(position, page_size)
+        for name, row_visitor, timestamp, touchpoint_type, source in rows:
+            if row_visitor != visitor:
+                if path:
+                    yield path, False
+                visitor, path = row_visitor, []
+
+            if touchpoint_type == "conversion":
+                if path:
+                    yield path, True
+                path = []
+            else:
+                path.append(source or "direct")
+
+        if len(rows) < page_size:
+            break
+        position = rows[-1][1], rows[-1][2], rows[-1][0]
+
+    if path:
+        yield path, False
+
+
+def _get_touch_page(position, limit):
+    conditions = ["touchpoint_type IN %(types)s"]
+    values = {"types": JOURNEY_TOUCH_TYPES, "limit": limit}
+
+    if position:
+        # Keyset on (visitor, timestamp, name)
+        conditions.append(
+            """(visitor > %(visitor)s OR (visitor = %(visitor)s AND (timestamp > %(ts)s
+                OR (timestamp = %(ts)s AND name > %(name)s))))"""
+        )
+        values.update(visitor=position[0], ts=position[1], name=position[2])
+
+    return frappe.db.sql(
+        """
+        SELECT name, visitor, timestamp, touchpoint_type, source
+        FROM `tabJourney Touchpoint`
+        WHERE {conditions}
+        ORDER BY visitor, timestamp, name
+        LIMIT %(limit)s
+        """.format(conditions=" AND ".join(conditions)),
+        values,
+    )
+
+
+def learn_markov_weights(journeys=None):
+    """Removal-effect channel weights over all journeys, and the journey count"""
+    counter = TransitionCounter()
+    for channels, converted in journeys if journeys is not None else stream_journeys():
+        counter.add_journey(channels, converted)
+    return counter.removal_effects(), counter.journeys
+
+
+def refresh_markov_models():
+    """Re-learn channel weights for every active Markov Attribution Model"""
+    models = frappe.get_all(
+        "Attribution Model", filters={"model_type": "markov", "is_active": 1}, pluck="name"
+    )
+    if not models or not frappe.db.table_exists("Journey Touchpoint"):
+        return None
+
+    weights, journeys = learn_markov_weights()
+    learned_on = now_datetime()
+    for name in models:
+        frappe.db.set_value(
+            "Attribution Model",
+            name,
+            {
+                "learned_weights": json.dumps(weights, sort_keys=True),
+                "learned_on": learned_on,
+                "learned_journeys": journeys,
+            },
+            update_modified=False,
+        )
+        frappe.clear_document_cache("Attribution Model", name)
+
+    frappe.db.commit()
+    return weights
+
@@ -0,0 +1,38 @@
+import frappe
+
+
+def execute():
+    """Record won time and child table placement for existing deals
+
+    Deals won before trackflow_won_on existed get their last modified time,
+    the best record of it. Deal Attribution rows written in bulk without a
+    parentfield are attached to the deal's attribution table.
+    """
+    if not frappe.db.table_exists("CRM Deal"):
+        return
+
+    from trackflow.install import create_fcrm_custom_fields
+
+    # Patches run before after_migrate creates the fields
+    create_fcrm_custom_fields()
+
+    frappe.db.sql(
+        """
+        UPDATE `tabCRM Deal`
+        SET trackflow_won_on = modified
+        WHERE status = 'Won' AND trackflow_won_on IS NULL
+        """
+    )
+
+    if frappe.db.table_exists("Deal Attribution"):
+        frappe.db.sql(
+            """
+            UPDATE `tabDeal Attribution` da
+            JOIN (
+                SELECT name, ROW_NUMBER() OVER (PARTITION BY parent ORDER BY creation, name) AS row_idx
+                FROM `tabDeal Attribution`
+                WHERE parenttype = 'CRM Deal' AND IFNULL(parentfield, '') = ''
+            ) numbered ON numbered.name = da.name
+            SET da.parentfield = 'trackflow_attributions', da.idx = numbered.row_idx
+            """
+        )
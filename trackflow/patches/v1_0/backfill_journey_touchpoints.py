@@ -0,0 +1,59 @@
+import frappe
+
+# (source doctype, touchpoint SELECT list) for every table the journey store mirrors
+SOURCES = {
+    "Click Event": """
+        visitor_id, IFNULL(click_timestamp, creation), 'link_click',
+        IFNULL(short_code, tracked_link), campaign, utm_source, utm_medium,
+        tracked_link, page_url, 0
+    """,
+    "Visitor Event": """
+        visitor, IFNULL(timestamp, creation),
+        IF(event_type IN ('pageview', 'page_view'), 'page_view', 'event'),
+        IFNULL(event_action, event_type), NULL, NULL, NULL,
+        tracked_link, url, IFNULL(event_value, 0)
+    """,
+    "Conversion": """
+        visitor_id, IFNULL(conversion_timestamp, creation), 'conversion',
+        conversion_type, campaign, NULL, NULL,
+        tracked_link, NULL, IFNULL(conversion_value, 0)
+    """,
+}
+
+
+def execute():
+    """Seed the journey store from the existing click, event and conversion tables
+
+    Rows are named by the full MD5 of their source. A 10 character prefix is
+    likely to collide over millions of rows, and the full hash also never
+    matches the 10 character names of live touchpoints.
+    """
+    frappe.reload_doc("trackflow", "doctype", "journey_touchpoint")
+
+    for doctype, select_list in SOURCES.items():
+        if not frappe.db.table_exists(doctype):
+            continue
+
+        visitor_column = "visitor" if doctype == "Visitor Event" else "visitor_id"
+        frappe.db.sql(
+            """
+            INSERT INTO `tabJourney Touchpoint`
+                (name, creation, modified, owner, modified_by,
+                visitor, timestamp, touchpoint_type,
+                title, campaign, source, medium,
+                tracked_link, url, value,
+                reference_doctype, reference_name)
+            SELECT
+                MD5(CONCAT(%(doctype)s, src.name)), NOW(), NOW(), 'Administrator', 'Administrator',
+                {select_list},
+                %(doctype)s, src.name
+            FROM `tab{doctype}` src
+            WHERE IFNULL(src.{visitor_column}, '') != ''
+                AND NOT EXISTS (
+                    SELECT 1 FROM `tabJourney Touchpoint` jt
+                    WHERE jt.reference_doctype = %(doctype)s AND jt.reference_name = src.name
+                )
+            """.format(select_list=select_list, doctype=doctype, visitor_column=visitor_column),
+            {"doctype": doctype},
+        )
+        frappe.db.commit()
@@ -0,0 +1,14 @@
+import frappe
+from frappe.utils import now_datetime
+
+
+def execute():
+    """Keep tracking emails sent before recipients were signed
+
+    Existing sites accept unsigned tracking URLs for campaigns created
+    before this migration; new sites never accept them.
+    """
+    frappe.reload_doc("trackflow", "doctype", "trackflow_settings")
+
+    if not frappe.db.get_single_value("TrackFlow Settings", "unsigned_email_links_before"):
+        frappe.db.set_single_value("TrackFlow Settings", "unsigned_email_links_before", now_datetime())
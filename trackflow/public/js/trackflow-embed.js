@@ -0,0 +1,111 @@
+// TrackFlow website tracking script
+// Served by trackflow.api.tracking.get_tracking_script, which prepends
+// window.TrackFlowConfig. The script is identical for every visitor, so it
+// can be cached by browsers and proxies; the visitor comes from the cookie.
+
+(function() {
+    var config = window.TrackFlowConfig || {};
+    var TrackFlow = window.TrackFlow || {};
+
+    TrackFlow.apiUrl = config.apiUrl || '';
+    TrackFlow.requireConsent = !!config.requireConsent;
+    TrackFlow.visitorId = getCookie('trackflow_visitor') || newVisitorId();
+    TrackFlow.sessionId = getCookie('trackflow_session') || '';
+
+    TrackFlow.queue = [];
+    TrackFlow.flushInterval = 5000;
+    TrackFlow.maxBatch = 20;
+
+    TrackFlow.track = function(eventType, properties) {
+        TrackFlow.queue.push({
+            event_type: eventType || 'pageview',
+            url: window.location.href,
+            referrer: document.referrer,
+            properties: properties || {},
+            ts: Date.now(),
+            utm_source: getParam('utm_source'),
+            utm_medium: getParam('utm_medium'),
+            utm_campaign: getParam('utm_campaign'),
+            utm_content: getParam('utm_content'),
+            utm_term: getParam('utm_term')
+        });
+        if (TrackFlow.queue.length >= TrackFlow.maxBatch) {
+            TrackFlow.flush();
+        }
+    };
+
+    // Send buffered events in one request; text/plain avoids a CORS preflight
+    TrackFlow.flush = function() {
+        if (!TrackFlow.queue.length) {
+            return;
+        }
+        var url = TrackFlow.apiUrl + '/api/method/trackflow.api.tracking.track_events';
+        var body = JSON.stringify({
+            visitor_id: TrackFlow.visitorId,
+            events: TrackFlow.queue.splice(0, TrackFlow.maxBatch)
+        });
+        var sent = navigator.sendBeacon &&
+            navigator.sendBeacon(url, new Blob([body], {type: 'text/plain;charset=UTF-8'}));
+        if (!sent) {
+            fetch(url, {
+                method: 'POST',
+                headers: {'Content-Type': 'text/plain;charset=UTF-8'},
+                body: body,
+                credentials: 'include',
+                keepalive: true
+            });
+        }
+        if (TrackFlow.queue.length) {
+            TrackFlow.flush();
+        }
+    };
+
+    setInterval(TrackFlow.flush, TrackFlow.flushInterval);
+    window.addEventListener('pagehide', TrackFlow.flush);
+    document.addEventListener('visibilitychange', function() {
+        if (document.visibilityState === 'hidden') {
+            TrackFlow.flush();
+        }
+    });
+
+    TrackFlow.consent = function(granted) {
+        fetch(TrackFlow.apiUrl + '/api/method/trackflow.api.tracking.record_consent', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                visitor_id: TrackFlow.visitorId,
+                consent_given: granted
+            }),
+            credentials: 'include'
+        });
+    };
+
+    function getParam(name) {
+        var match = RegExp('[?&]' + name + '=([^&]*)').exec(window.location.search);
+        return match && decodeURIComponent(match[1].replace(/\+/g, ' '));
+    }
+
+    function getCookie(name) {
+        var value = "; " + document.cookie;
+        var parts = value.split("; " + name + "=");
+        if (parts.length == 2) return parts.pop().split(";").shift();
+    }
+
+    // Same shape as server-generated ids; kept for a year like the server cookie
+    function newVisitorId() {
+        var bytes = new Uint8Array(8);
+        (window.crypto || window.msCrypto).getRandomValues(bytes);
+        var id = 'v_' + Array.prototype.map.call(bytes, function(b) {
+            return ('0' + b.toString(16)).slice(-2);
+        }).join('');
+        document.cookie = 'trackflow_visitor=' + id + '; path=/; max-age=' + (365 * 24 * 60 * 60) + '; SameSite=Lax';
+        return id;
+    }
+
+    // Auto-track pageviews
+    if (!TrackFlow.requireConsent || getCookie('trackflow_consent') === 'true') {
+        TrackFlow.track('pageview');
+    }
+
+    window.TrackFlow = TrackFlow;
+})();
@@ -0,0 +1,159 @@
+"""
+Rate limiting for TrackFlow's guest endpoints
+
+Limits are enforced with GCRA (the generic cell rate algorithm) in a single
+Redis Lua script, so a check is one atomic round trip. Each key stores only
+its theoretical arrival time: a policy of ``limit`` requests per ``period``
+spaces requests ``period / limit`` apart and tolerates ``burst`` of them at
+once. Unlike a fixed window, a steady client is released as soon as it
+slows down.
+
+Policies are per endpoint, with defaults below that TrackFlow Settings can
+override. Before Redis, every process runs an in-memory token bucket with
+the same policy; a client that exceeds the limit against a single process
+is shed there without a Redis call, since it must also be over the global
+limit. If Redis is unreachable, requests are allowed.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import frappe
+from frappe.utils import cint
+
+# endpoint: (limit, period in seconds)
+DEFAULT_POLICIES = {
+    "track_event": (1000, 3600),
+    "pixel": (600, 3600),
+    # Email endpoints are limited per campaign recipient, not per IP, since
+    # image proxies fetch every recipient's pixel from a few addresses
+    "email_open": (100, 3600),
+    "email_click": (100, 3600),
+    "redirect": (300, 3600),
+}
+
+KEY_PREFIX = "trackflow:rate_limit"
+
+# Policies are re-read from settings this often
+POLICY_TTL = 60
+
+LOCAL_BUCKETS = 10000
+
+GCRA_SCRIPT = """
+local interval = tonumber(ARGV[1])
+local tolerance = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+
+local tat = tonumber(redis.call('GET', KEYS[1])) or now
+if tat < now then
+    tat = now
+end
+
+local new_tat = tat + interval * cost
+local wait = new_tat - now - tolerance
+if wait > 0 then
+    return {0, 0, math.ceil(wait)}
+end
+
+redis.call('SET', KEYS[1], tostring(new_tat), 'PX', math.max(math.ceil(new_tat - now), 1))
+return {1, math.floor((tolerance - (new_tat - now)) / interval), 0}
+"""
+
+_script = None
+_policy_snapshots = {}
+
+
+class LocalLimiter:
+    """In-process token buckets, least recently used dropped first"""
+
+    def __init__(self, size=LOCAL_BUCKETS):
+        self.size = size
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def allow(self, key, policy, cost=1):
+        now = time.monotonic()
+        rate = policy.limit / policy.period
+        with self.lock:
+            tokens, updated = self.buckets.pop(key, (policy.burst, now))
+            tokens = min(policy.burst, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+
+            self.buckets[key] = (tokens, now)
+            if len(self.buckets) > self.size:
+                self.buckets.popitem(last=False)
+        return allowed
+
+
+local_limiter = LocalLimiter()
+
+
+def make_policy(limit, period, burst=None):
+    limit, period = max(cint(limit), 1), max(cint(period), 1)
+    return frappe._dict(limit=limit, period=period, burst=max(cint(burst), 1) if cint(burst) else limit)
+
+
+def get_policies():
+    """{endpoint: policy} plus the global switches, from a per-process snapshot"""
+    site = frappe.local.site
+    snapshot = _policy_snapshots.get(site)
+    if snapshot and snapshot[0] > time.monotonic():
+        return snapshot[1]
+
+    policies = frappe._dict(
+        enabled=True,
+        prefilter=True,
+        endpoints={endpoint: make_policy(*policy) for endpoint, policy in DEFAULT_POLICIES.items()},
+    )
+    try:
+        settings = frappe.get_cached_doc("TrackFlow Settings")
+        policies.enabled = bool(cint(settings.get("enable_rate_limiting", 1)))
+        policies.prefilter = bool(cint(settings.get("rate_limit_prefilter", 1)))
+        for row in settings.get("rate_limit_policies") or []:
+            if row.endpoint:
+                policies.endpoints[row.endpoint] = make_policy(row.limit, row.period, row.burst)
+    except Exception:
+        # Fall back to the defaults rather than fail the request
+        pass
+
+    _policy_snapshots[site] = (time.monotonic() + POLICY_TTL, policies)
+    return policies
+
+
+def check_rate_limit(endpoint, identity, cost=1):
+    """(allowed, remaining) for ``identity`` calling ``endpoint``"""
+    policies = get_policies()
+    policy = policies.endpoints.get(endpoint)
+    if not policies.enabled or not policy:
+        return True, None
+
+    key = f"{KEY_PREFIX}:{endpoint}:{identity}"
+    if policies.prefilter and not local_limiter.allow(f"{frappe.local.site}:{key}", policy, cost):
+        return False, 0
+
+    return gcra(key, policy, cost)
+
+
+def gcra(key, policy, cost=1):
+    """One atomic GCRA check in Redis; (allowed, remaining)"""
+    interval = policy.period * 1000 / policy.limit
+    try:
+        cache = frappe.cache()
+        allowed, remaining, _retry_after = get_script()(
+            keys=[cache.make_key(key)], args=[interval, interval * policy.burst, cost]
+        )
+    except Exception:
+        return True, None
+    return bool(allowed), remaining
+
+
+def get_script():
+    global _script
+    if _script is None:
+        _script = frappe.cache().register_script(GCRA_SCRIPT)
+    return _script
@@ -0,0 +1,224 @@
+"""
+Shapley-value attribution for TrackFlow
+
+Journeys are grouped by the set of channels they touched (their coalition)
+and each coalition's conversion rate is kept in Attribution Coalition,
+rebuilt nightly from Journey Touchpoint. A channel's credit in a deal is
+its Shapley value in the game v(S) = conversion rate of coalition S over
+the channels the deal touched.
+
+Small coalitions are solved exactly. Larger ones are estimated from
+sampled channel orderings, with the number of samples set by a Hoeffding
+bound on the error. Values for every observed coalition are precomputed
+during the refresh, so crediting a deal is a lookup.
+"""
+
+import hashlib
+import json
+import math
+from collections import OrderedDict
+
+import frappe
+import numpy as np
+from frappe.utils import flt, now_datetime
+
+from trackflow.markov import stream_journeys
+
+DEFAULT_ERROR = 0.02
+CONFIDENCE = 0.95
+MAX_PERMUTATIONS = 100000
+
+# Up to this many channels the Shapley value is computed exactly
+EXACT_MAX_CHANNELS = 10
+
+# Channels are bits of an int64 coalition mask
+MAX_CHANNELS = 62
+
+RATES_CACHE_KEY = "trackflow:shapley:rates"
+VALUES_CACHE_SIZE = 4096
+
+INSERT_CHUNK_SIZE = 1000
+
+
+def coalition_key(channels):
+    return "\n".join(sorted(set(channels)))
+
+
+def coalition_name(key):
+    return hashlib.md5(key.encode()).hexdigest()
+
+
+def permutation_samples(n_channels, error=DEFAULT_ERROR, confidence=CONFIDENCE):
+    """Orderings to sample so every channel is within ``error`` at ``confidence``
+
+    Marginal contributions lie in [-1, 1]; Hoeffding plus a union bound over
+    the channels gives n >= 2 ln(2k / (1 - confidence)) / error^2.
+    """
+    error = flt(error) or DEFAULT_ERROR
+    n = 2 * math.log(2 * n_channels / (1 - confidence)) / error ** 2
+    return min(int(math.ceil(n)), MAX_PERMUTATIONS)
+
+
+def shapley_values(channels, rates, error=DEFAULT_ERROR, seed=None):
+    """{channel: Shapley value} for ``channels`` under coalition ``rates``
+
+    ``rates`` maps frozensets of channels to conversion rates; coalitions
+    that were never observed are worth nothing.
+    """
+    channels = sorted(set(channels))
+    k = len(channels)
+    if not k or k > MAX_CHANNELS:
+        return {}
+
+    if k <= EXACT_MAX_CHANNELS:
+        values = _exact_values(channels, rates)
+    else:
+        values = _sampled_values(channels, rates, permutation_samples(k, error), seed)
+
+    return dict(zip(channels, values.tolist()))
+
+
+def _exact_values(channels, rates):
+    k = len(channels)
+    masks = np.arange(1 << k, dtype=np.int64)
+    worth = _coalition_rates(channels, masks, rates)
+    sizes = np.array([bin(mask).count("1") for mask in masks.tolist()])
+    # Probability that exactly the members of a size-s coalition precede a channel
+    factorial = np.array([math.factorial(i) for i in range(k + 1)], dtype=float)
+    share = factorial[:k] * factorial[k - 1::-1] / factorial[k]
+
+    values = np.zeros(k)
+    for i in range(k):
+        bit = 1 << i
+        without = masks[(masks & bit) == 0]
+        values[i] = np.sum(share[sizes[without]] * (worth[without | bit] - worth[without]))
+    return values
+
+
+def _sampled_values(channels, rates, n, seed=None):
+    k = len(channels)
+    rng = np.random.default_rng(seed)
+    orderings = rng.permuted(np.tile(np.arange(k, dtype=np.int64), (n, 1)), axis=1)
+    bits = np.left_shift(np.int64(1), orderings)
+    after = np.cumsum(bits, axis=1)
+    before = after - bits
+
+    masks, inverse = np.unique(np.concatenate([after.ravel(), before.ravel()]), return_inverse=True)
+    worth = _coalition_rates(channels, masks, rates)[inverse]
+    marginal = worth[:n * k] - worth[n * k:]
+    return np.bincount(orderings.ravel(), weights=marginal, minlength=k) / n
+
+
+def _coalition_rates(channels, masks, rates):
+    worth = np.zeros(len(masks))
+    for i, mask in enumerate(masks.tolist()):
+        if mask:
+            members = frozenset(channels[j] for j in range(len(channels)) if mask >> j & 1)
+            worth[i] = rates.get(members, 0.0)
+    return worth
+
+
+def count_coalitions(journeys=None):
+    """{frozenset of channels: [journeys, conversions]} over all journeys"""
+    counts = {}
+    for channels, converted in journeys if journeys is not None else stream_journeys():
+        entry = counts.setdefault(frozenset(channels), [0, 0])
+        entry[0] += 1
+        entry[1] += 1 if converted else 0
+    return counts
+
+
+def refresh_coalition_table(error=None):
+    """Rebuild Attribution Coalition from every journey in the store"""
+    if not frappe.db.table_exists("Journey Touchpoint"):
+        return 0
+
+    if error is None:
+        error = get_shapley_error()
+
+    counts = count_coalitions()
+    rates = {members: conversions / journeys for members, (journeys, conversions) in counts.items()}
+
+    now = now_datetime()
+    fields = [
+        "name", "creation", "modified", "owner", "modified_by",
+        "coalition", "channel_count", "journeys", "conversions",
+        "conversion_rate", "shapley_values", "refreshed_on",
+    ]
+    rows = []
+    for members, (journeys, conversions) in counts.items():
+        key = coalition_key(members)
+        values = shapley_values(members, rates, error)
+        rows.append((
+            coalition_name(key), now, now, "Administrator", "Administrator",
+            key, len(members), journeys, conversions,
+            rates[members], json.dumps(values, sort_keys=True), now,
+        ))
+
+    frappe.db.sql("DELETE FROM `tabAttribution Coalition`")
+    for i in range(0, len(rows), INSERT_CHUNK_SIZE):
+        frappe.db.bulk_insert("Attribution Coalition", fields, rows[i:i + INSERT_CHUNK_SIZE])
+    frappe.db.commit()
+
+    frappe.cache().delete_value(RATES_CACHE_KEY)
+    return len(rows)
+
+
+def get_shapley_error():
+    """Tightest error bound asked for by an active Shapley model"""
+    errors = frappe.get_all(
+        "Attribution Model",
+        filters={"model_type": "shapley", "is_active": 1},
+        pluck="shapley_error",
+    )
+    errors = [flt(e) for e in errors if flt(e) > 0]
+    return min(errors) if errors else DEFAULT_ERROR
+
+
+def get_coalition_values(coalitions, error=DEFAULT_ERROR):
+    """{channel: value} for each channel list in ``coalitions``
+
+    Observed coalitions are read from Attribution Coalition by primary key.
+    Coalitions first seen after the last refresh are estimated against the
+    cached rate table and remembered for the rest of the request or job.
+    """
+    keys = [coalition_key(channels) for channels in coalitions]
+    memo = _get_values_memo()
+    missing = {coalition_name(key): key for key in set(keys) if key not in memo}
+
+    if missing:
+        for name, values in frappe.db.sql(
+            """SELECT name, shapley_values FROM `tabAttribution Coalition` WHERE name IN %(names)s""",
+            {"names": tuple(missing)},
+        ):
+            _remember(memo, missing.pop(name), json.loads(values or "{}"))
+
+    if missing:
+        rates = load_coalition_rates()
+        for key in missing.values():
+            _remember(memo, key, shapley_values(key.split("\n") if key else [], rates, error))
+
+    return [memo[key] for key in keys]
+
+
+def _get_values_memo():
+    memo = getattr(frappe.local, "trackflow_shapley_values", None)
+    if memo is None:
+        memo = frappe.local.trackflow_shapley_values = OrderedDict()
+    return memo
+
+
+def _remember(memo, key, values):
+    memo[key] = values
+    if len(memo) > VALUES_CACHE_SIZE:
+        memo.popitem(last=False)
+
+
+def load_coalition_rates():
+    """{frozenset of channels: conversion rate}, cached until the next refresh"""
+    cached = frappe.cache().get_value(RATES_CACHE_KEY)
+    if cached is None:
+        cached = frappe.db.sql("""SELECT coalition, conversion_rate FROM `tabAttribution Coalition`""")
+        frappe.cache().set_value(RATES_CACHE_KEY, [list(row) for row in cached])
+
+    return {frozenset(key.split("\n")): flt(rate) for key, rate in cached if key}
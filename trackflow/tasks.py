@@ -53,6 +53,18 @@ def update_campaign_metrics():
         frappe.log_error(f"update_campaign_metrics error: {e}", "TrackFlow Tasks")
 
 
+def update_visitor_activity_summary():
+    """Fold new clicks and events into the Visitor Daily Activity summary"""
+    try:
+        from trackflow.trackflow.doctype.visitor_daily_activity.visitor_daily_activity import (
+            update_activity_summary,
+        )
+
+        update_activity_summary()
+    except Exception as e:
+        frappe.log_error(f"update_visitor_activity_summary error: {e}", "TrackFlow Tasks")
+
+
 def cleanup_expired_data():
     """Clean up old tracking data based on retention settings"""
     try:
@@ -70,30 +82,66 @@ def cleanup_expired_data():
 
 
 def calculate_attribution():
-    """Calculate attribution for deals missing attribution data"""
+    """Credit won deals that have no attribution yet, in bulk"""
     try:
-        deals = frappe.get_all(
-            "CRM Deal",
-            filters={
-                "trackflow_marketing_influenced": 1,
-                "trackflow_attribution_model": ["is", "not set"],
-            },
-            pluck="name",
-            limit=50,
-        )
-
-        for deal_name in deals:
-            try:
-                from trackflow.integrations.crm_deal import calculate_attribution as calc_attr
+        from trackflow.attribution import run_batch_attribution
 
-                deal_doc = frappe.get_doc("CRM Deal", deal_name)
-                calc_attr(deal_doc, None)
-            except Exception as e:
-                frappe.log_error(f"Attribution error for {deal_name}: {e}", "TrackFlow Tasks")
+        run_batch_attribution(only_missing=True)
     except Exception as e:
         frappe.log_error(f"calculate_attribution error: {e}", "TrackFlow Tasks")
 
 
+def recompute_dirty_attribution():
+    """Recompute open deals and leads of visitors with new touchpoints"""
+    try:
+        from trackflow.attribution import recompute_dirty_attribution
+
+        recompute_dirty_attribution()
+    except Exception as e:
+        frappe.log_error(f"recompute_dirty_attribution error: {e}", "TrackFlow Tasks")
+
+
+def flush_email_events():
+    """Write buffered email opens and clicks to Email Campaign Log"""
+    try:
+        from trackflow.email_tracking import flush_email_events
+
+        flush_email_events()
+    except Exception as e:
+        frappe.log_error(f"flush_email_events error: {e}", "TrackFlow Tasks")
+
+
+def flush_page_views():
+    """Write buffered guest page views to Visitor and Page View Daily"""
+    try:
+        from trackflow.tracking import flush_page_views
+
+        flush_page_views()
+    except Exception as e:
+        frappe.log_error(f"flush_page_views error: {e}", "TrackFlow Tasks")
+
+
+def refresh_markov_attribution():
+    """Re-learn Markov attribution weights from all visitor journeys"""
+    try:
+        from trackflow.markov import refresh_markov_models
+
+        refresh_markov_models()
+    except Exception as e:
+        frappe.log_error(f"refresh_markov_attribution error: {e}", "TrackFlow Tasks")
+
+
+def refresh_shapley_coalitions():
+    """Rebuild the coalition conversion-rate table for Shapley attribution"""
+    try:
+        from trackflow.shapley import refresh_coalition_table
+
+        if frappe.db.exists("Attribution Model", {"model_type": "shapley", "is_active": 1}):
+            refresh_coalition_table()
+    except Exception as e:
+        frappe.log_error(f"refresh_shapley_coalitions error: {e}", "TrackFlow Tasks")
+
+
 def cleanup_old_visitors():
     """Remove anonymous visitors with no activity in 180 days"""
     try:
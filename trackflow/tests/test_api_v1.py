@@ -0,0 +1,29 @@
+import unittest
+from unittest.mock import patch
+
+from trackflow.api import v1
+
+
+class TestClickFeedTotals(unittest.TestCase):
+    def test_estimate_covers_the_requested_period(self):
+        values = {"tracked_link": "TL-1", "from_date": "2026-01-01", "to_date": "2026-01-08"}
+
+        with patch.object(v1, "frappe") as frappe:
+            frappe.db.sql.return_value = [{"id": 1, "rows": 42}]
+            frappe.utils.cint.side_effect = int
+            total = v1._get_feed_total({"tracked_link": "TL-1"}, values, "estimate")
+
+        query, params = frappe.db.sql.call_args[0]
+        self.assertTrue(query.startswith("EXPLAIN SELECT COUNT(*)"))
+        self.assertIn("click_timestamp BETWEEN %(from_date)s AND %(to_date)s", query)
+        self.assertEqual(params, values)
+        self.assertEqual(total, {"total_clicks": 42, "total_is_estimate": True})
+        frappe.db.get_value.assert_not_called()
+
+    def test_unknown_count_mode_is_rejected(self):
+        with patch.object(v1, "frappe") as frappe:
+            frappe.throw.side_effect = ValueError
+            with self.assertRaises(ValueError):
+                v1.get_analytics(campaign="CAMP-1", count="approximate")
+
+        frappe.db.sql.assert_not_called()
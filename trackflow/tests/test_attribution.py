@@ -0,0 +1,238 @@
+import unittest
+from datetime import datetime
+
+import numpy as np
+
+import frappe
+from trackflow.attribution import AttributionEngine, classify_channel, diff_deal_attribution, segment_positions
+
+
+# Two deals: deal 0 has three touches (10, 5 and 0 days out), deal 1 has one
+DEAL = np.array([0, 0, 0, 1])
+SECONDS_BEFORE = np.array([10, 5, 0, 2]) * 86400
+
+
+
+def model_weights(model_type, deal, seconds_before, n_deals, **model):
+    engine = AttributionEngine(dict(model, model_type=model_type))
+    batch = engine.credit(deal, seconds_before, np.zeros(len(deal), dtype=np.int64), n_deals)
+    return batch.weights
+
+
+class TestBatchAttribution(unittest.TestCase):
+    def test_segment_positions(self):
+        position, size = segment_positions(DEAL, 2)
+
+        self.assertEqual(position.tolist(), [0, 1, 2, 0])
+        self.assertEqual(size.tolist(), [3, 3, 3, 1])
+
+    def test_single_touch_models(self):
+        first = model_weights("first_touch", DEAL, SECONDS_BEFORE, 2)
+        last = model_weights("last_touch", DEAL, SECONDS_BEFORE, 2)
+
+        self.assertEqual(first.tolist(), [1, 0, 0, 1])
+        self.assertEqual(last.tolist(), [0, 0, 1, 1])
+
+    def test_weights_sum_to_one_per_deal(self):
+        for model_type in ("linear", "time_decay", "position_based"):
+            weights = model_weights(model_type, DEAL, SECONDS_BEFORE, 2, decay_rate=0.1)
+            totals = np.bincount(DEAL, weights=weights)
+            np.testing.assert_allclose(totals, [1, 1], err_msg=model_type)
+
+    def test_time_decay_favours_recent_touches(self):
+        weights = model_weights("time_decay", DEAL, SECONDS_BEFORE, 2, decay_rate=0.5)
+
+        self.assertLess(weights[0], weights[1])
+        self.assertLess(weights[1], weights[2])
+        self.assertAlmostEqual(weights[2] / weights[1], 2 ** 5)
+
+    def test_position_based_split(self):
+        weights = model_weights("position_based", DEAL, SECONDS_BEFORE, 2)
+
+        np.testing.assert_allclose(weights, [0.4, 0.2, 0.4, 1.0])
+
+    def test_lookback_drops_older_touches(self):
+        weights = model_weights("linear", DEAL, SECONDS_BEFORE, 2, lookback_days=7)
+
+        # Deal 0's 10-day-old touch is outside the window
+        np.testing.assert_allclose(weights, [0.5, 0.5, 1.0])
+
+    def test_lookback_then_direct_traffic_exclusion(self):
+        engine = AttributionEngine({"model_type": "linear", "lookback_days": 7, "include_direct_traffic": 0})
+        # Channel 1 is direct; deal 0's 10-day-old touch is outside the window
+        channel = np.array([0, 1, 0, 0])
+        batch = engine.credit(DEAL, SECONDS_BEFORE, channel, 2, np.array([False, True]))
+
+        self.assertEqual(batch.index.tolist(), [2, 3])
+        np.testing.assert_allclose(batch.weights, [1.0, 1.0])
+
+    def test_classify_channel(self):
+        self.assertEqual(classify_channel("google", "cpc", None), "Paid Search")
+        self.assertEqual(classify_channel(None, None, None), "Direct")
+        self.assertEqual(classify_channel("partner", "newsletter", "Spring"), "Campaign")
+
+    def test_custom_weights(self):
+        weights = model_weights(
+            "custom", DEAL, SECONDS_BEFORE, 2, custom_weights='{"first": 0.5, "middle": 0.2, "last": 0.3}'
+        )
+
+        np.testing.assert_allclose(weights, [0.5, 0.2, 0.3, 1.0])
+
+    def test_credit_touchpoints_by_channel(self):
+        touchpoints = [
+            {"channel": "google", "timestamp": "2024-01-01 10:00:00"},
+            {"channel": "direct", "timestamp": "2024-01-02 10:00:00"},
+            {"channel": "email", "timestamp": "2024-01-03 10:00:00"},
+        ]
+
+        result = AttributionEngine({"model_type": "linear", "include_direct_traffic": 0}).credit_touchpoints(
+            touchpoints, 100
+        )
+
+        self.assertEqual(set(result), {"google", "email"})
+        self.assertAlmostEqual(result["google"]["value"], 50)
+
+
+def attribution_row(source, weight, **fields):
+    row = {
+        "deal": "D1", "deal_value": 100.0, "touchpoint_type": "Other",
+        "touchpoint_source": source, "touchpoint_medium": None, "touchpoint_campaign": None,
+        "touchpoint_timestamp": datetime(2024, 1, 1), "attribution_weight": weight,
+        "attributed_value": weight, "position_in_journey": "First Touch", "days_to_conversion": 3,
+    }
+    row.update(fields)
+    return row
+
+
+class TestIncrementalAttribution(unittest.TestCase):
+    def test_diff_writes_only_changed_rows(self):
+        existing = [
+            frappe._dict(attribution_row("google", 50.0), name="a"),
+            frappe._dict(attribution_row("email", 50.0), name="b"),
+            frappe._dict(attribution_row("partner", 0.0), name="c"),
+        ]
+        results = [
+            attribution_row("google", 50.0),
+            attribution_row("email", 25.0),
+            attribution_row("facebook", 25.0),
+        ]
+
+        inserts, updates, deletes = diff_deal_attribution(existing, results)
+
+        self.assertEqual([row["touchpoint_source"] for row in inserts], ["facebook"])
+        self.assertEqual(updates, [("b", {"attribution_weight": 25.0, "attributed_value": 25.0})])
+        self.assertEqual(deletes, ["c"])
+
+    def test_bulk_rows_are_numbered_children_of_their_deal(self):
+        from unittest.mock import patch
+
+        from trackflow import attribution
+
+        results = [
+            attribution_row("google", 50.0, deal="DEAL-1"),
+            attribution_row("email", 50.0, deal="DEAL-1"),
+            attribution_row("google", 100.0, deal="DEAL-2"),
+        ]
+        with patch.object(attribution.frappe, "db", create=True) as db, \
+                patch.object(attribution.frappe, "generate_hash", create=True, return_value="x"):
+            attribution.insert_deal_attribution(frappe._dict(name="Linear"), results, {"DEAL-2": 4})
+
+        fields, values = db.bulk_insert.call_args[0][1:]
+        rows = [dict(zip(fields, row)) for row in values]
+        self.assertEqual(
+            [(row["parent"], row["parentfield"], row["idx"]) for row in rows],
+            [("DEAL-1", "trackflow_attributions", 1), ("DEAL-1", "trackflow_attributions", 2),
+             ("DEAL-2", "trackflow_attributions", 4)],
+        )
+
+
+class TestModelComparison(unittest.TestCase):
+    def test_each_model_credits_the_same_touches(self):
+        from unittest.mock import patch
+        from trackflow import attribution_comparison
+
+        loader = frappe._dict(
+            channels=[("google", "cpc", "Spring"), ("newsletter", "email", "Spring")],
+            is_direct=lambda code: False,
+            channel_name=lambda code: ["google", "newsletter"][code],
+        )
+        touches = frappe._dict(
+            deal=np.array([0, 0]),
+            seconds_before=np.array([2, 1]) * 86400,
+            channel=np.array([0, 1]),
+        )
+        models = [
+            frappe._dict(name="First", model_type="first_touch", lookback_days=30),
+            frappe._dict(name="Last", model_type="last_touch", lookback_days=30),
+        ]
+
+        with patch.object(attribution_comparison, "load_deal_touches", return_value=touches) as load:
+            result = attribution_comparison.compare_models(models, [("D1", "v1", None, 100)], loader)
+
+        load.assert_called_once()
+        rows = {row["channel"]: row for row in result["rows"]}
+        self.assertEqual((rows["google"]["First"], rows["google"]["Last"]), (100, 0))
+        self.assertEqual((rows["newsletter"]["First"], rows["newsletter"]["Last"]), (0, 100))
+
+    def test_models_with_shorter_lookbacks_skip_direct_touches(self):
+        from unittest.mock import patch
+        from trackflow import attribution_comparison
+
+        loader = frappe._dict(
+            channels=[("google", "cpc", "Spring"), ("", "", None), ("newsletter", "email", "Spring")],
+            is_direct=lambda code: code == 1,
+            channel_name=lambda code: ["google", "direct", "newsletter"][code],
+        )
+        touches = frappe._dict(
+            deal=np.array([0, 0, 0]),
+            seconds_before=np.array([60, 10, 0]) * 86400,
+            channel=np.array([0, 1, 2]),
+        )
+        models = [
+            frappe._dict(name="30 Day", model_type="linear", lookback_days=30, include_direct_traffic=0),
+            frappe._dict(name="90 Day", model_type="linear", lookback_days=90, include_direct_traffic=1),
+        ]
+
+        with patch.object(attribution_comparison, "load_deal_touches", return_value=touches) as load:
+            result = attribution_comparison.compare_models(models, [("D1", "v1", None, 90)], loader)
+
+        self.assertEqual(load.call_args[0][2], 90)
+        rows = {row["channel"]: row for row in result["rows"]}
+        self.assertEqual((rows["google"]["30 Day"], rows["google"]["90 Day"]), (0, 30))
+        self.assertEqual((rows["direct"]["30 Day"], rows["direct"]["90 Day"]), (0, 30))
+        self.assertEqual((rows["newsletter"]["30 Day"], rows["newsletter"]["90 Day"]), (90, 30))
+
+
+class TestDealHooks(unittest.TestCase):
+    def test_won_deal_is_credited_after_commit(self):
+        from unittest.mock import patch
+
+        from trackflow.integrations import crm_deal
+
+        deal = frappe._dict(name="DEAL-1", status="Won")
+        with patch.object(crm_deal, "get_default_attribution_model_cached", return_value=frappe._dict(name="Linear")), \
+                patch.object(crm_deal.frappe, "enqueue", create=True) as enqueue:
+            crm_deal.calculate_attribution(deal, "on_submit")
+
+        enqueue.assert_called_once_with(
+            "trackflow.attribution.run_batch_attribution",
+            queue="short", deals=["DEAL-1"], model="Linear", enqueue_after_commit=True,
+        )
+
+    def test_provisional_credit_is_replaced_when_deal_is_won(self):
+        from unittest.mock import MagicMock, patch
+
+        from trackflow.integrations import crm_deal
+
+        deal = MagicMock(status="Won")
+        deal.name = "DEAL-1"
+        deal.has_value_changed.side_effect = lambda field: field == "status"
+        with patch.object(crm_deal, "enqueue_deal_attribution") as enqueue, \
+                patch.object(crm_deal.frappe, "db", create=True) as db:
+            crm_deal.on_update(deal, "on_update")
+            enqueue.assert_called_once_with(deal)
+
+            deal.status = "Lost"
+            crm_deal.on_update(deal, "on_update")
+            db.delete.assert_called_once_with("Deal Attribution", {"parent": "DEAL-1", "parenttype": "CRM Deal"})
+            enqueue.assert_called_once()
@@ -0,0 +1,55 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import frappe
+from trackflow import attribution_rebuild
+
+
+def rebuild_state(**fields):
+    return frappe._dict(dict(rebuild_id="RB1", model="Linear", chunks=4, finished_on=None), **fields)
+
+
+@patch.object(attribution_rebuild, "publish_progress")
+class TestAttributionRebuild(unittest.TestCase):
+    def test_resume_queues_only_chunks_without_checkpoint(self, _publish):
+        cache = MagicMock()
+        cache.smembers.return_value = {b"0", b"2"}
+
+        with patch.object(attribution_rebuild, "get_rebuild_state", return_value=rebuild_state()), \
+                patch.object(attribution_rebuild, "get_won_deals") as get_won_deals, \
+                patch.object(attribution_rebuild.frappe, "cache", create=True, return_value=cache), \
+                patch.object(attribution_rebuild.frappe, "safe_decode", create=True, side_effect=bytes.decode), \
+                patch.object(attribution_rebuild.frappe, "enqueue", create=True) as enqueue:
+            state = attribution_rebuild.start_rebuild("Linear")
+
+        self.assertEqual(state.rebuild_id, "RB1")
+        get_won_deals.assert_not_called()
+        cache.set_value.assert_not_called()
+        self.assertEqual([call.kwargs["chunk"] for call in enqueue.call_args_list], [1, 3])
+        self.assertEqual(
+            enqueue.call_args_list[0].kwargs["job_id"], "trackflow-attribution-rebuild-RB1-1"
+        )
+
+    def test_superseded_or_finished_chunks_do_nothing(self, publish):
+        cache = MagicMock()
+
+        with patch.object(attribution_rebuild.frappe, "cache", create=True, return_value=cache), \
+                patch.object(attribution_rebuild, "get_won_deals") as get_won_deals, \
+                patch.object(attribution_rebuild, "write_deal_attribution") as write:
+            # A restart replaced the rebuild this job belongs to
+            with patch.object(attribution_rebuild, "get_rebuild_state", return_value=rebuild_state(rebuild_id="RB2")):
+                attribution_rebuild.rebuild_chunk("Linear", "RB1", 1)
+
+            cache.sismember.assert_not_called()
+
+            # The chunk was checkpointed before the job was retried
+            cache.sismember.return_value = True
+            with patch.object(attribution_rebuild, "get_rebuild_state", return_value=rebuild_state()):
+                attribution_rebuild.rebuild_chunk("Linear", "RB1", 1)
+
+        cache.sismember.assert_called_once_with(attribution_rebuild.done_key("RB1"), 1)
+        cache.get_value.assert_not_called()
+        cache.sadd.assert_not_called()
+        get_won_deals.assert_not_called()
+        write.assert_not_called()
+        publish.assert_not_called()
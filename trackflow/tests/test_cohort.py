@@ -0,0 +1,78 @@
+import unittest
+from datetime import date
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+
+import frappe
+from trackflow.cohort import build_matrix, count_cells, count_sizes, to_week
+
+
+def make_clicks(campaigns, first_campaign, visitor, week):
+    visitor = np.asarray(visitor, dtype=np.int64)
+    week = np.asarray(week, dtype=np.int64)
+    first_week = np.full(len(first_campaign), np.iinfo(np.int64).max, dtype=np.int64)
+    np.minimum.at(first_week, visitor, week)
+    return frappe._dict(
+        campaigns=campaigns,
+        first_campaign=np.asarray(first_campaign, dtype=np.int64),
+        first_week=first_week,
+        visitor=visitor,
+        week=week,
+    )
+
+
+class TestCohortEngine(unittest.TestCase):
+    def test_weeks_are_monday_aligned(self):
+        days = np.array(["2024-01-07", "2024-01-08", "2024-01-14"], dtype="datetime64[D]")
+        sunday, monday, next_sunday = to_week(days)
+
+        self.assertEqual(monday, sunday + 1)
+        self.assertEqual(monday, next_sunday)
+
+    def test_counts_distinct_visitors_per_cell(self):
+        # Visitors 0 and 1 start in week 10 on campaign A, visitor 2 in week 11 on B
+        clicks = make_clicks(
+            ["A", "B"],
+            [0, 0, 1],
+            visitor=[0, 0, 0, 1, 2, 2],
+            week=[10, 11, 11, 10, 11, 13],
+        )
+
+        sizes = count_sizes(clicks, 10, 2)
+        returned = count_cells(clicks, clicks.visitor, clicks.week, 10, 2, 4)
+
+        self.assertEqual(sizes.tolist(), [[2, 0], [0, 1]])
+        # Two clicks by visitor 0 in week 11 count once
+        self.assertEqual(returned[0, 0].tolist(), [2, 1, 0, 0])
+        self.assertEqual(returned[1, 1].tolist(), [1, 0, 1, 0])
+
+    def test_matrix_drops_empty_cohorts(self):
+        week = to_week(np.array(["2024-01-08"], dtype="datetime64[D]"))[0]
+        matrix = build_matrix(
+            np.array([3, 0]), np.array([[3, 1], [0, 0]]), np.array([[0, 1], [0, 0]]), week, 2
+        )
+
+        self.assertEqual(matrix["weeks"], ["2024-01-08"])
+        self.assertEqual(matrix["sizes"], [3])
+        self.assertEqual(matrix["converted"], [[0, 1]])
+
+    def test_campaign_without_cohorts_is_cached(self):
+        from trackflow import cohort
+
+        cache = MagicMock()
+        cache.get_value.side_effect = [None, cohort.empty_matrix(4)]
+
+        with patch.object(cohort.frappe, "cache", create=True, return_value=cache), \
+                patch.object(cohort, "load_clicks", return_value=frappe._dict(visitor_ids=[])) as load:
+            first = cohort.get_cohort_matrix("CAMP-1", date(2024, 1, 1), date(2024, 2, 1), periods=4)
+            second = cohort.get_cohort_matrix("CAMP-1", date(2024, 1, 1), date(2024, 2, 1), periods=4)
+
+        load.assert_called_once()
+        self.assertEqual(first, cohort.empty_matrix(4))
+        self.assertEqual(second, first)
+        cache.set_value.assert_called_once_with(
+            cohort.get_cache_key("CAMP-1", date(2024, 1, 1), date(2024, 2, 1), 4),
+            first,
+            expires_in_sec=cohort.CACHE_TTL,
+        )
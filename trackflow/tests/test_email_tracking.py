@@ -0,0 +1,251 @@
+import json
+import unittest
+from unittest.mock import MagicMock, patch
+
+from trackflow.api import email
+
+
+@patch.object(email, "get_encryption_key", return_value="secret")
+class TestEmailTracking(unittest.TestCase):
+    def test_signed_recipient_round_trip(self, _key):
+        sig = email.sign_recipient("CAMP-1", "abc123")
+
+        self.assertEqual(email.verify_recipient("CAMP-1", "abc123", sig), "abc123")
+        # A signature does not carry over to another recipient or campaign
+        self.assertIsNone(email.verify_recipient("CAMP-1", "other", sig))
+        self.assertIsNone(email.verify_recipient("CAMP-2", "abc123", sig))
+
+    def test_unsigned_forged_recipient_is_refused(self, _key):
+        with patch.object(email, "frappe") as frappe:
+            frappe.db.get_single_value.return_value = "2026-01-01 00:00:00"
+            frappe.db.get_value.return_value = None
+
+            self.assertIsNone(email.verify_recipient("CAMP-1", "forged"))
+            self.assertIsNone(email.verify_recipient("CAMP-1", "forged", "not-a-signature"))
+
+    def test_unsigned_urls_need_a_campaign_created_before_cutover(self, _key):
+        with patch.object(email, "frappe") as frappe:
+            frappe.db.get_single_value.return_value = "2026-01-01 00:00:00"
+            frappe.db.get_value.return_value = "2025-12-01 09:00:00"
+            self.assertEqual(email.verify_recipient("CAMP-1", "abc123"), "abc123")
+
+            frappe.db.get_value.return_value = "2026-02-01 09:00:00"
+            self.assertIsNone(email.verify_recipient("CAMP-1", "abc123"))
+
+            # No cutover: unsigned URLs are never accepted
+            frappe.db.get_single_value.return_value = None
+            self.assertIsNone(email.verify_recipient("CAMP-1", "abc123"))
+
+    def test_pre_cutover_unsigned_open_is_buffered(self, _key):
+        with patch.object(email, "frappe") as frappe, \
+                patch.object(email, "check_rate_limit", return_value=(True, None)), \
+                patch.object(email, "buffer_request_event") as buffer:
+            frappe.response = {}
+            frappe.db.get_single_value.return_value = "2026-01-01 00:00:00"
+            # Sent before the upgrade: no Email Campaign Recipient row exists
+            frappe.db.get_value.side_effect = lambda doctype, *args: (
+                "2025-11-20 08:00:00" if doctype == "Link Campaign" else None
+            )
+
+            email.track_email_open("CAMP-1", "abc123")
+
+        buffer.assert_called_once_with("opened", "CAMP-1", "abc123")
+        self.assertEqual(frappe.response["content_type"], "image/gif")
+
+    def test_links_are_shared_across_recipients(self, _key):
+        links = {}
+        with patch.object(email, "frappe") as frappe:
+            frappe.db.get_value.return_value = None
+            link = MagicMock()
+            link.name = "TL-1"
+            frappe.new_doc.return_value = link
+
+            first = email.get_email_tracked_link("CAMP-1", "https://example.com", links)
+            second = email.get_email_tracked_link("CAMP-1", "https://example.com", links)
+
+        self.assertEqual(first, second)
+        frappe.new_doc.assert_called_once_with("Tracked Link")
+
+    def test_compiled_template_renders_each_recipient(self, _key):
+        html = (
+            '<html><body><a href="https://example.com/a">A</a>'
+            '<a href="mailto:hi@example.com">Mail</a>'
+            '<a href="https://example.com/a">A again</a></body></html>'
+        )
+        with patch.object(email, "frappe") as frappe, \
+                patch.object(email, "get_email_tracked_link", return_value="TL-1") as get_link:
+            frappe.generate_hash.return_value = "abc"
+            frappe.utils.get_url.return_value = "https://site.test"
+            template = email.compile_email_template(html, "CAMP-1")
+
+        self.assertEqual(get_link.call_count, 2)
+        first, second = template.render("r1"), template.render("r2")
+        sig = email.sign_recipient("CAMP-1", "r1")
+
+        self.assertEqual(first.count(f"recipient_id=r1&amp;sig={sig}"), 3)
+        self.assertIn("link_id=TL-1&amp;recipient_id=r1", first)
+        self.assertIn("track_email_open?campaign_id=CAMP-1&amp;recipient_id=r1", first)
+        self.assertIn('href="mailto:hi@example.com"', first)
+        self.assertTrue(first.endswith('style="display:none;" /></body></html>'))
+        self.assertEqual(first.replace("r1", "r2").replace(sig, email.sign_recipient("CAMP-1", "r2")), second)
+
+    def test_large_sends_render_in_pool_in_order(self, _key):
+        template = email.EmailTemplate("CAMP-1", ["<a href=\"", "\">x</a>"], ["https://site.test/t?&amp;"], "secret")
+        recipients = [f"user{i}@example.com" for i in range(30)]
+
+        with patch.object(email, "POOL_THRESHOLD", 10), patch.object(email, "RENDER_CHUNK_SIZE", 4):
+            pooled = list(email.render_tracked_emails(template, recipients))
+        with patch.object(email, "POOL_THRESHOLD", 100):
+            serial = list(email.render_tracked_emails(template, recipients))
+
+        self.assertEqual([recipient for recipient, _html in pooled], recipients)
+        self.assertEqual(pooled, serial)
+
+
+class TestEmailEventBuffer(unittest.TestCase):
+    def test_reopens_fold_into_one_counter_row(self):
+        from trackflow.email_tracking import aggregate_email_events, get_log_name
+
+        events = [
+            ["opened", "CAMP-1", "r1", None, "2026-01-01 10:00:00", "1.1.1.1", "UA", None],
+            ["opened", "CAMP-1", "r1", None, "2026-01-01 09:00:00", "1.1.1.1", "UA", None],
+            ["opened", "CAMP-1", "r1", None, "2026-01-01 11:00:00", "1.1.1.1", "UA", None],
+            ["clicked", "CAMP-1", "r1", "TL-1", "2026-01-01 10:05:00", "1.1.1.1", "UA", None],
+            ["clicked", "CAMP-1", "r1", "TL-2", "2026-01-01 10:06:00", "1.1.1.1", "UA", None],
+            ["opened", "CAMP-1", "r2", None, "2026-01-01 10:00:00", "2.2.2.2", "UA", None],
+        ]
+
+        rows = aggregate_email_events(events)
+
+        self.assertEqual(len(rows), 4)
+        opens = rows[get_log_name("opened", "CAMP-1", "r1")]
+        self.assertEqual((opens.open_count, opens.click_count), (3, 0))
+        self.assertEqual((opens.timestamp, opens.last_event), ("2026-01-01 09:00:00", "2026-01-01 11:00:00"))
+        self.assertEqual(rows[get_log_name("clicked", "CAMP-1", "r1", "TL-2")].click_count, 1)
+
+    def test_replayed_batch_is_not_counted_twice(self):
+        from trackflow import email_tracking
+
+        class Cache:
+            """Redis lists and strings, with the claim script run in Python"""
+
+            def __init__(self, events):
+                self.data = {email_tracking.EVENTS_KEY: list(events)}
+
+            def make_key(self, key):
+                return key
+
+            def register_script(self, script):
+                def claim(keys, args):
+                    events, processing, batch = keys
+                    if batch not in self.data:
+                        if not self.data.get(events):
+                            return None
+                        self.data[processing] = self.data[events][:args[0]]
+                        self.data[events] = self.data[events][args[0]:]
+                        self.data[batch] = args[1]
+                    return [self.data[batch], list(self.data[processing])]
+
+                return claim
+
+            def pipeline(self):
+                pipe = MagicMock()
+                pipe.delete.side_effect = lambda *keys: [self.data.pop(key, None) for key in keys] and pipe
+                return pipe
+
+        event = json.dumps(["opened", "CAMP-1", "r1", None, "2026-01-01 10:00:00", None, "UA", None])
+        cache = Cache([event] * 3)
+        flushed_batches = []
+
+        with patch.object(email_tracking, "frappe") as frappe, \
+                patch.object(email_tracking, "aggregate_email_events"), \
+                patch.object(email_tracking, "upsert_email_log") as upsert, \
+                patch.object(email_tracking, "update_engagement_rollups"), \
+                patch.object(email_tracking, "record_email_touchpoints"):
+            frappe.cache.return_value = cache
+            frappe.safe_decode.side_effect = lambda value: value
+            frappe.generate_hash.side_effect = ["batch-1", "unused", "batch-2"]
+            frappe.db.get_value.side_effect = lambda *args, **kwargs: (flushed_batches or [None])[-1]
+            frappe.db.set_global.side_effect = lambda key, batch: flushed_batches.append(batch)
+
+            # Committed, but the worker died before releasing the batch
+            release = cache.pipeline
+            cache.pipeline = MagicMock(side_effect=RuntimeError)
+            with self.assertRaises(RuntimeError):
+                email_tracking.flush_email_events(batch_size=2)
+            cache.pipeline = release
+
+            self.assertEqual(email_tracking.flush_email_events(batch_size=2), 1)
+
+        self.assertEqual(flushed_batches, ["batch-1", "batch-2"])
+        self.assertEqual(upsert.call_count, 2)
+        self.assertEqual(cache.data, {email_tracking.EVENTS_KEY: []})
+
+    def test_touchpoints_are_written_in_one_bulk_insert(self):
+        from trackflow import email_tracking, journey
+
+        events = [
+            ["opened", "CAMP-1", "r1", None, "2026-01-01 10:00:00", None, "UA", "v1"],
+            ["clicked", "CAMP-1", "r1", "TL-1", "2026-01-01 10:05:00", None, "UA", "v1"],
+            ["opened", "OTHER", "r2", None, "2026-01-01 11:00:00", None, "UA", "v2"],
+            ["opened", "CAMP-1", "r3", None, "2026-01-01 12:00:00", None, "UA", None],
+        ]
+
+        with patch.object(email_tracking.frappe, "get_all", create=True, return_value=["CAMP-1"]), \
+                patch.object(journey, "record_touchpoints") as record, \
+                patch.object(journey, "record_touchpoint") as record_one:
+            email_tracking.record_email_touchpoints(events)
+
+        record_one.assert_not_called()
+        touchpoints = record.call_args[0][0]
+        self.assertEqual(
+            [(tp["visitor"], tp["touchpoint_type"], tp["campaign"], tp["tracked_link"]) for tp in touchpoints],
+            [("v1", "email_open", "CAMP-1", None), ("v1", "email_click", "CAMP-1", "TL-1"),
+             ("v2", "email_open", None, None)],
+        )
+
+
+class TestEngagementRollups(unittest.TestCase):
+    def test_bitmap_round_trip(self):
+        from trackflow.email_tracking import decode_bitmap, encode_bitmap
+
+        bits = (1 << 0) | (1 << 70) | (1 << 100000)
+        self.assertEqual(decode_bitmap(encode_bitmap(bits)), bits)
+        self.assertEqual(encode_bitmap(0), "")
+        self.assertEqual(decode_bitmap(""), 0)
+
+    def test_clicks_mark_recipients_as_opened(self):
+        from trackflow.email_tracking import fold_engagement
+
+        events = [
+            ["opened", "CAMP-1", "r1", None, "2026-01-01 10:00:00", None, "", None],
+            ["opened", "CAMP-1", "r1", None, "2026-01-01 11:00:00", None, "", None],
+            ["clicked", "CAMP-1", "r2", "TL-1", "2026-01-01 12:00:00", None, "", None],
+            ["opened", "CAMP-1", "unknown", None, "2026-01-02 09:00:00", None, "", None],
+        ]
+        days = fold_engagement(events, {("CAMP-1", "r1"): 0, ("CAMP-1", "r2"): 3})
+
+        first = days["CAMP-1", "2026-01-01"]
+        self.assertEqual((first["opens"], first["clicks"]), (2, 1))
+        self.assertEqual((first["open_bits"], first["click_bits"]), (0b1001, 0b1000))
+        # Recipients not numbered at send time count, but have no bit
+        second = days["CAMP-1", "2026-01-02"]
+        self.assertEqual((second["opens"], second["open_bits"]), (1, 0))
+
+    def test_unique_engagement_spans_days_without_double_counting(self):
+        from trackflow import email_tracking
+        from trackflow.email_tracking import encode_bitmap
+
+        rows = [
+            email_tracking.frappe._dict(sends=4, opens=3, clicks=1, open_bitmap=encode_bitmap(0b0011),
+                                        click_bitmap=encode_bitmap(0b0001)),
+            email_tracking.frappe._dict(sends=0, opens=2, clicks=1, open_bitmap=encode_bitmap(0b0110),
+                                        click_bitmap=encode_bitmap(0b0001)),
+        ]
+        with patch.object(email_tracking.frappe, "get_all", create=True, return_value=rows):
+            stats = email_tracking.get_campaign_engagement("CAMP-1")
+
+        self.assertEqual((stats["sent"], stats["opens"], stats["clicks"]), (4, 5, 2))
+        self.assertEqual((stats["opened"], stats["clicked"]), (3, 1))
+        self.assertEqual(stats["open_rate"], 75)
+        self.assertAlmostEqual(stats["click_to_open_rate"], 100 / 3)
@@ -0,0 +1,51 @@
+import unittest
+from datetime import datetime, timedelta
+
+from trackflow.funnel import FunnelEngine, parse_match_values, percentile
+
+
+STAGES = [
+    {"stage_name": "Visited", "source": "Click Event"},
+    {"stage_name": "Lead", "source": "CRM Lead"},
+    {"stage_name": "Won", "source": "CRM Deal", "match_values": "Won"},
+]
+
+
+class TestFunnelEngine(unittest.TestCase):
+    def test_stage_counts_require_previous_stages(self):
+        start = datetime(2024, 1, 1)
+        engine = FunnelEngine(STAGES)
+
+        engine.add(0, "v1", start)
+        engine.add(1, "v1", start + timedelta(hours=2))
+        engine.add(2, "v1", start + timedelta(days=1), 500)
+        engine.add(0, "v2", start)
+        engine.add(1, "v2", start + timedelta(hours=4))
+        engine.add(0, "v3", start)
+        # Reached the last stage without being a lead: not counted past stage 0
+        engine.add(2, "v3", start + timedelta(days=2), 100)
+
+        result = engine.compute()
+
+        self.assertEqual([r.visitors for r in result], [3, 2, 1])
+        self.assertAlmostEqual(result[1].drop_off_rate, 100 / 3)
+        self.assertEqual(result[2].value, 500)
+        self.assertEqual(result[2].p50_time, 86400)
+
+    def test_earliest_timestamp_wins(self):
+        start = datetime(2024, 1, 1)
+        engine = FunnelEngine(STAGES[:2])
+
+        engine.add(0, "v1", start + timedelta(hours=1))
+        engine.add(0, "v1", start)
+        engine.add(1, "v1", start + timedelta(hours=3))
+
+        result = engine.compute()
+        self.assertEqual(result[1].p50_time, 3 * 3600)
+
+    def test_helpers(self):
+        self.assertIsNone(parse_match_values(""))
+        self.assertEqual(parse_match_values("Won, Lost\nOpen"), {"Won", "Lost", "Open"})
+        self.assertEqual(percentile([1, 2, 3, 4], 50), 2)
+        self.assertEqual(percentile([1, 2, 3, 4], 90), 4)
+        self.assertEqual(percentile([], 90), 0)
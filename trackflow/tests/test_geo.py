@@ -0,0 +1,61 @@
+import os
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+
+import frappe
+from trackflow import geo
+
+RECORD = {
+    "country": {"iso_code": "DE", "names": {"en": "Germany"}},
+    "subdivisions": [{"names": {"en": "Bavaria"}}],
+    "city": {"names": {"en": "Munich"}},
+}
+
+
+class TestGeo(unittest.TestCase):
+    def setUp(self):
+        geo._paths.clear()
+        geo._readers.clear()
+        geo.lookup.cache_clear()
+        frappe.local.site = "test.site"
+
+        fd, self.path = tempfile.mkstemp(suffix=".mmdb")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+        self.reader = MagicMock()
+        self.reader.get.return_value = RECORD
+        settings = frappe._dict(geoip_database_path=self.path)
+        for patcher in (
+            patch.object(geo.frappe, "get_cached_doc", create=True, return_value=settings),
+            patch("maxminddb.open_database", return_value=self.reader),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_location_from_database(self):
+        location = geo.get_geo_location("203.0.113.7")
+
+        self.assertEqual(location, {"country": "Germany", "region": "Bavaria", "city": "Munich"})
+        self.reader.get.assert_called_once_with("203.0.113.0")
+
+    def test_lookups_are_cached_per_network(self):
+        for ip in ("203.0.113.7", "203.0.113.200", "203.0.113.7"):
+            geo.get_geo_location(ip)
+        geo.get_geo_location("198.51.100.1")
+
+        self.assertEqual(self.reader.get.call_count, 2)
+
+    def test_private_and_unknown_addresses(self):
+        self.assertEqual(geo.get_geo_location("10.1.2.3"), {})
+        self.assertEqual(geo.get_geo_location("not-an-ip"), {})
+
+        self.reader.get.return_value = None
+        self.assertEqual(geo.get_geo_location("2001:db8::1").country, None)
+        self.reader.get.assert_called_once_with("2001:db8::")
+
+    def test_no_database_configured(self):
+        geo._paths[frappe.local.site] = (float("inf"), None)
+        self.assertEqual(geo.get_geo_location("203.0.113.7"), {})
+        self.reader.get.assert_not_called()
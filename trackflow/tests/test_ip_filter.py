@@ -0,0 +1,47 @@
+import unittest
+from unittest.mock import patch
+
+import frappe
+from trackflow import ip_filter
+
+
+class TestIPFilter(unittest.TestCase):
+    def setUp(self):
+        ip_filter._matchers.clear()
+        frappe.local.site = "test.site"
+
+    def test_ranges_and_prefixes(self):
+        matcher = ip_filter.compile_ip_ranges(
+            "10.0.0.0/8, 192.168.1.\n203.0.113.5\n198.51.100.10-198.51.100.20\n2001:db8::/32"
+        )
+
+        for ip in ("10.1.2.3", "192.168.1.77", "203.0.113.5", "198.51.100.15", "2001:db8::1", "::ffff:10.0.0.1"):
+            self.assertTrue(matcher.contains(ip), ip)
+        for ip in ("11.0.0.1", "192.168.10.1", "203.0.113.50", "198.51.100.21", "2001:db9::1", "not-an-ip"):
+            self.assertFalse(matcher.contains(ip), ip)
+
+    def test_overlapping_ranges_are_merged(self):
+        matcher = ip_filter.compile_ip_ranges("10.0.0.0/16\n10.0.128.0/17\n10.1.0.0/16")
+
+        self.assertEqual(len(matcher.starts[4]), 1)
+        self.assertTrue(matcher.contains("10.1.255.255"))
+        self.assertFalse(matcher.contains("10.2.0.0"))
+
+    def test_invalid_ranges(self):
+        self.assertRaises(ValueError, ip_filter.parse_ip_range, "10.0.0.0/33")
+        self.assertRaises(ValueError, ip_filter.parse_ip_range, "10.0.0.9-10.0.0.1")
+        self.assertFalse(ip_filter.compile_ip_ranges("nonsense"))
+
+    def test_matcher_is_rebuilt_only_when_settings_change(self):
+        settings = frappe._dict(modified="1", exclude_internal_traffic=1, internal_ip_ranges="10.0.0.0/8")
+        with patch.object(ip_filter.frappe, "get_cached_doc", create=True, return_value=settings), \
+                patch.object(ip_filter, "SETTINGS_TTL", 0):
+            matcher = ip_filter.get_internal_matcher()
+            self.assertIs(ip_filter.get_internal_matcher(), matcher)
+
+            settings.update(modified="2", internal_ip_ranges="172.16.0.0/12")
+            self.assertFalse(ip_filter.is_internal_traffic("10.0.0.1"))
+            self.assertTrue(ip_filter.is_internal_traffic("172.20.0.1"))
+
+            settings.update(modified="3", exclude_internal_traffic=0)
+            self.assertFalse(ip_filter.is_internal_traffic("172.20.0.1"))
@@ -0,0 +1,55 @@
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+import frappe
+from trackflow import journey
+
+
+def touchpoint(name, visitor, ts):
+    return frappe._dict(name=name, visitor=visitor, timestamp=ts, touchpoint_type="link_click")
+
+
+class TestJourneyStore(unittest.TestCase):
+    def test_cursor_round_trip(self):
+        row = touchpoint("abc123", "v1", datetime(2024, 1, 1, 12, 30))
+        ts, name = journey.decode_cursor(journey.encode_cursor(row))
+
+        self.assertEqual(ts, row.timestamp)
+        self.assertEqual(name, "abc123")
+
+    def test_pages_from_several_visitors_are_merged(self):
+        start = datetime(2024, 1, 1)
+        rows = {
+            "v1": [touchpoint(f"a{i}", "v1", start + timedelta(hours=2 * i)) for i in range(3)],
+            "v2": [touchpoint(f"b{i}", "v2", start + timedelta(hours=2 * i + 1)) for i in range(3)],
+        }
+
+        def fake_page(visitor, position, limit, descending):
+            page = sorted(rows[visitor], key=lambda r: r.timestamp, reverse=descending)
+            return page[:limit]
+
+        with patch.object(journey, "_get_visitor_page", side_effect=fake_page):
+            page = journey.get_journey(["v1", "v2"], limit=4)
+
+        self.assertEqual([r.name for r in page["touchpoints"]], ["b2", "a2", "b1", "a1"])
+        self.assertTrue(page["has_more"])
+        self.assertIsNotNone(page["next_cursor"])
+
+    def test_bulk_touchpoints_mark_attribution_visitors_dirty(self):
+        touchpoints = [
+            {"visitor": "v1", "touchpoint_type": "page_view", "timestamp": datetime(2024, 1, 1), "url": "/a"},
+            {"visitor": "v2", "touchpoint_type": "link_click", "timestamp": datetime(2024, 1, 1)},
+            {"visitor": None, "touchpoint_type": "page_view", "timestamp": datetime(2024, 1, 1)},
+        ]
+        with patch.object(journey.frappe, "db") as db, \
+                patch.object(journey.frappe, "generate_hash", create=True, return_value="h"), \
+                patch.object(journey, "now", return_value="2024-01-01 00:00:00"), \
+                patch.object(journey, "mark_visitor_dirty") as mark_dirty:
+            journey.record_touchpoints(touchpoints)
+
+        doctype, fields, rows = db.bulk_insert.call_args[0]
+        self.assertEqual(doctype, "Journey Touchpoint")
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[0][fields.index("url")], "/a")
+        mark_dirty.assert_called_once_with("v2")
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy as np
+
+import frappe
+from trackflow.attribution import AttributionEngine
+from trackflow.markov import TransitionCounter, learn_markov_weights
+
+
+class TestMarkovAttribution(unittest.TestCase):
+    def test_transition_rows_are_probabilities(self):
+        counter = TransitionCounter()
+        counter.add_journey(["google", "email"], True)
+        counter.add_journey(["google"], False)
+
+        matrix = counter.transition_matrix()
+        visited = matrix.sum(axis=1) > 0
+
+        np.testing.assert_allclose(matrix.sum(axis=1)[visited], 1)
+
+    def test_channel_that_never_converts_gets_no_credit(self):
+        weights, journeys = learn_markov_weights([
+            (["google"], True),
+            (["google"], True),
+            (["facebook"], False),
+        ])
+
+        self.assertEqual(journeys, 3)
+        self.assertAlmostEqual(weights["google"], 1)
+        self.assertAlmostEqual(weights["facebook"], 0)
+
+    def test_shared_paths_split_by_removal_effect(self):
+        weights, _journeys = learn_markov_weights([
+            (["google", "email"], True),
+            (["email"], True),
+            (["google"], False),
+        ])
+
+        self.assertAlmostEqual(sum(weights.values()), 1)
+        self.assertGreater(weights["email"], weights["google"])
+
+    def test_kernel_applies_learned_weights_per_deal(self):
+        model = frappe._dict(model_type="markov", learned_weights='{"google": 0.75, "email": 0.25}')
+        touchpoints = [
+            {"channel": "google", "timestamp": "2024-01-01 10:00:00"},
+            {"channel": "google", "timestamp": "2024-01-02 10:00:00"},
+            {"channel": "email", "timestamp": "2024-01-03 10:00:00"},
+        ]
+
+        result = AttributionEngine(model).credit_touchpoints(touchpoints, 100)
+
+        self.assertAlmostEqual(result["google"]["value"], 75)
+        self.assertAlmostEqual(result["email"]["value"], 25)
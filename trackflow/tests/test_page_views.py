@@ -0,0 +1,28 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+from trackflow import tracking
+
+
+class TestPageViewAccumulator(unittest.TestCase):
+    def test_views_are_handed_out_in_batches(self):
+        accumulator = tracking.PageViewAccumulator()
+
+        with patch.object(tracking, "PUSH_SIZE", 3), patch.object(tracking, "PUSH_INTERVAL", 3600):
+            self.assertIsNone(accumulator.add("v1", "/a", "2026-01-01 10:00:00"))
+            self.assertIsNone(accumulator.add("v1", "/a", "2026-01-01 10:05:00"))
+            counts, last_seen = accumulator.add("v2", "/b", "2026-01-01 10:01:00")
+
+        self.assertEqual(counts, {("v1", "/a", "2026-01-01"): 2, ("v2", "/b", "2026-01-01"): 1})
+        self.assertEqual(last_seen, {"v1": "2026-01-01 10:05:00", "v2": "2026-01-01 10:01:00"})
+        self.assertEqual(accumulator.counts, {})
+
+    def test_requests_without_cookie_or_from_api_are_not_counted(self):
+        request = MagicMock(path="/api/method/ping", method="GET")
+        with patch.object(tracking, "track_page_view") as track:
+            tracking.after_request(MagicMock(status_code=200), request)
+
+            request = MagicMock(path="/blog", method="POST")
+            tracking.after_request(MagicMock(status_code=200), request)
+
+        track.assert_not_called()
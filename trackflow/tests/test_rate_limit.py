@@ -0,0 +1,57 @@
+import unittest
+from unittest.mock import MagicMock, patch
+
+import frappe
+from trackflow import rate_limit
+
+
+class TestRateLimit(unittest.TestCase):
+    def setUp(self):
+        rate_limit._policy_snapshots.clear()
+        frappe.local.site = "test.site"
+
+    def test_token_bucket_refills_at_policy_rate(self):
+        limiter = rate_limit.LocalLimiter()
+        policy = rate_limit.make_policy(2, 10)
+
+        with patch.object(rate_limit.time, "monotonic", return_value=100.0):
+            self.assertTrue(limiter.allow("k", policy))
+            self.assertTrue(limiter.allow("k", policy))
+            self.assertFalse(limiter.allow("k", policy))
+        # One request per five seconds comes back
+        with patch.object(rate_limit.time, "monotonic", return_value=105.0):
+            self.assertTrue(limiter.allow("k", policy))
+            self.assertFalse(limiter.allow("k", policy))
+
+    def test_least_recent_buckets_are_dropped(self):
+        limiter = rate_limit.LocalLimiter(size=2)
+        policy = rate_limit.make_policy(1, 60)
+        for key in ("a", "b", "c"):
+            limiter.allow(key, policy)
+
+        self.assertEqual(list(limiter.buckets), ["b", "c"])
+
+    def test_settings_override_defaults(self):
+        settings = frappe._dict(
+            enable_rate_limiting=1,
+            rate_limit_prefilter=0,
+            rate_limit_policies=[frappe._dict(endpoint="pixel", limit=10, period=60, burst=0)],
+        )
+        with patch.object(rate_limit.frappe, "get_cached_doc", create=True, return_value=settings):
+            policies = rate_limit.get_policies()
+
+        self.assertFalse(policies.prefilter)
+        self.assertEqual(policies.endpoints["pixel"], {"limit": 10, "period": 60, "burst": 10})
+        self.assertEqual(policies.endpoints["redirect"].limit, rate_limit.DEFAULT_POLICIES["redirect"][0])
+
+    def test_floods_are_shed_before_redis(self):
+        policies = frappe._dict(enabled=True, prefilter=True, endpoints={"pixel": rate_limit.make_policy(1, 3600)})
+        script = MagicMock(return_value=[1, 0, 0])
+
+        with patch.object(rate_limit, "get_policies", return_value=policies), \
+                patch.object(rate_limit, "get_script", return_value=script), \
+                patch.object(rate_limit.frappe, "cache", create=True):
+            self.assertTrue(rate_limit.check_rate_limit("pixel", "1.2.3.4")[0])
+            self.assertFalse(rate_limit.check_rate_limit("pixel", "1.2.3.4")[0])
+
+        script.assert_called_once()
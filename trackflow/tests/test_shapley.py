@@ -0,0 +1,64 @@
+import unittest
+from unittest.mock import patch
+
+import frappe
+from trackflow import shapley
+from trackflow.attribution import AttributionEngine
+
+
+RATES = {
+    frozenset(["google"]): 0.2,
+    frozenset(["email"]): 0.1,
+    frozenset(["google", "email"]): 0.5,
+}
+
+
+class TestShapleyAttribution(unittest.TestCase):
+    def test_exact_values_split_synergy_evenly(self):
+        values = shapley.shapley_values(["google", "email"], RATES)
+
+        # Each channel keeps its own rate plus half of the 0.2 synergy
+        self.assertAlmostEqual(values["google"], 0.3)
+        self.assertAlmostEqual(values["email"], 0.2)
+        self.assertAlmostEqual(sum(values.values()), RATES[frozenset(["google", "email"])])
+
+    def test_sampled_values_are_within_error_bound(self):
+        channels = [f"c{i}" for i in range(12)]
+        # Additive game: each channel is worth exactly its own rate
+        rates = {}
+        for mask in range(1, 1 << len(channels)):
+            members = frozenset(c for i, c in enumerate(channels) if mask >> i & 1)
+            rates[members] = sum(int(c[1:]) for c in members) / 100
+
+        values = shapley.shapley_values(channels, rates, error=0.05, seed=7)
+
+        for channel in channels:
+            self.assertAlmostEqual(values[channel], int(channel[1:]) / 100, delta=0.05)
+
+    def test_tighter_error_needs_more_samples(self):
+        self.assertGreater(shapley.permutation_samples(12, 0.01), shapley.permutation_samples(12, 0.05))
+
+    def test_coalitions_are_counted_per_channel_set(self):
+        counts = shapley.count_coalitions([
+            (["google", "email", "google"], True),
+            (["email", "google"], False),
+            (["email"], False),
+        ])
+
+        self.assertEqual(counts[frozenset(["google", "email"])], [2, 1])
+        self.assertEqual(counts[frozenset(["email"])], [1, 0])
+
+    def test_kernel_uses_deal_coalition_values(self):
+        touchpoints = [
+            {"channel": "google", "timestamp": "2024-01-01 10:00:00"},
+            {"channel": "email", "timestamp": "2024-01-02 10:00:00"},
+            {"channel": "email", "timestamp": "2024-01-03 10:00:00"},
+        ]
+        values = [{"google": 0.3, "email": 0.2}]
+
+        with patch.object(shapley, "get_coalition_values", return_value=values) as lookup:
+            result = AttributionEngine(frappe._dict(model_type="shapley")).credit_touchpoints(touchpoints, 100)
+
+        self.assertEqual(sorted(lookup.call_args[0][0][0]), ["email", "google"])
+        self.assertAlmostEqual(result["google"]["value"], 60)
+        self.assertAlmostEqual(result["email"]["value"], 40)
@@ -0,0 +1,187 @@
+import json
+import os
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+
+import frappe
+from trackflow.api import tracking
+
+EMBED_SCRIPT = os.path.join(os.path.dirname(tracking.__file__), "..", "public", "js", "trackflow-embed.js")
+
+
+class TestTrackingScript(unittest.TestCase):
+    def settings(self, **values):
+        return frappe._dict(dict(enable_tracking=1, require_gdpr_consent=0, modified="2026-01-01 00:00:00"), **values)
+
+    def test_script_version_follows_settings(self):
+        with patch.object(tracking.frappe, "get_cached_doc", create=True, return_value=self.settings()), \
+                patch.object(tracking.frappe, "get_app_path", create=True, return_value=EMBED_SCRIPT), \
+                patch.object(tracking.frappe.utils, "get_url", create=True, return_value="https://site.test"):
+            first = tracking.build_tracking_script()
+            self.assertEqual(tracking.build_tracking_script(), first)
+            self.assertTrue(first["script"].startswith('window.TrackFlowConfig = {"apiUrl": "https://site.test"'))
+            self.assertIn("track_events", first["script"])
+
+        with patch.object(tracking.frappe, "get_cached_doc", create=True,
+                          return_value=self.settings(enable_tracking=0, modified="2026-02-01 00:00:00")):
+            disabled = tracking.build_tracking_script()
+
+        self.assertNotEqual(disabled["version"], first["version"])
+
+    def test_cached_script_is_revalidated_without_the_database(self):
+        cache = MagicMock()
+        cache.get_value.return_value = {"version": "abc", "script": "/* js */"}
+
+        with patch.object(tracking.frappe, "cache", create=True, return_value=cache), \
+                patch.object(tracking.frappe, "get_cached_doc", create=True) as get_doc, \
+                patch.object(tracking.frappe, "get_request_header", create=True, return_value='"abc"'):
+            response = tracking.get_tracking_script(v="abc")
+
+        get_doc.assert_not_called()
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["ETag"], '"abc"')
+        self.assertIn("immutable", response.headers["Cache-Control"])
+
+        with patch.object(tracking.frappe, "cache", create=True, return_value=cache), \
+                patch.object(tracking.frappe, "get_request_header", create=True, return_value=None):
+            response = tracking.get_tracking_script()
+
+        self.assertEqual(response.get_data(as_text=True), "/* js */")
+        self.assertEqual(response.headers["Cache-Control"], f"public, max-age={tracking.SCRIPT_MAX_AGE}")
+
+
+# Site clock 5h30 ahead of UTC, unlike the server's
+SITE_OFFSET = timedelta(hours=5, minutes=30)
+SITE_NOW = datetime(2026, 3, 1, 12, 0, 0)
+
+
+def epoch_ms(site_time):
+    return int((site_time - SITE_OFFSET).replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+@patch.object(tracking.frappe.utils, "now_datetime", return_value=SITE_NOW)
+@patch.object(tracking.frappe.utils, "convert_utc_to_system_timezone", create=True,
+              side_effect=lambda utc: utc + SITE_OFFSET)
+@patch.object(tracking.frappe.utils, "strip_html_tags", create=True, side_effect=lambda value: value)
+class TestEventBatch(unittest.TestCase):
+    def test_client_time_is_read_in_the_site_timezone(self, *_mocks):
+        ten_minutes_ago = SITE_NOW - timedelta(minutes=10)
+
+        self.assertEqual(tracking.get_event_timestamp(epoch_ms(ten_minutes_ago)), ten_minutes_ago)
+
+    def test_untrusted_client_time_is_replaced(self, *_mocks):
+        for ts in (
+            epoch_ms(SITE_NOW + timedelta(minutes=5)),
+            epoch_ms(SITE_NOW - timedelta(seconds=tracking.MAX_EVENT_AGE + 1)),
+            "yesterday",
+            None,
+        ):
+            self.assertEqual(tracking.get_event_timestamp(ts), SITE_NOW, ts)
+
+    def test_event_rows(self, *_mocks):
+        with patch.object(tracking.frappe, "generate_hash", create=True, return_value="ev1"):
+            row = tracking.build_event_row("VIS-1", {
+                "url": "https://example.com/pricing",
+                "properties": {"category": "cta", "plan": "pro"},
+                "ts": epoch_ms(SITE_NOW - timedelta(minutes=1)),
+            })
+            bad_url = tracking.build_event_row("VIS-1", {"url": "https://example.com/<script>"})
+            bad_properties = tracking.build_event_row("VIS-1", {"event_type": "signup", "properties": "x"})
+
+        self.assertEqual(row.event_type, "pageview")
+        self.assertEqual(row.event_category, "cta")
+        self.assertEqual(row.timestamp, SITE_NOW - timedelta(minutes=1))
+        self.assertEqual(json.loads(row.event_data), {"category": "cta", "plan": "pro"})
+        self.assertIsNone(bad_url)
+        self.assertEqual((bad_properties.event_type, bad_properties.event_data), ("signup", "{}"))
+
+    def test_events_with_a_non_string_type_are_dropped(self, *_mocks):
+        with patch.object(tracking.frappe, "generate_hash", create=True, return_value="ev1"):
+            for event_type in (5, 1.5, True, {"a": 1}):
+                self.assertIsNone(tracking.build_event_row("VIS-1", {"event_type": event_type}), event_type)
+
+    def test_referrer_and_utm_parameters_are_kept(self, *_mocks):
+        with patch.object(tracking.frappe, "generate_hash", create=True, return_value="ev1"):
+            row = tracking.build_event_row("VIS-1", {
+                "url": "https://example.com/?utm_source=google",
+                "referrer": "https://www.google.com/",
+                "utm_source": "google",
+                "utm_medium": "cpc",
+                "utm_campaign": None,
+                "utm_term": 5,
+            })
+            bad_referrer = tracking.build_event_row("VIS-1", {"referrer": "https://example.com/<x>"})
+
+        self.assertEqual(row.attribution, {"source": "google", "medium": "cpc", "referrer": "https://www.google.com/"})
+        self.assertEqual(bad_referrer.attribution, {})
+
+        with patch.object(tracking.frappe, "db", create=True) as db, \
+                patch("trackflow.journey.record_touchpoints"):
+            tracking.insert_visitor_events("VIS-1", [bad_referrer, row])
+
+        query, values = db.sql.call_args[0]
+        self.assertIn("IFNULL(source, 'direct') IN ('', 'direct')", query)
+        self.assertEqual(values, dict(row.attribution, visitor="VIS-1"))
+
+    def test_batch_is_charged_and_inserted_once(self, *_mocks):
+        events = [{"url": "https://example.com/a"}, {"url": "https://example.com/<b>"}, {"event_type": "signup"}]
+        request = MagicMock(data=json.dumps({"visitor_id": "v_1", "events": events}), cookies={})
+
+        with patch.object(tracking.frappe, "request", request, create=True), \
+                patch.object(tracking.frappe, "db", create=True) as db, \
+                patch.object(tracking.frappe, "generate_hash", create=True, return_value="ev"), \
+                patch.object(tracking, "get_client_ip", return_value="203.0.113.9"), \
+                patch.object(tracking, "is_internal_traffic", return_value=False), \
+                patch.object(tracking, "check_rate_limit", return_value=(True, 97)) as rate_limit, \
+                patch.object(tracking, "get_or_create_visitor", return_value="VIS-1"), \
+                patch.object(tracking, "insert_visitor_events") as insert:
+            response = tracking.track_events()
+
+        rate_limit.assert_called_once_with("track_event", "203.0.113.9", cost=3)
+        self.assertEqual(response["accepted"], 2)
+        self.assertEqual([row.event_type for row in insert.call_args[0][1]], ["pageview", "signup"])
+        db.commit.assert_called_once()
+
+    def test_oversized_batch_is_refused(self, *_mocks):
+        events = [{"event_type": "pageview"}] * (tracking.MAX_BATCH_EVENTS + 1)
+        request = MagicMock(data=json.dumps({"events": events}), cookies={})
+
+        with patch.object(tracking.frappe, "request", request, create=True), \
+                patch.object(tracking, "check_rate_limit") as rate_limit, \
+                patch.object(tracking.frappe, "log_error", create=True):
+            response = tracking.track_events()
+
+        self.assertEqual(response["status"], "error")
+        rate_limit.assert_not_called()
+
+
+class TestWebsiteTracking(unittest.TestCase):
+    def test_head_block_points_at_the_current_version(self):
+        from trackflow.trackflow.doctype.trackflow_settings import trackflow_settings
+
+        website = MagicMock(head_html=(
+            '<meta name="x">\n<!-- TrackFlow Analytics -->\n'
+            '<script src="/api/method/trackflow.api.tracking.get_tracking_script" async></script>\n'
+            '<!-- End TrackFlow Analytics -->'
+        ))
+        settings = MagicMock(enable_tracking=1)
+
+        with patch.object(trackflow_settings.frappe, "get_single", create=True, return_value=website), \
+                patch.object(tracking, "get_tracking_script_bundle", return_value={"version": "abc"}):
+            trackflow_settings.TrackFlowSettings.update_website_tracking(settings)
+
+            self.assertEqual(website.head_html, (
+                '<meta name="x">\n<!-- TrackFlow Analytics -->\n'
+                '<script src="/api/method/trackflow.api.tracking.get_tracking_script?v=abc" async></script>\n'
+                '<!-- End TrackFlow Analytics -->'
+            ))
+            website.save.assert_called_once()
+
+            # Unchanged version: nothing to save
+            trackflow_settings.TrackFlowSettings.update_website_tracking(settings)
+            website.save.assert_called_once()
+
+            settings.enable_tracking = 0
+            trackflow_settings.TrackFlowSettings.update_website_tracking(settings)
+            self.assertEqual(website.head_html, '<meta name="x">')
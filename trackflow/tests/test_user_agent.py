@@ -0,0 +1,56 @@
+import unittest
+
+import frappe
+from trackflow import user_agent
+from trackflow.user_agent import parse_user_agent, set_user_agent_fields
+
+CHROME = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+IPHONE = ("Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) AppleWebKit/605.1.15 "
+          "(KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1")
+CUBOT = ("Mozilla/5.0 (Linux; Android 10; Cubot P40) AppleWebKit/537.36 "
+         "(KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36")
+IPAD = ("Mozilla/5.0 (iPad; CPU OS 16_6 like Mac OS X) AppleWebKit/605.1.15 "
+        "(KHTML, like Gecko) Version/16.6 Mobile/15E148 Safari/604.1")
+
+
+class TestUserAgent(unittest.TestCase):
+    def test_browsers_and_devices(self):
+        chrome = parse_user_agent(CHROME)
+        self.assertEqual((chrome.browser, chrome.operating_system, chrome.device_type, chrome.is_bot),
+                         ("Chrome", "Windows", "Desktop", 0))
+        self.assertEqual(parse_user_agent(IPHONE).device_type, "Mobile")
+        self.assertEqual(parse_user_agent(IPAD).device_type, "Tablet")
+
+    def test_bots(self):
+        for ua in (
+            "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+            "python-requests/2.31.0",
+            "curl/8.4.0",
+            "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/120.0 Safari/537.36",
+            "",
+            None,
+        ):
+            ua_info = parse_user_agent(ua)
+            self.assertEqual((ua_info.device_type, ua_info.is_bot), ("Bot", 1), ua)
+
+    def test_device_names_are_not_mistaken_for_bots(self):
+        cubot = parse_user_agent(CUBOT)
+        self.assertEqual((cubot.browser, cubot.device_type, cubot.is_bot), ("Chrome Mobile", "Mobile", 0))
+
+    def test_libraries_missed_by_user_agents(self):
+        for ua in ("Wget/1.21.4", "Go-http-client/1.1", "okhttp/4.12.0", "axios/1.6.0", "node-fetch/1.0",
+                   "libwww-perl/6.72", "Apache-HttpClient/4.5.14 (Java/17)", "Python/3.11 aiohttp/3.9.1"):
+            self.assertEqual(parse_user_agent(ua).is_bot, 1, ua)
+
+    def test_repeated_user_agents_are_cached(self):
+        user_agent.classify.cache_clear()
+        for _i in range(3):
+            parse_user_agent(CHROME)
+        self.assertEqual(user_agent.classify.cache_info().hits, 2)
+
+    def test_fields_are_set_on_doc(self):
+        doc = frappe._dict()
+        set_user_agent_fields(doc, IPHONE)
+        self.assertEqual(doc.device_type, "Mobile")
+        self.assertEqual(doc.is_bot, 0)
+        self.assertTrue(doc.browser)
@@ -126,7 +126,7 @@ def create_custom_fields():
                 "fieldname": "trackflow_attribution_model",
                 "label": "Attribution Model",
                 "fieldtype": "Select",
-                "options": "\nLast Touch\nFirst Touch\nLinear\nTime Decay\nPosition Based",
+                "options": "\nLast Touch\nFirst Touch\nLinear\nTime Decay\nPosition Based\nCustom\nMarkov\nShapley",
                 "insert_after": "trackflow_source",
                 "default": "Last Touch"
             },
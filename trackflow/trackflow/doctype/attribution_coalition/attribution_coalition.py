@@ -0,0 +1,9 @@
+# Copyright (c) 2026, Chinmay Bhat and contributors
+# For license information, please see license.txt
+
+from frappe.model.document import Document
+
+
+class AttributionCoalition(Document):
+    # Rows are rebuilt wholesale by trackflow.shapley.refresh_coalition_table
+    pass
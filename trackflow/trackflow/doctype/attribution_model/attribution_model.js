@@ -0,0 +1,79 @@
+// Copyright (c) 2026, chinmaybhatk and contributors
+// For license information, please see license.txt
+
+frappe.ui.form.on('Attribution Model', {
+    onload: function (frm) {
+        frappe.realtime.off('trackflow_attribution_rebuild');
+        frappe.realtime.on('trackflow_attribution_rebuild', function (progress) {
+            if (progress.model === frm.doc.name) {
+                frm.events.show_rebuild_progress(frm, progress);
+            }
+        });
+    },
+
+    refresh: function (frm) {
+        if (frm.is_new()) {
+            return;
+        }
+
+        frm.add_custom_button(__('Rebuild Attribution'), function () {
+            frm.events.rebuild_attribution(frm);
+        });
+
+        frappe.call({
+            method: 'trackflow.attribution_rebuild.get_rebuild_status',
+            args: { model: frm.doc.name },
+            callback: function (r) {
+                if (r.message && !r.message.finished) {
+                    frm.events.show_rebuild_progress(frm, r.message);
+                }
+            }
+        });
+    },
+
+    rebuild_attribution: function (frm) {
+        const dialog = new frappe.ui.Dialog({
+            title: __('Rebuild Attribution'),
+            fields: [
+                { fieldname: 'from_date', fieldtype: 'Date', label: __('Deals Won From') },
+                { fieldname: 'to_date', fieldtype: 'Date', label: __('Deals Won To') },
+                {
+                    fieldname: 'restart', fieldtype: 'Check', label: __('Restart'),
+                    description: __('Start over instead of resuming an unfinished rebuild')
+                }
+            ],
+            primary_action_label: __('Rebuild'),
+            primary_action: function (values) {
+                dialog.hide();
+                frappe.call({
+                    method: 'trackflow.attribution_rebuild.rebuild_attribution',
+                    args: Object.assign({ model: frm.doc.name }, values),
+                    callback: function (r) {
+                        if (r.message) {
+                            frappe.show_alert({
+                                message: __('Re-crediting {0} deals in the background', [r.message.deals]),
+                                indicator: 'blue'
+                            });
+                            frm.events.show_rebuild_progress(frm, r.message);
+                        }
+                    }
+                });
+            }
+        });
+        dialog.show();
+    },
+
+    show_rebuild_progress: function (frm, progress) {
+        if (progress.finished) {
+            frm.dashboard.hide_progress();
+            frappe.show_alert({ message: __('Attribution rebuild complete'), indicator: 'green' });
+            return;
+        }
+
+        frm.dashboard.show_progress(
+            __('Rebuilding Attribution'),
+            progress.percent,
+            __('{0} of {1} chunks done', [progress.done, progress.chunks])
+        );
+    }
+});
@@ -7,3 +7,11 @@ from frappe.model.document import Document
 
 class ClickEvent(Document):
     pass
+
+
+def on_doctype_update():
+    """Indexes backing the click feeds and per-visitor lookups"""
+    frappe.db.add_index("Click Event", ["tracked_link", "click_timestamp"])
+    frappe.db.add_index("Click Event", ["campaign", "click_timestamp"])
+    frappe.db.add_index("Click Event", ["visitor_id", "click_timestamp"])
+    frappe.db.add_index("Click Event", ["click_timestamp"])
@@ -7,3 +7,10 @@ from frappe.model.document import Document
 
 class Conversion(Document):
     pass
+
+
+def on_doctype_update():
+    """Indexes for per-visitor and per-campaign lookups and time-ordered scans"""
+    frappe.db.add_index("Conversion", ["visitor_id", "conversion_timestamp"])
+    frappe.db.add_index("Conversion", ["campaign", "conversion_timestamp"])
+    frappe.db.add_index("Conversion", ["conversion_timestamp"])
@@ -0,0 +1,14 @@
+# Copyright (c) 2026, Chinmay Bhat and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class EmailCampaignDailyStats(Document):
+    # Rows are maintained by trackflow.email_tracking
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Email Campaign Daily Stats", ["campaign", "stats_date"])
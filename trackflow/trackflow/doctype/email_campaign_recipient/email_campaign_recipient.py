@@ -0,0 +1,14 @@
+# Copyright (c) 2026, Chinmay Bhat and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class EmailCampaignRecipient(Document):
+    # Rows are written by trackflow.email_tracking.record_email_sends
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Email Campaign Recipient", ["campaign", "recipient_index"])
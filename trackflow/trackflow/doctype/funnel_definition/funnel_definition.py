@@ -0,0 +1,25 @@
+# Copyright (c) 2026, Chinmay Bhat and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+
+
+class FunnelDefinition(Document):
+    def validate(self):
+        if not self.stages:
+            frappe.throw(_("A funnel needs at least one stage"))
+
+        if len(self.stages) > 32:
+            frappe.throw(_("A funnel can have at most 32 stages"))
+
+        # Ensure only one default funnel
+        if self.is_default:
+            existing_default = frappe.db.get_value(
+                "Funnel Definition",
+                {"is_default": 1, "name": ["!=", self.name]},
+                "name"
+            )
+            if existing_default:
+                frappe.throw(_("Funnel '{0}' is already set as default. Please uncheck it first.").format(existing_default))
@@ -0,0 +1,18 @@
+# Copyright (c) 2026, Chinmay Bhat and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe import _
+from frappe.model.document import Document
+
+
+class JourneyTouchpoint(Document):
+    def validate(self):
+        # The journey store is append-only; corrections are new touchpoints
+        if not self.is_new():
+            frappe.throw(_("Journey Touchpoints cannot be modified"))
+
+
+def on_doctype_update():
+    frappe.db.add_index("Journey Touchpoint", ["visitor", "timestamp"])
+    frappe.db.add_index("Journey Touchpoint", ["reference_doctype", "reference_name"])
@@ -0,0 +1,14 @@
+# Copyright (c) 2026, Chinmay Bhat and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class PageViewDaily(Document):
+    # Rows are maintained by trackflow.tracking.flush_page_views
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Page View Daily", ["view_date"])
@@ -14,11 +14,12 @@ class TrackedLink(Document):
 
     def after_insert(self):
         """Generate QR code after the link is first created"""
-        self._generate_and_save_qr()
+        if not self.flags.skip_qr:
+            self._generate_and_save_qr()
 
     def on_update(self):
         """Regenerate QR if it's missing (e.g. after manual short_code reset)"""
-        if not self.qr_code:
+        if not self.qr_code and not self.flags.skip_qr:
             self._generate_and_save_qr()
 
     def generate_short_code(self, length=6):
@@ -106,6 +107,11 @@ def regenerate_qr(name):
     return doc.qr_code
 
 
+def on_doctype_update():
+    """Backs the per-campaign link lookup used when preparing email sends"""
+    frappe.db.add_index("Tracked Link", ["campaign", "target_url"])
+
+
 def get_permission_query_conditions(user):
     """Return permission query conditions for Tracked Link doctype"""
     if not user:
@@ -0,0 +1,8 @@
+# Copyright (c) 2026, Chinmay Bhat and contributors
+# For license information, please see license.txt
+
+from frappe.model.document import Document
+
+
+class TrackFlowRateLimitPolicy(Document):
+    pass
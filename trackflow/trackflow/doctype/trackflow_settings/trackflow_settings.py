@@ -23,39 +23,78 @@ class TrackFlowSettings(Document):
                 frappe.throw(
                     "Please specify at least one internal IP range when excluding internal traffic"
                 )
+            self.validate_internal_ip_ranges()
         
         # Validate attribution window
         attribution_window = getattr(self, 'attribution_window_days', 30)
         if attribution_window and attribution_window < 1:
             frappe.throw("Attribution window must be at least 1 day")
+        
+        self.validate_rate_limit_policies()
+        self.validate_geoip_database_path()
+    
+    def validate_internal_ip_ranges(self):
+        from trackflow.ip_filter import parse_ip_range, parse_ip_ranges
+        
+        for token in parse_ip_ranges(self.internal_ip_ranges):
+            try:
+                parse_ip_range(token)
+            except ValueError:
+                frappe.throw(f"Invalid internal IP range: {token}")
+    
+    def validate_rate_limit_policies(self):
+        endpoints = set()
+        for policy in self.get("rate_limit_policies") or []:
+            if policy.endpoint in endpoints:
+                frappe.throw(f"Row {policy.idx}: only one rate limit policy per endpoint")
+            endpoints.add(policy.endpoint)
+            
+            if (policy.limit or 0) < 1 or (policy.period or 0) < 1:
+                frappe.throw(f"Row {policy.idx}: requests and period must be at least 1")
+    
+    def validate_geoip_database_path(self):
+        import os
+        
+        path = (self.get("geoip_database_path") or "").strip()
+        if path and not os.path.isfile(path if os.path.isabs(path) else frappe.get_site_path(path)):
+            frappe.throw(f"GeoIP database not found: {path}")
     
     def on_update(self):
         # Clear cache when settings are updated
         frappe.clear_cache()
         
+        from trackflow.api.tracking import clear_tracking_script_cache
+        clear_tracking_script_cache()
+        
         # Update website tracking script if tracking is enabled/disabled
         self.update_website_tracking()
     
     def update_website_tracking(self):
-        """Update website tracking script based on settings"""
+        """Update website tracking script based on settings
+        
+        The script URL carries the script version, so the block is replaced
+        whenever the version changes.
+        """
+        import re
+        
+        from trackflow.api.tracking import SCRIPT_TAG_END, SCRIPT_TAG_START, get_tracking_script_tag
+        
         try:
             website_settings = frappe.get_single("Website Settings")
             
-            tracking_script = """<!-- TrackFlow Analytics -->
-<script src="/api/method/trackflow.api.tracking.get_tracking_script" async></script>
-<!-- End TrackFlow Analytics -->"""
+            current = website_settings.head_html or ""
+            existing = re.compile(
+                r"\n?" + re.escape(SCRIPT_TAG_START) + r".*?" + re.escape(SCRIPT_TAG_END), re.DOTALL
+            )
+            head_html = existing.sub("", current)
             
             enable_tracking = getattr(self, 'enable_tracking', 0)
             if enable_tracking:
-                # Add tracking script if not present
-                if tracking_script not in (website_settings.head_html or ""):
-                    website_settings.head_html = (website_settings.head_html or "") + "\n" + tracking_script
-                    website_settings.save()
-            else:
-                # Remove tracking script if present
-                if website_settings.head_html and tracking_script in website_settings.head_html:
-                    website_settings.head_html = website_settings.head_html.replace(tracking_script, "")
-                    website_settings.save()
+                head_html = head_html + "\n" + get_tracking_script_tag()
+            
+            if head_html != current:
+                website_settings.head_html = head_html
+                website_settings.save()
         except Exception as e:
             # Log error but don't break the settings save
             frappe.log_error(f"Error updating website tracking: {str(e)}", "TrackFlow Settings")
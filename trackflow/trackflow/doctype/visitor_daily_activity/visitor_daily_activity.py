@@ -0,0 +1,174 @@
+# Copyright (c) 2026, Chinmay Bhat and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+from frappe.utils import add_to_date, get_datetime, getdate, now_datetime
+
+# Global default holding the upper bound of the last summarised window
+WATERMARK_KEY = "trackflow_visitor_activity_watermark"
+
+# Rows are summarised once they were inserted this long ago, so rows still
+# being written when a window closes are not skipped
+SETTLE_MINUTES = 2
+
+# Largest window summarised per step; a backfill commits after every step
+MAX_WINDOW_HOURS = 24
+
+PAGE_VIEW_EVENTS = ("pageview", "page_view")
+
+
+class VisitorDailyActivity(Document):
+    pass
+
+
+def on_doctype_update():
+    frappe.db.add_index("Visitor Daily Activity", ["visitor", "activity_date"])
+
+
+def get_summary_name(visitor, activity_date):
+    """Deterministic row name so a (visitor, day) pair is upserted in place"""
+    return f"{getdate(activity_date)}-{visitor}"
+
+
+def update_activity_summary(max_steps=48):
+    """Fold new Click Event and Visitor Event rows into the daily summary
+
+    Processes the raw tables from the stored watermark up to a couple of
+    minutes ago, one bounded window at a time, so each run only reads the
+    activity recorded since the previous one. Windows are taken over when
+    rows were inserted, not when the activity happened: the tracking
+    script delivers buffered events up to an hour late, and they are
+    still added to the day they happened on.
+    """
+    upper_bound = add_to_date(now_datetime(), minutes=-SETTLE_MINUTES)
+    watermark = frappe.db.get_global(WATERMARK_KEY)
+    start = get_datetime(watermark) if watermark else _get_first_activity()
+
+    if not start:
+        return
+
+    for _step in range(max_steps):
+        if start >= upper_bound:
+            break
+
+        end = min(add_to_date(start, hours=MAX_WINDOW_HOURS), upper_bound)
+        summarise_window(start, end)
+
+        frappe.db.set_global(WATERMARK_KEY, str(end))
+        frappe.db.commit()
+        start = end
+
+
+def _get_first_activity():
+    first = frappe.db.sql(
+        """
+        SELECT MIN(ts) FROM (
+            SELECT MIN(creation) AS ts FROM `tabClick Event`
+            UNION ALL
+            SELECT MIN(creation) AS ts FROM `tabVisitor Event`
+        ) t
+        """
+    )[0][0]
+    return get_datetime(first) if first else None
+
+
+def summarise_window(start, end):
+    """Aggregate raw events inserted in one (start, end] window into summary rows"""
+    rows = {}
+
+    clicks = frappe.db.sql(
+        """
+        SELECT visitor_id, DATE(IFNULL(click_timestamp, creation)), COUNT(*)
+        FROM `tabClick Event`
+        WHERE creation > %s AND creation <= %s
+            AND visitor_id IS NOT NULL AND visitor_id != ''
+        GROUP BY visitor_id, DATE(IFNULL(click_timestamp, creation))
+        """,
+        (start, end),
+    )
+    for visitor, day, count in clicks:
+        rows.setdefault((visitor, day), [0, 0, 0])[0] += count
+
+    events = frappe.db.sql(
+        """
+        SELECT
+            visitor,
+            DATE(IFNULL(timestamp, creation)),
+            SUM(CASE WHEN event_type IN %(page_view_events)s THEN 1 ELSE 0 END),
+            COUNT(*)
+        FROM `tabVisitor Event`
+        WHERE creation > %(start)s AND creation <= %(end)s
+            AND visitor IS NOT NULL AND visitor != ''
+        GROUP BY visitor, DATE(IFNULL(timestamp, creation))
+        """,
+        {"start": start, "end": end, "page_view_events": PAGE_VIEW_EVENTS},
+    )
+    for visitor, day, page_views, count in events:
+        counters = rows.setdefault((visitor, day), [0, 0, 0])
+        counters[1] += int(page_views or 0)
+        counters[2] += count
+
+    if rows:
+        upsert_activity(rows)
+
+
+def upsert_activity(rows):
+    """Add {(visitor, date): [clicks, page_views, events]} onto the summary"""
+    visitors = _get_visitor_details({visitor for visitor, _day in rows})
+    now = now_datetime()
+
+    values = []
+    for (visitor, day), (clicks, page_views, events) in rows.items():
+        details = visitors.get(visitor)
+        if not details:
+            continue
+
+        first_seen = getdate(details.first_seen) if details.first_seen else None
+        values.append((
+            get_summary_name(visitor, day), now, now, "Administrator", "Administrator",
+            day, visitor, 1 if first_seen == getdate(day) else 0,
+            clicks, page_views, events,
+            details.source, details.medium, details.campaign, (details.referrer or "")[:140],
+            details.device_type, details.browser,
+        ))
+
+    for i in range(0, len(values), 500):
+        frappe.db.sql(
+            """
+            INSERT INTO `tabVisitor Daily Activity`
+                (name, creation, modified, owner, modified_by,
+                activity_date, visitor, is_new_visitor,
+                clicks, page_views, events,
+                source, medium, campaign, referrer,
+                device_type, browser)
+            VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE
+                clicks = clicks + VALUES(clicks),
+                page_views = page_views + VALUES(page_views),
+                events = events + VALUES(events),
+                modified = VALUES(modified)
+            """.format(placeholders=", ".join(["(" + ", ".join(["%s"] * 17) + ")"] * len(values[i:i + 500]))),
+            [v for row in values[i:i + 500] for v in row],
+        )
+
+
+def _get_visitor_details(visitor_names):
+    """Visitor attributes for the summary"""
+    from trackflow.user_agent import parse_user_agent
+
+    details = {}
+    visitor_names = list(visitor_names)
+    for i in range(0, len(visitor_names), 1000):
+        for visitor in frappe.get_all(
+            "Visitor",
+            filters={"name": ["in", visitor_names[i:i + 1000]]},
+            fields=["name", "first_seen", "source", "medium", "campaign", "referrer",
+                    "user_agent", "device_type", "browser"],
+        ):
+            # Visitors created before classification at ingest
+            if not visitor.device_type and visitor.user_agent:
+                visitor.update(parse_user_agent(visitor.user_agent))
+            details[visitor.name] = visitor
+
+    return details
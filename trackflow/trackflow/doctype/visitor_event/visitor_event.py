@@ -21,4 +21,10 @@ class VisitorEvent(Document):
         
         # Update session's last activity if session is linked
         if self.session:
-            frappe.db.set_value("Visitor Session", self.session, "last_activity", self.timestamp)
\ No newline at end of file
+            frappe.db.set_value("Visitor Session", self.session, "last_activity", self.timestamp)
+
+
+def on_doctype_update():
+    """Indexes for per-visitor lookups and time-ordered scans"""
+    frappe.db.add_index("Visitor Event", ["visitor", "timestamp"])
+    frappe.db.add_index("Visitor Event", ["timestamp"])
@@ -0,0 +1,88 @@
+import frappe
+from frappe import _
+from trackflow.attribution_comparison import get_attribution_comparison
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    comparison = get_attribution_comparison(
+        from_date=filters.get("from_date"),
+        to_date=filters.get("to_date"),
+        campaign=filters.get("campaign"),
+    )
+    models = comparison["models"]
+
+    columns = get_columns(models)
+    data = get_data(comparison, models)
+    chart = get_chart(comparison, models)
+    summary = get_summary(comparison, models)
+
+    return columns, data, None, chart, summary
+
+def get_columns(models):
+    columns = [
+        {
+            "fieldname": "campaign",
+            "label": _("Campaign"),
+            "fieldtype": "Link",
+            "options": "Link Campaign",
+            "width": 180
+        },
+        {
+            "fieldname": "channel",
+            "label": _("Channel"),
+            "fieldtype": "Data",
+            "width": 140
+        }
+    ]
+
+    for model in models:
+        columns.append({
+            "fieldname": frappe.scrub(model),
+            "label": model,
+            "fieldtype": "Currency",
+            "width": 130
+        })
+
+    return columns
+
+def get_data(comparison, models):
+    data = []
+    for row in comparison["rows"]:
+        record = {"campaign": row["campaign"], "channel": row["channel"]}
+        for model in models:
+            record[frappe.scrub(model)] = row[model]
+        data.append(record)
+    return data
+
+def get_chart(comparison, models):
+    # Credited revenue per channel, one bar per model
+    channels = {}
+    for row in comparison["rows"]:
+        totals = channels.setdefault(row["channel"], [0] * len(models))
+        for i, model in enumerate(models):
+            totals[i] += row[model]
+
+    top = sorted(channels, key=lambda channel: -max(channels[channel]))[:10]
+    return {
+        "data": {
+            "labels": top,
+            "datasets": [
+                {
+                    "name": model,
+                    "values": [round(channels[channel][i], 2) for channel in top]
+                }
+                for i, model in enumerate(models)
+            ]
+        },
+        "type": "bar"
+    }
+
+def get_summary(comparison, models):
+    return [
+        {
+            "value": round(sum(row[model] for row in comparison["rows"]), 2),
+            "label": _("{0} Credited Revenue").format(model),
+            "datatype": "Currency",
+        }
+        for model in models
+    ]
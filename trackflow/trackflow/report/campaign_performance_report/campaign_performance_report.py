@@ -3,7 +3,7 @@
 
 import frappe
 from frappe import _
-from frappe.utils import flt, getdate, add_days
+from frappe.utils import flt
 
 def execute(filters=None):
     columns = get_columns()
@@ -63,7 +63,7 @@ def get_columns():
         },
         {
             "fieldname": "cost",
-            "label": _("Cost"),
+            "label": _("Budget"),
             "fieldtype": "Currency",
             "width": 100
         },
@@ -88,68 +88,98 @@ def get_columns():
     ]
 
 def get_data(filters):
-    conditions = get_conditions(filters)
-    
-    data = frappe.db.sql("""
-        SELECT
-            c.name as campaign,
-            c.source,
-            c.medium,
-            COALESCE(SUM(tl.total_clicks), 0) as total_clicks,
-            COUNT(DISTINCT v.name) as unique_visitors,
-            COUNT(DISTINCT conv.name) as conversions,
-            COALESCE(SUM(conv.conversion_value), 0) as total_value,
-            c.total_cost as cost
-        FROM `tabCampaign` c
-        LEFT JOIN `tabTracked Link` tl ON tl.campaign = c.name
-        LEFT JOIN `tabPage View` pv ON pv.tracking_link = tl.name
-        LEFT JOIN `tabVisitor` v ON pv.visitor = v.name
-        LEFT JOIN `tabConversion` conv ON conv.visitor = v.name
-            AND conv.campaign = c.campaign_name
-        WHERE c.docstatus < 2 {conditions}
-        GROUP BY c.name
-        ORDER BY total_clicks DESC
-    """.format(conditions=conditions), filters, as_dict=True)
-    
-    # Calculate additional metrics
-    for row in data:
-        if row.unique_visitors:
-            row.conversion_rate = flt(row.conversions) / flt(row.unique_visitors) * 100
-        else:
-            row.conversion_rate = 0
-        
-        if row.cost:
-            row.roi = (flt(row.total_value) - flt(row.cost)) / flt(row.cost) * 100
-            if row.total_clicks:
-                row.cpc = flt(row.cost) / flt(row.total_clicks)
-            if row.conversions:
-                row.cpa = flt(row.cost) / flt(row.conversions)
-        else:
-            row.roi = 0
-            row.cpc = 0
-            row.cpa = 0
-    
+    filters = frappe._dict(filters or {})
+    campaigns = get_campaigns(filters)
+    if not campaigns:
+        return []
+
+    names = list(campaigns)
+    clicks = get_click_totals(names, filters)
+    conversions = get_conversion_totals(names, filters)
+
+    data = []
+    for name, campaign in campaigns.items():
+        click_row = clicks.get(name, {})
+        conversion_row = conversions.get(name, {})
+
+        row = frappe._dict(
+            campaign=name,
+            source=campaign.source,
+            medium=campaign.medium,
+            total_clicks=click_row.get("total_clicks", 0),
+            unique_visitors=click_row.get("unique_visitors", 0),
+            conversions=conversion_row.get("conversions", 0),
+            total_value=flt(conversion_row.get("total_value")),
+            cost=flt(campaign.budget),
+        )
+        add_ratios(row)
+        data.append(row)
+
+    data.sort(key=lambda row: row.total_clicks, reverse=True)
     return data
 
-def get_conditions(filters):
-    conditions = ""
-    
+def add_ratios(row):
+    row.conversion_rate = flt(row.conversions) / flt(row.unique_visitors) * 100 if row.unique_visitors else 0
+    row.roi = (row.total_value - row.cost) / row.cost * 100 if row.cost else 0
+    row.cpc = row.cost / row.total_clicks if row.cost and row.total_clicks else 0
+    row.cpa = row.cost / row.conversions if row.cost and row.conversions else 0
+
+def get_campaigns(filters):
+    campaign_filters = {}
+    for fieldname in ("source", "medium", "status"):
+        if filters.get(fieldname):
+            campaign_filters[fieldname] = filters.get(fieldname)
     if filters.get("campaign"):
-        conditions += " AND c.name = %(campaign)s"
-    
-    if filters.get("source"):
-        conditions += " AND c.source = %(source)s"
-    
-    if filters.get("medium"):
-        conditions += " AND c.medium = %(medium)s"
-    
+        campaign_filters["name"] = filters.campaign
+
+    return {
+        c.name: c
+        for c in frappe.get_all(
+            "Link Campaign",
+            filters=campaign_filters,
+            fields=["name", "source", "medium", "budget"],
+        )
+    }
+
+# Each aggregate reads a single table grouped by campaign, so no join can
+# multiply rows; the results are merged per campaign in get_data.
+
+def get_click_totals(campaigns, filters):
+    rows = frappe.db.sql("""
+        SELECT
+            campaign,
+            COUNT(*) as total_clicks,
+            COUNT(DISTINCT visitor_id) as unique_visitors
+        FROM `tabClick Event`
+        WHERE campaign IN %(campaigns)s {conditions}
+        GROUP BY campaign
+    """.format(conditions=get_date_conditions("click_timestamp", filters)),
+        dict(filters, campaigns=campaigns), as_dict=True)
+
+    return {row.campaign: row for row in rows}
+
+def get_conversion_totals(campaigns, filters):
+    rows = frappe.db.sql("""
+        SELECT
+            campaign,
+            COUNT(*) as conversions,
+            IFNULL(SUM(conversion_value), 0) as total_value
+        FROM `tabConversion`
+        WHERE campaign IN %(campaigns)s
+            AND IFNULL(conversion_status, '') != 'Rejected' {conditions}
+        GROUP BY campaign
+    """.format(conditions=get_date_conditions("conversion_timestamp", filters)),
+        dict(filters, campaigns=campaigns), as_dict=True)
+
+    return {row.campaign: row for row in rows}
+
+def get_date_conditions(fieldname, filters):
+    conditions = ""
+
     if filters.get("from_date"):
-        conditions += " AND c.start_date >= %(from_date)s"
-    
+        conditions += f" AND {fieldname} >= %(from_date)s"
+
     if filters.get("to_date"):
-        conditions += " AND c.start_date <= %(to_date)s"
-    
-    if filters.get("status"):
-        conditions += " AND c.status = %(status)s"
-    
-    return conditions
\ No newline at end of file
+        conditions += f" AND {fieldname} < DATE_ADD(%(to_date)s, INTERVAL 1 DAY)"
+
+    return conditions
@@ -0,0 +1,81 @@
+import frappe
+from frappe import _
+from frappe.utils import getdate, nowdate
+from trackflow.cohort import get_cohort_matrix
+
+def execute(filters=None):
+    filters = frappe._dict(filters or {})
+    matrix = get_cohort_matrix(
+        campaign=filters.get("campaign"),
+        from_date=filters.get("from_date"),
+        to_date=filters.get("to_date"),
+        periods=filters.get("periods"),
+    )
+    counts = matrix["converted"] if filters.get("metric") == "Converted" else matrix["returned"]
+
+    columns = get_columns(matrix["periods"])
+    data = get_data(matrix, counts)
+    chart = get_chart(matrix, counts)
+
+    return columns, data, None, chart
+
+def get_columns(periods):
+    columns = [
+        {
+            "fieldname": "cohort",
+            "label": _("Cohort Week"),
+            "fieldtype": "Date",
+            "width": 110
+        },
+        {
+            "fieldname": "visitors",
+            "label": _("Visitors"),
+            "fieldtype": "Int",
+            "width": 90
+        }
+    ]
+
+    for period in range(periods):
+        columns.append({
+            "fieldname": f"week_{period}",
+            "label": _("Week {0}").format(period),
+            "fieldtype": "Percent",
+            "width": 90
+        })
+
+    return columns
+
+def get_data(matrix, counts):
+    data = []
+    for week, size, row in zip(matrix["weeks"], matrix["sizes"], counts):
+        record = {"cohort": week, "visitors": size}
+        for period, count in enumerate(row):
+            record[f"week_{period}"] = round(count / size * 100, 2) if size else 0
+        data.append(record)
+    return data
+
+def get_chart(matrix, counts):
+    # Average retention curve, weighted by cohort size
+    periods = matrix["periods"]
+    totals = [0] * periods
+    population = [0] * periods
+
+    # Cohorts too recent to have reached a week are left out of its average
+    today = getdate(nowdate())
+    for week, size, row in zip(matrix["weeks"], matrix["sizes"], counts):
+        age = (today - getdate(week)).days // 7
+        for period in range(min(age + 1, periods)):
+            totals[period] += row[period]
+            population[period] += size
+
+    return {
+        "data": {
+            "labels": [_("Week {0}").format(p) for p in range(periods)],
+            "datasets": [{
+                "name": _("Retention %"),
+                "values": [round(t / p * 100, 2) if p else 0 for t, p in zip(totals, population)]
+            }]
+        },
+        "type": "line",
+        "colors": ["#36A2EB"]
+    }
@@ -6,6 +6,8 @@ import json
 from datetime import datetime, timedelta
 from urllib.parse import urlparse, parse_qs
 
+from trackflow.user_agent import parse_user_agent
+
 def generate_visitor_id():
     """Generate a unique visitor ID"""
     return str(uuid.uuid4())
@@ -73,49 +75,6 @@ def get_visitor_info_from_request():
     
     return info
 
-def parse_user_agent(user_agent):
-    """Parse user agent string to extract browser, OS, and device info"""
-    info = {
-        'browser': 'Unknown',
-        'browser_version': None,
-        'operating_system': 'Unknown',
-        'device_type': 'Desktop'
-    }
-    
-    ua_lower = user_agent.lower()
-    
-    # Detect browser
-    if 'chrome' in ua_lower and 'edge' not in ua_lower:
-        info['browser'] = 'Chrome'
-    elif 'firefox' in ua_lower:
-        info['browser'] = 'Firefox'
-    elif 'safari' in ua_lower and 'chrome' not in ua_lower:
-        info['browser'] = 'Safari'
-    elif 'edge' in ua_lower:
-        info['browser'] = 'Edge'
-    elif 'opera' in ua_lower or 'opr' in ua_lower:
-        info['browser'] = 'Opera'
-    
-    # Detect OS
-    if 'windows' in ua_lower:
-        info['operating_system'] = 'Windows'
-    elif 'mac' in ua_lower:
-        info['operating_system'] = 'macOS'
-    elif 'linux' in ua_lower:
-        info['operating_system'] = 'Linux'
-    elif 'android' in ua_lower:
-        info['operating_system'] = 'Android'
-    elif 'ios' in ua_lower or 'iphone' in ua_lower or 'ipad' in ua_lower:
-        info['operating_system'] = 'iOS'
-    
-    # Detect device type
-    if 'mobile' in ua_lower or 'android' in ua_lower or 'iphone' in ua_lower:
-        info['device_type'] = 'Mobile'
-    elif 'tablet' in ua_lower or 'ipad' in ua_lower:
-        info['device_type'] = 'Tablet'
-    
-    return info
-
 def create_click_event(tracked_link, visitor_id, request_data=None):
     """Create a click event record for a tracked link"""
     try:
@@ -164,7 +123,7 @@ def create_click_event(tracked_link, visitor_id, request_data=None):
         # Get geo location if possible
         if request_data and request_data.get("ip"):
             try:
-                from trackflow.utils.geo import get_geo_location
+                from trackflow.geo import get_geo_location
                 geo = get_geo_location(request_data.get("ip"))
                 if geo:
                     click_event.country = geo.get("country")
@@ -182,153 +141,6 @@ def create_click_event(tracked_link, visitor_id, request_data=None):
         frappe.log_error(frappe.get_traceback(), f"Create Click Event Error: {str(e)}")
         raise
 
-def calculate_attribution(deal_name, model='last_touch'):
-    """Calculate attribution for a deal based on the selected model"""
-    attributions = []
-    
-    # Get all touchpoints for the deal
-    deal_link = frappe.db.get_value(
-        "Deal Link Association",
-        {"deal": deal_name},
-        ["visitor_id", "lead"],
-        as_dict=1
-    )
-    
-    if not deal_link or not deal_link.visitor_id:
-        return attributions
-    
-    # Get all sessions for the visitor
-    sessions = frappe.get_all(
-        "Visitor Session",
-        filters={"visitor_id": deal_link.visitor_id},
-        fields=["name", "visit_date", "utm_source", "utm_medium", "utm_campaign", "campaign"],
-        order_by="visit_date"
-    )
-    
-    if not sessions:
-        return attributions
-    
-    # Get deal value
-    deal_value = frappe.db.get_value("Opportunity", deal_name, "opportunity_amount") or 0
-    
-    if model == 'last_touch':
-        # Give 100% credit to the last touchpoint
-        last_session = sessions[-1]
-        if last_session.campaign:
-            attributions.append({
-                "campaign": last_session.campaign,
-                "attribution_percentage": 100,
-                "attribution_value": deal_value
-            })
-    
-    elif model == 'first_touch':
-        # Give 100% credit to the first touchpoint
-        first_session = sessions[0]
-        if first_session.campaign:
-            attributions.append({
-                "campaign": first_session.campaign,
-                "attribution_percentage": 100,
-                "attribution_value": deal_value
-            })
-    
-    elif model == 'linear':
-        # Distribute credit equally among all touchpoints
-        campaigns = [s.campaign for s in sessions if s.campaign]
-        unique_campaigns = list(set(campaigns))
-        
-        if unique_campaigns:
-            percentage = 100 / len(unique_campaigns)
-            value = deal_value / len(unique_campaigns)
-            
-            for campaign in unique_campaigns:
-                attributions.append({
-                    "campaign": campaign,
-                    "attribution_percentage": percentage,
-                    "attribution_value": value
-                })
-    
-    elif model == 'time_decay':
-        # Give more credit to recent touchpoints
-        campaigns = [(s.campaign, s.visit_date) for s in sessions if s.campaign]
-        
-        if campaigns:
-            # Calculate days from first touch
-            first_date = campaigns[0][1]
-            weights = []
-            total_weight = 0
-            
-            for campaign, visit_date in campaigns:
-                days_diff = (visit_date - first_date).days
-                weight = 2 ** (days_diff / 7)  # Double weight every week
-                weights.append((campaign, weight))
-                total_weight += weight
-            
-            # Group by campaign and sum weights
-            campaign_weights = {}
-            for campaign, weight in weights:
-                if campaign not in campaign_weights:
-                    campaign_weights[campaign] = 0
-                campaign_weights[campaign] += weight
-            
-            # Calculate attribution
-            for campaign, weight in campaign_weights.items():
-                percentage = (weight / total_weight) * 100
-                value = (weight / total_weight) * deal_value
-                
-                attributions.append({
-                    "campaign": campaign,
-                    "attribution_percentage": round(percentage, 2),
-                    "attribution_value": round(value, 2)
-                })
-    
-    elif model == 'position_based':
-        # 40% to first touch, 40% to last touch, 20% distributed among middle
-        campaigns = [s.campaign for s in sessions if s.campaign]
-        
-        if len(campaigns) == 1:
-            attributions.append({
-                "campaign": campaigns[0],
-                "attribution_percentage": 100,
-                "attribution_value": deal_value
-            })
-        elif len(campaigns) == 2:
-            # 50% each
-            for idx, campaign in enumerate(campaigns):
-                attributions.append({
-                    "campaign": campaign,
-                    "attribution_percentage": 50,
-                    "attribution_value": deal_value / 2
-                })
-        else:
-            # First touch: 40%
-            attributions.append({
-                "campaign": campaigns[0],
-                "attribution_percentage": 40,
-                "attribution_value": deal_value * 0.4
-            })
-            
-            # Middle touches: 20% distributed
-            middle_campaigns = campaigns[1:-1]
-            if middle_campaigns:
-                middle_percentage = 20 / len(middle_campaigns)
-                middle_value = (deal_value * 0.2) / len(middle_campaigns)
-                
-                for campaign in middle_campaigns:
-                    attributions.append({
-                        "campaign": campaign,
-                        "attribution_percentage": middle_percentage,
-                        "attribution_value": middle_value
-                    })
-            
-            # Last touch: 40%
-            attributions.append({
-                "campaign": campaigns[-1],
-                "attribution_percentage": 40,
-                "attribution_value": deal_value * 0.4
-            })
-    
-    return attributions
-
 def get_campaign_roi(campaign_name):
     """Calculate ROI for a campaign"""
     campaign = frappe.get_doc("Link Campaign", campaign_name)
@@ -420,9 +232,9 @@ def jinja_filters():
 
 def get_tracking_script_tag():
     """Get TrackFlow tracking script tag for templates"""
-    return """<script src="{0}" async></script>""".format(
-        frappe.utils.get_url("/api/method/trackflow.api.tracking.get_tracking_script")
-    )
+    from trackflow.api.tracking import get_tracking_script_tag
+
+    return get_tracking_script_tag()
 
 def get_campaign_tracking_url(url, campaign_name):
     """Get URL with campaign tracking parameters"""
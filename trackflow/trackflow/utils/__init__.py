@@ -18,6 +18,9 @@ import frappe
 import hashlib
 from datetime import datetime
 
+from trackflow.geo import set_geo_fields
+from trackflow.user_agent import parse_user_agent, set_user_agent_fields
+
 
 def generate_visitor_id():
     """Generate unique visitor ID"""
@@ -43,6 +46,8 @@ def upsert_visitor(visitor_id, request_data=None, tracked_link=None):
         visitor.ip_address = request_data.get("ip")
         visitor.user_agent = request_data.get("user_agent")
         visitor.referrer = request_data.get("referrer")
+        set_user_agent_fields(visitor, visitor.user_agent)
+        set_geo_fields(visitor, visitor.ip_address)
     if tracked_link:
         if tracked_link.get("source"):
             visitor.source = tracked_link["source"]
@@ -78,6 +83,8 @@ def create_click_event(tracked_link, visitor_id, request_data=None):
             click_event.ip_address = request_data.get("ip")
             click_event.user_agent = request_data.get("user_agent")
             click_event.referrer = request_data.get("referrer")
+            set_user_agent_fields(click_event, click_event.user_agent)
+            set_geo_fields(click_event, click_event.ip_address)
 
         if tracked_link.campaign:
             click_event.campaign = tracked_link.campaign
@@ -116,6 +123,8 @@ def get_visitor_from_request(request=None):
         visitor_doc.last_seen = frappe.utils.now()
         visitor_doc.ip_address = get_client_ip()
         visitor_doc.user_agent = request.headers.get("User-Agent", "")
+        set_user_agent_fields(visitor_doc, visitor_doc.user_agent)
+        set_geo_fields(visitor_doc, visitor_doc.ip_address)
         visitor_doc.insert(ignore_permissions=True)
         visitor_name = visitor_doc.name
 
@@ -138,42 +147,3 @@ def set_visitor_cookie(response, visitor_id):
         httponly=False,
         samesite="Lax",
     )
-
-
-def parse_user_agent(user_agent):
-    """Parse user agent string to extract browser, OS, device info"""
-    browser = "Unknown"
-    os_name = "Unknown"
-    device = "Desktop"
-
-    if user_agent:
-        ua = user_agent.lower()
-
-        if "chrome" in ua and "edg" not in ua:
-            browser = "Chrome"
-        elif "firefox" in ua:
-            browser = "Firefox"
-        elif "edg" in ua:
-            browser = "Edge"
-        elif "safari" in ua:
-            browser = "Safari"
-        elif "opera" in ua or "opr" in ua:
-            browser = "Opera"
-
-        if "windows" in ua:
-            os_name = "Windows"
-        elif "mac" in ua:
-            os_name = "macOS"
-        elif "android" in ua:
-            os_name = "Android"
-        elif "iphone" in ua or "ipad" in ua:
-            os_name = "iOS"
-        elif "linux" in ua:
-            os_name = "Linux"
-
-        if "mobile" in ua or "android" in ua and "tablet" not in ua:
-            device = "Mobile"
-        elif "tablet" in ua or "ipad" in ua:
-            device = "Tablet"
-
-    return {"browser": browser, "os": os_name, "device": device}
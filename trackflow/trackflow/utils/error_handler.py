@@ -180,28 +180,21 @@ def validate_url(url):
     except Exception as e:
         raise ValidationError(_("Invalid URL: {0}").format(str(e)))
 
-def rate_limit_check(key, limit=100, window=3600):
+def rate_limit_check(key, limit=100, window=3600, cost=1):
     """Check rate limit for a given key
     
     Args:
         key: Unique key for rate limiting (e.g., IP address, user)
         limit: Maximum number of requests allowed
         window: Time window in seconds
+        cost: Requests this call counts as (e.g., events in a batch)
         
     Returns:
         Tuple of (allowed, remaining_requests)
     """
-    cache_key = f"trackflow_rate_limit:{key}"
-    current_count = frappe.cache().get(cache_key) or 0
+    from trackflow.rate_limit import gcra, make_policy
     
-    if current_count >= limit:
-        return False, 0
-    
-    # Increment counter
-    new_count = current_count + 1
-    frappe.cache().setex(cache_key, window, new_count)
-    
-    return True, limit - new_count
+    return gcra(f"trackflow_rate_limit:{key}", make_policy(limit, window), cost)
 
 def sanitize_input(data, allowed_fields=None, max_length=None):
     """Sanitize input data
@@ -272,19 +265,9 @@ def is_internal_ip(ip_address):
     if not ip_address:
         return False
     
-    # Check common private IP ranges
-    private_ranges = [
-        ("10.0.0.0", "10.255.255.255"),
-        ("172.16.0.0", "172.31.255.255"),
-        ("192.168.0.0", "192.168.255.255"),
-        ("127.0.0.0", "127.255.255.255")
-    ]
-    
-    for start, end in private_ranges:
-        if is_ip_in_range(ip_address, start, end):
-            return True
+    from trackflow.ip_filter import PRIVATE_NETWORKS
     
-    return False
+    return PRIVATE_NETWORKS.contains(ip_address)
 
 def is_ip_in_range(ip, start, end):
     """Check if IP is in range
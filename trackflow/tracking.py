@@ -1,30 +1,91 @@
 """
 Tracking module for after_request hook
+
+Guest page views are counted in process memory, keyed by site, visitor,
+path and day, and pushed to Redis in one pipeline every few seconds. A
+scheduled job drains Redis into Visitor and Page View Daily. A request
+never reads or writes the database for tracking; the settings it needs are
+a process-local snapshot refreshed every minute.
+
+Counts not yet pushed are lost if the worker exits, and a process that
+stops receiving traffic holds its last few seconds of counts until its
+next request.
 """
 
+import hashlib
+import json
+import threading
+import time
+
 import frappe
 from frappe import _
 
+SKIPPED_PATHS = ("/api/", "/files/", "/private/files/", "/assets/")
+MAX_PATH_LENGTH = 1000
+
+# Process-local counts are pushed to Redis this often, or at this many views
+PUSH_INTERVAL = 5
+PUSH_SIZE = 200
+
+SETTINGS_TTL = 60
+
+PAGE_VIEWS_KEY = "trackflow:page_views"
+LAST_SEEN_KEY = "trackflow:page_views:last_seen"
+FLUSHING_SUFFIX = ":flushing"
+
+INSERT_CHUNK_SIZE = 500
+
+# Per-site state of this process
+_accumulators = {}
+_settings_snapshots = {}
+
+
+class PageViewAccumulator:
+    """Page view counts of one site in this process, handed out in batches"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
 
-def after_request(response):
+    def reset(self):
+        self.counts = {}
+        self.last_seen = {}
+        self.views = 0
+        self.started = time.monotonic()
+
+    def add(self, visitor, path, timestamp):
+        """Count one view; returns (counts, last_seen) when a push is due"""
+        key = (visitor, path, timestamp[:10])
+        with self.lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+            self.last_seen[visitor] = max(self.last_seen.get(visitor, timestamp), timestamp)
+            self.views += 1
+
+            if self.views < PUSH_SIZE and time.monotonic() - self.started < PUSH_INTERVAL:
+                return None
+
+            batch = self.counts, self.last_seen
+            self.reset()
+            return batch
+
+
+def after_request(response, request=None):
     """Process tracking after request"""
     try:
-        if frappe.request and frappe.request.path:
-            if frappe.request.path.startswith(("/api/", "/files/", "/private/files/", "/assets/")):
-                return response
+        request = request or frappe.request
+        if not request or not request.path or request.path.startswith(SKIPPED_PATHS):
+            return response
+
+        if request.method != "GET" or getattr(response, "status_code", 200) != 200:
+            return response
 
         if frappe.session and frappe.session.user != "Guest":
             return response
 
-        try:
-            if frappe.db.exists("TrackFlow Settings", "TrackFlow Settings"):
-                settings = frappe.get_cached_doc("TrackFlow Settings", "TrackFlow Settings")
-                if not settings.enable_tracking:
-                    return response
-        except Exception:
+        if not is_tracking_enabled():
             return response
 
-        track_page_view()
+        track_page_view(request)
 
     except Exception as e:
         if frappe.local.conf.get("developer_mode"):
@@ -33,23 +94,139 @@ def after_request(response):
     return response
 
 
-def track_page_view():
-    """Track a page view"""
-    from trackflow.trackflow.utils import get_visitor_from_request
+def is_tracking_enabled():
+    """enable_tracking from a process-local snapshot of TrackFlow Settings"""
+    site = frappe.local.site
+    snapshot = _settings_snapshots.get(site)
+    if snapshot and snapshot[0] > time.monotonic():
+        return snapshot[1]
 
-    result = get_visitor_from_request()
-    if not result:
-        return
+    try:
+        enabled = bool(frappe.get_cached_doc("TrackFlow Settings").enable_tracking)
+    except Exception:
+        enabled = False
+
+    _settings_snapshots[site] = (time.monotonic() + SETTINGS_TTL, enabled)
+    return enabled
 
-    visitor_id, visitor_name = result
-    if not visitor_name:
+
+def track_page_view(request=None):
+    """Count a page view for the visitor in the tracking cookie"""
+    request = request or frappe.request
+    visitor = request.cookies.get("trackflow_visitor") if request else None
+    if not visitor:
         return
 
-    frappe.db.set_value("Visitor", visitor_name, {
-        "last_seen": frappe.utils.now(),
-        "page_views": frappe.db.get_value("Visitor", visitor_name, "page_views", 0) + 1,
-    }, update_modified=False)
-    # Per-session bucketing is on the roadmap (see SCHEMA_AUDIT P0 #3).
+    accumulator = _accumulators.get(frappe.local.site)
+    if accumulator is None:
+        accumulator = _accumulators.setdefault(frappe.local.site, PageViewAccumulator())
+
+    batch = accumulator.add(visitor[:140], request.path[:MAX_PATH_LENGTH], frappe.utils.now())
+    if batch:
+        push_page_views(*batch)
+
+
+def push_page_views(counts, last_seen):
+    """Add a batch of process-local counts onto the Redis buffer"""
+    cache = frappe.cache()
+    views_key, seen_key = cache.make_key(PAGE_VIEWS_KEY), cache.make_key(LAST_SEEN_KEY)
+
+    pipe = cache.pipeline()
+    for (visitor, path, day), count in counts.items():
+        pipe.hincrby(views_key, json.dumps([visitor, path, day]), count)
+    for visitor, timestamp in last_seen.items():
+        pipe.hset(seen_key, visitor, timestamp)
+    pipe.execute()
+
+
+def flush_page_views():
+    """Move buffered page views into Visitor and Page View Daily
+
+    Each Redis hash is renamed aside before it is read, so views pushed
+    during the flush go to a fresh hash. A hash left aside by a failed
+    flush is flushed first on the next run.
+    """
+    cache = frappe.cache()
+    views_key = take_hash(cache, cache.make_key(PAGE_VIEWS_KEY))
+    seen_key = take_hash(cache, cache.make_key(LAST_SEEN_KEY))
+
+    pipe = cache.pipeline()
+    pipe.hgetall(views_key)
+    pipe.hgetall(seen_key)
+    views, last_seen = pipe.execute()
+
+    pages, visitors = {}, {}
+    for field, count in views.items():
+        visitor, path, day = json.loads(frappe.safe_decode(field))
+        pages[day, path] = pages.get((day, path), 0) + int(count)
+        visitors[visitor] = visitors.get(visitor, 0) + int(count)
+
+    if pages:
+        upsert_page_view_daily(pages)
+    if visitors:
+        update_visitor_page_views(
+            visitors, {frappe.safe_decode(k): frappe.safe_decode(v) for k, v in last_seen.items()}
+        )
+    frappe.db.commit()
+
+    cache.pipeline().delete(views_key, seen_key).execute()
+    return sum(visitors.values())
+
+
+def take_hash(cache, key):
+    """Name of the hash to flush for ``key``, moving the live hash aside"""
+    flushing = key + FLUSHING_SUFFIX
+    pipe = cache.pipeline()
+    pipe.exists(flushing)
+    pipe.exists(key)
+    has_flushing, has_live = pipe.execute()
+
+    if has_live and not has_flushing:
+        cache.pipeline().rename(key, flushing).execute()
+    return flushing
+
+
+def get_page_view_name(day, path):
+    """Deterministic row name so a (day, path) pair is upserted in place"""
+    return hashlib.md5(f"{day}\n{path}".encode()).hexdigest()
+
+
+def upsert_page_view_daily(pages):
+    """Add {(date, path): views} onto Page View Daily"""
+    now = frappe.utils.now()
+    values = [
+        (get_page_view_name(day, path), now, now, "Administrator", "Administrator", day, path, count)
+        for (day, path), count in pages.items()
+    ]
+    for i in range(0, len(values), INSERT_CHUNK_SIZE):
+        chunk = values[i:i + INSERT_CHUNK_SIZE]
+        frappe.db.sql(
+            """
+            INSERT INTO `tabPage View Daily`
+                (name, creation, modified, owner, modified_by, view_date, path, page_views)
+            VALUES {placeholders}
+            ON DUPLICATE KEY UPDATE
+                page_views = page_views + VALUES(page_views),
+                modified = VALUES(modified)
+            """.format(placeholders=", ".join(["(" + ", ".join(["%s"] * 8) + ")"] * len(chunk))),
+            [v for row in chunk for v in row],
+        )
+
+
+def update_visitor_page_views(visitors, last_seen):
+    """Add page views onto Visitor and move last_seen forward"""
+    now = frappe.utils.now()
+    for visitor, count in visitors.items():
+        seen = last_seen.get(visitor, now)
+        frappe.db.sql(
+            """
+            UPDATE `tabVisitor`
+            SET page_views = IFNULL(page_views, 0) + %s,
+                last_seen = GREATEST(IFNULL(last_seen, %s), %s)
+            WHERE name = %s
+            """,
+            (count, seen, seen, visitor),
+        )
 
 
 def track_event(visitor_id, event_type, event_data=None):
@@ -10,6 +10,8 @@ from datetime import datetime, timedelta
 import re
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse
 
+from trackflow.user_agent import set_user_agent_fields
+
 
 def get_visitor_from_request():
     """Get or create visitor from current request"""
@@ -31,24 +33,14 @@ def get_visitor_from_request():
         visitor.ip_address = frappe.local.request_ip
         
         # Parse user agent for device info
-        user_agent = frappe.request.headers.get('User-Agent', '')
-        visitor.user_agent = user_agent
-        browser, os = parse_user_agent(user_agent)
-        visitor.browser = browser
-        visitor.operating_system = os
-        
-        # Determine device type
-        if 'Mobile' in user_agent or 'Android' in user_agent or 'iPhone' in user_agent:
-            visitor.device_type = 'Mobile'
-        elif 'iPad' in user_agent or 'Tablet' in user_agent:
-            visitor.device_type = 'Tablet'
-        else:
-            visitor.device_type = 'Desktop'
+        visitor.user_agent = frappe.request.headers.get('User-Agent', '')
+        set_user_agent_fields(visitor, visitor.user_agent)
         
         # Get geo information if available
         if frappe.local.request_ip:
             geo_info = get_geo_location(frappe.local.request_ip)
             visitor.country = geo_info.get('country')
+            visitor.region = geo_info.get('region')
             visitor.city = geo_info.get('city')
         
         # Get UTM parameters
@@ -216,81 +208,11 @@ def get_tracking_script():
     """
 
 
-def parse_user_agent(user_agent):
-    """Parse user agent string to get browser and OS info"""
-    browser = "Unknown"
-    os = "Unknown"
-    
-    # Simple browser detection
-    if "Chrome" in user_agent and "Chromium" not in user_agent:
-        browser = "Chrome"
-    elif "Firefox" in user_agent:
-        browser = "Firefox"
-    elif "Safari" in user_agent and "Chrome" not in user_agent:
-        browser = "Safari"
-    elif "Edge" in user_agent or "Edg" in user_agent:
-        browser = "Edge"
-    elif "Opera" in user_agent or "OPR" in user_agent:
-        browser = "Opera"
-    elif "MSIE" in user_agent or "Trident" in user_agent:
-        browser = "Internet Explorer"
-    elif "Chromium" in user_agent:
-        browser = "Chromium"
-    elif "bot" in user_agent.lower() or "spider" in user_agent.lower() or "crawl" in user_agent.lower():
-        browser = "Bot"
-        
-    # Simple OS detection
-    if "Windows" in user_agent:
-        os = "Windows"
-    elif "Mac" in user_agent:
-        os = "macOS"
-    elif "Linux" in user_agent and "Android" not in user_agent:
-        os = "Linux"
-    elif "Android" in user_agent:
-        os = "Android"
-    elif "iOS" in user_agent or "iPhone" in user_agent or "iPad" in user_agent:
-        os = "iOS"
-        
-    return browser, os
-
-
 def get_geo_location(ip_address):
     """Get geo location from IP address"""
-    try:
-        settings = frappe.get_cached_doc("TrackFlow Settings", "TrackFlow Settings")
-        
-        if settings.geo_ip_service == "None":
-            return {
-                "country": "Unknown",
-                "region": "Unknown",
-                "city": "Unknown"
-            }
-            
-        # Placeholder for IP geolocation service integration
-        # In a real implementation, you'd call an API service here
-        
-        # For testing/placeholder, use a basic mapping
-        if ip_address.startswith('127.') or ip_address.startswith('192.168.') or ip_address.startswith('10.'):
-            return {
-                "country": "Internal",
-                "region": "Local",
-                "city": "Office"
-            }
-            
-        # Default for now - in production, integrate with a real geo service
-        return {
-            "country": "Unknown",
-            "region": "Unknown",
-            "city": "Unknown"
-        }
-        
-    except Exception as e:
-        frappe.log_error(f"Error in geo location lookup: {str(e)}", "TrackFlow Geo Lookup")
-        return {
-            "country": "Unknown",
-            "region": "Unknown",
-            "city": "Unknown"
-        }
+    from trackflow.geo import get_geo_location
+
+    return get_geo_location(ip_address)
 
 
 def calculate_time_on_page(start_time, end_time):
@@ -325,41 +247,16 @@ def get_bounce_rate(visitor):
 
 def is_internal_traffic(ip_address):
     """Check if IP address is internal traffic"""
-    try:
-        if not ip_address:
-            return False
-            
-        # Try to get settings
-        if not frappe.db.exists("TrackFlow Settings", "TrackFlow Settings"):
-            return False
-            
-        settings = frappe.get_cached_doc("TrackFlow Settings", "TrackFlow Settings")
-
-        if not settings.exclude_internal_traffic:
-            return False
-
-        # Internal IP ranges are stored as a newline/comma-separated text field
-        # on TrackFlow Settings (one CIDR or prefix per line).
-        raw = (settings.get("internal_ip_ranges") or "").strip()
-        if not raw:
-            return False
+    from trackflow.ip_filter import is_internal_traffic
 
-        for token in raw.replace(",", "\n").splitlines():
-            ip_range = token.strip()
-            if ip_range and is_ip_in_range(ip_address, ip_range):
-                return True
-
-        return False
-    except Exception:
-        # If any error, don't exclude the traffic
-        return False
+    return is_internal_traffic(ip_address)
 
 
 def is_ip_in_range(ip, ip_range):
-    """Check if IP is in given range"""
-    # Simple implementation - just check prefix match
-    # For production, use ipaddress module for proper CIDR handling
-    return ip.startswith(ip_range.split('/')[0].strip())
+    """Check if IP is in given range (CIDR, start-end or IPv4 prefix)"""
+    from trackflow.ip_filter import compile_ip_ranges
+
+    return compile_ip_ranges(ip_range).lookup(ip)
 
 
 def sanitize_url(url):
@@ -531,19 +428,7 @@ def create_click_event(tracked_link, visitor_id=None, request_data=None):
         click_event.referrer = request_data.get("referrer", "")
         
         # Parse user agent
-        browser, os = parse_user_agent(request_data.get("user_agent", ""))
-        click_event.browser = browser
-        click_event.os = os
-        
-        # Set device type
-        if browser == "Bot":
-            click_event.device_type = "Bot"
-        elif "Mobile" in request_data.get("user_agent", "") or "Android" in request_data.get("user_agent", ""):
-            click_event.device_type = "Mobile"
-        elif "iPad" in request_data.get("user_agent", "") or "Tablet" in request_data.get("user_agent", ""):
-            click_event.device_type = "Tablet"
-        else:
-            click_event.device_type = "Desktop"
+        set_user_agent_fields(click_event, click_event.user_agent)
             
         # Geo location
         if request_data.get("ip"):
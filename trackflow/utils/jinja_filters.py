@@ -104,14 +104,9 @@ def device_type(user_agent):
     if not user_agent:
         return "Unknown"
         
-    ua_lower = user_agent.lower()
+    from trackflow.user_agent import parse_user_agent
     
-    if "mobile" in ua_lower or "android" in ua_lower or "iphone" in ua_lower:
-        return "Mobile"
-    elif "tablet" in ua_lower or "ipad" in ua_lower:
-        return "Tablet"
-    else:
-        return "Desktop"
+    return parse_user_agent(user_agent).device_type
 
 
 def clean_referrer(referrer_url):
@@ -150,34 +150,6 @@ def format_currency(amount, currency="USD"):
 
 def get_tracking_script_tag():
     """Get complete tracking script tag for website"""
-    return """<!-- TrackFlow Analytics -->
-<script>
-(function() {
-    var tf = window.trackflow = window.trackflow || [];
-    tf.push = function() {
-        tf.queue = tf.queue || [];
-        tf.queue.push(arguments);
-    };
-    tf.visitor = getCookie('trackflow_visitor');
-    
-    function getCookie(name) {
-        var value = "; " + document.cookie;
-        var parts = value.split("; " + name + "=");
-        if (parts.length == 2) return parts.pop().split(";").shift();
-    }
-    
-    // Track page view
-    tf.push('track', 'pageview', {
-        url: window.location.href,
-        title: document.title,
-        referrer: document.referrer
-    });
-    
-    // Load tracking script
-    var script = document.createElement('script');
-    script.async = true;
-    script.src = '/assets/trackflow/js/trackflow-web.js';
-    document.head.appendChild(script);
-})();
-</script>
-<!-- End TrackFlow Analytics -->"""
+    from trackflow.api.tracking import get_tracking_script_tag
+
+    return get_tracking_script_tag()
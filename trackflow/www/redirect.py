@@ -1,5 +1,7 @@
 import frappe
 from frappe import _
+from trackflow.ip_filter import is_internal_traffic
+from trackflow.rate_limit import check_rate_limit
 from trackflow.trackflow.utils import create_click_event, generate_visitor_id
 
 no_cache = 1
@@ -37,6 +39,7 @@ def get_context(context):
 
     try:
         visitor_id = frappe.request.cookies.get("trackflow_visitor")
+        client_ip = frappe.local.request_ip or frappe.request.environ.get("REMOTE_ADDR")
 
         if not visitor_id:
             visitor_id = generate_visitor_id()
@@ -46,43 +49,9 @@ def get_context(context):
                 max_age=365 * 24 * 60 * 60,
             )
 
-        request_data = {
-            "ip": frappe.local.request_ip or frappe.request.environ.get("REMOTE_ADDR"),
-            "user_agent": frappe.request.headers.get("User-Agent", ""),
-            "referrer": frappe.request.headers.get("Referer", ""),
-        }
-
-        click_event = create_click_event(tracked_link_doc, visitor_id, request_data)
-
-        frappe.db.sql(
-            """
-            UPDATE `tabTracked Link`
-            SET
-                click_count = IFNULL(click_count, 0) + 1,
-                last_click = %s
-            WHERE name = %s
-        """,
-            (frappe.utils.now(), tracked_link_doc.name),
-        )
-
-        if click_event and not frappe.db.exists(
-            "Click Event",
-            {
-                "tracked_link": tracked_link_doc.name,
-                "visitor_id": visitor_id,
-                "name": ["!=", click_event.name],
-            },
-        ):
-            frappe.db.sql(
-                """
-                UPDATE `tabTracked Link`
-                SET unique_visitor_count = IFNULL(unique_visitor_count, 0) + 1
-                WHERE name = %s
-            """,
-                tracked_link_doc.name,
-            )
-
-        frappe.db.commit()
+        # Internal or over the limit: still redirect, but do not record the click
+        if not is_internal_traffic(client_ip) and check_rate_limit("redirect", client_ip)[0]:
+            record_click(tracked_link_doc, visitor_id, client_ip)
 
     except Exception:
         frappe.log_error(frappe.get_traceback(), "Click Event Tracking Error")
@@ -124,3 +93,44 @@ def get_context(context):
 
     frappe.flags.redirect_location = final_url
     raise frappe.Redirect
+
+
+def record_click(tracked_link_doc, visitor_id, client_ip):
+    """Record a click on a tracked link and update its counters"""
+    request_data = {
+        "ip": client_ip,
+        "user_agent": frappe.request.headers.get("User-Agent", ""),
+        "referrer": frappe.request.headers.get("Referer", ""),
+    }
+
+    click_event = create_click_event(tracked_link_doc, visitor_id, request_data)
+
+    frappe.db.sql(
+        """
+        UPDATE `tabTracked Link`
+        SET
+            click_count = IFNULL(click_count, 0) + 1,
+            last_click = %s
+        WHERE name = %s
+    """,
+        (frappe.utils.now(), tracked_link_doc.name),
+    )
+
+    if click_event and not frappe.db.exists(
+        "Click Event",
+        {
+            "tracked_link": tracked_link_doc.name,
+            "visitor_id": visitor_id,
+            "name": ["!=", click_event.name],
+        },
+    ):
+        frappe.db.sql(
+            """
+            UPDATE `tabTracked Link`
+            SET unique_visitor_count = IFNULL(unique_visitor_count, 0) + 1
+            WHERE name = %s
+        """,
+            tracked_link_doc.name,
+        )
+
+    frappe.db.commit()